@@ -0,0 +1,261 @@
+"""
+Перенос ручных правок разметки на новый экспорт GLiNER.
+
+Пример определяется хэшем своих токенов (example_id), поэтому правка находит свой пример
+в новом экспорте, даже если порядок примеров изменился. Правка хранится как разница сущностей
+между ответом LLM и исправленным примером: какие сущности человек добавил и какие удалил.
+
+При переносе на новый ответ LLM:
+- удаленные человеком сущности убираются, как и новые сущности LLM той же метки, пересекающиеся с ними;
+- добавленные человеком сущности вставляются, а пересекающиеся с ними сущности LLM убираются —
+  в этих токенах решение человека главнее.
+Пересечения ищутся по дереву интервалов (IntervalTree).
+
+Правки из журнала редактора сравниваются с примером, для которого они сделаны, поэтому diff нужно
+запускать до того, как main.py перезапишет экспорт: после этого в файле уже новые ответы LLM,
+и правки, чьих токенов на прежнем месте нет, пропускаются (AnnotationStore.edits).
+
+Запуск:
+    python annotation_merge.py diff output/gliner.jsonl --diffs output/human_edits.jsonl   # до нового экспорта
+    python annotation_merge.py apply output/gliner.jsonl --diffs output/human_edits.jsonl -o output/gliner_merged.jsonl
+"""
+import argparse
+import json
+import logging
+import os
+from collections import Counter
+
+from annotation_store import AnnotationStore, example_id
+
+try:  # необязательная зависимость: разбор JSON в несколько раз быстрее
+    from orjson import loads as _loads
+except ImportError:
+    _loads = json.loads
+
+logger = logging.getLogger(__name__)
+
+
+def _spans(ner):
+    return [(start, end, label) for start, end, label in ner]
+
+
+class IntervalTree:
+    """
+    Статическое дерево интервалов над отсортированным по началу массивом.
+
+    Узел поддерева [lo, hi) — элемент с номером (lo + hi) // 2, для каждого узла хранится
+    максимальный конец интервалов его поддерева, поэтому поиск пересечений — O(log n + k).
+    Концы интервалов включительные, как у сущностей GLiNER.
+
+    :param intervals: Итерируемое из кортежей (начало, конец, ...).
+    """
+
+    def __init__(self, intervals):
+        self.items = sorted(intervals, key=lambda item: (item[0], item[1]))
+        self._max_end = [item[1] for item in self.items]
+        self._build(0, len(self.items))
+
+    def _build(self, lo, hi):
+        if lo >= hi:
+            return -1
+        mid = (lo + hi) // 2
+        self._max_end[mid] = max(self._max_end[mid], self._build(lo, mid), self._build(mid + 1, hi))
+        return self._max_end[mid]
+
+    def overlapping(self, start, end):
+        """Интервалы, пересекающиеся с [start, end]."""
+        result = []
+        stack = [(0, len(self.items))] if self.items else []
+        while stack:
+            lo, hi = stack.pop()
+            if lo >= hi:
+                continue
+            mid = (lo + hi) // 2
+            if self._max_end[mid] < start:
+                continue
+            stack.append((lo, mid))
+            item = self.items[mid]
+            if item[0] <= end:
+                if item[1] >= start:
+                    result.append(item)
+                stack.append((mid + 1, hi))
+        return result
+
+
+def diff_spans(base_ner, edited_ner):
+    """
+    Разница сущностей между ответом LLM и исправленным примером.
+
+    :return: Словарь {'added': [...], 'removed': [...]} со списками [начало, конец, метка].
+    """
+    base, edited = Counter(_spans(base_ner)), Counter(_spans(edited_ner))
+    return {
+        'added': [list(span) for span in sorted((edited - base).elements())],
+        'removed': [list(span) for span in sorted((base - edited).elements())],
+    }
+
+
+def combine_diffs(old, new):
+    """
+    Правка поверх более ранней правки того же примера (new сделана на примере, к которому уже применена old).
+    Повторное объединение с той же правкой ничего не меняет.
+    """
+    added, removed = set(_spans(old['added'])), set(_spans(old['removed']))
+    new_added, new_removed = set(_spans(new['added'])), set(_spans(new['removed']))
+    # Удаление добавленной ранее сущности отменяет добавление, и наоборот
+    added, removed = (added - new_removed) | new_added, (removed - new_added) | new_removed
+    return {'added': [list(span) for span in sorted(added)], 'removed': [list(span) for span in sorted(removed)]}
+
+
+def apply_diff(ner, diff):
+    """
+    Применяет правку к новому списку сущностей.
+
+    :return: Пара (новый список сущностей, число убранных из-за правки сущностей LLM).
+    """
+    added = _spans(diff['added'])
+    added_set = set(added)
+    added_tree = IntervalTree(added)
+    removed_tree = IntervalTree(_spans(diff['removed']))
+    kept, dropped = [], 0
+    for span in _spans(ner):
+        start, end, label = span
+        if span in added_set:
+            continue  # LLM сама нашла сущность, добавленную человеком
+        if added_tree.overlapping(start, end) or \
+                any(other[2] == label for other in removed_tree.overlapping(start, end)):
+            dropped += 1
+        else:
+            kept.append(span)
+    return [list(span) for span in sorted(kept + added)], dropped
+
+
+def collect_diffs(pairs, diffs=None):
+    """
+    Собирает правки по парам (пример LLM, исправленный пример).
+
+    :param diffs: Уже накопленные правки {id: правка}; новая правка того же примера объединяется с ними.
+    :return: Словарь {id: правка} только для примеров, где разница не пустая.
+    """
+    diffs = {} if diffs is None else diffs
+    for base, edited in pairs:
+        diff = diff_spans(base['ner'], edited['ner'])
+        if not diff['added'] and not diff['removed']:
+            continue
+        key = example_id(edited)
+        diffs[key] = combine_diffs(diffs[key], diff) if key in diffs else diff
+    return diffs
+
+
+def load_diffs(path):
+    """Правки из JSONL-файла строками {"id", "added", "removed"}; нет файла — пустой словарь."""
+    diffs = {}
+    if os.path.exists(path):
+        with open(path, 'r', encoding='utf-8') as f:
+            for line in f:
+                if line.strip():
+                    record = json.loads(line)
+                    diffs[record['id']] = {'added': record['added'], 'removed': record['removed']}
+    return diffs
+
+
+def save_diffs(diffs, path):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        for key, diff in diffs.items():
+            f.write(json.dumps({'id': key, **diff}, ensure_ascii=False) + '\n')
+    os.replace(tmp_path, path)
+
+
+def iter_lines(path):
+    """
+    Примеры из JSONL или JSON-массива вместе с исходной строкой JSONL.
+
+    :return: Генератор пар (пример, строка в байтах без перевода строки или None для JSON-массива).
+    """
+    with open(path, 'rb') as f:
+        if not path.endswith('.jsonl'):
+            for example in json.load(f):
+                yield example, None
+            return
+        for line in f:
+            if line.strip():
+                yield _loads(line), line.rstrip(b'\r\n')
+
+
+def iter_examples(path):
+    """Примеры из JSONL или JSON-массива."""
+    return (example for example, _ in iter_lines(path))
+
+
+def merge_file(input_path, diffs, output_path):
+    """
+    Переносит правки на новый экспорт и пишет результат в JSONL.
+
+    :param diffs: Словарь {id: правка} (см. load_diffs).
+    :return: Словарь со статистикой: examples, edited, added, removed, unmatched (правки без примера).
+    """
+    stats = Counter(examples=0, edited=0, added=0, removed=0)
+    matched = set()
+    with open(output_path, 'wb') as out:
+        for example, line in iter_lines(input_path):
+            stats['examples'] += 1
+            key = example_id(example)
+            diff = diffs.get(key)
+            if diff is None and line is not None:
+                # Примеры без правок копируются как есть, без повторной сериализации
+                out.write(line + b'\n')
+                continue
+            if diff is not None:
+                example['ner'], dropped = apply_diff(example['ner'], diff)
+                labels = example.setdefault('label', [])
+                labels.extend(dict.fromkeys(label for _, _, label in diff['added'] if label not in labels))
+                matched.add(key)
+                stats['edited'] += 1
+                stats['removed'] += dropped
+                stats['added'] += len(diff['added'])
+            out.write(json.dumps(example, ensure_ascii=False).encode('utf-8') + b'\n')
+    stats['unmatched'] = len(diffs) - len(matched)
+    return dict(stats)
+
+
+def pairs_by_id(base_path, edited_path):
+    """Пары (пример LLM, исправленный пример) с одинаковыми токенами из двух файлов."""
+    edited = {example_id(example): example for example in iter_examples(edited_path)}
+    for example in iter_examples(base_path):
+        other = edited.get(example_id(example))
+        if other is not None:
+            yield example, other
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+    parser = argparse.ArgumentParser(description="Keep manual NER edits across re-exports of GLiNER examples.")
+    commands = parser.add_subparsers(dest='command', required=True)
+    diff_parser = commands.add_parser('diff', help="Record the edits made to an export; run it before re-exporting to that path.")
+    diff_parser.add_argument('base', help="Export the edits were made on (JSONL or JSON).")
+    diff_parser.add_argument('--edited', help="Edited examples; by default the editor journal of BASE is used.")
+    diff_parser.add_argument('--journal', help="Editor journal (default: <base>.edits.jsonl).")
+    diff_parser.add_argument('--diffs', default='output/human_edits.jsonl', help="File with the recorded edits, updated in place.")
+    apply_parser = commands.add_parser('apply', help="Re-apply the recorded edits to a new export.")
+    apply_parser.add_argument('input', help="New export (JSONL or JSON).")
+    apply_parser.add_argument('--diffs', default='output/human_edits.jsonl', help="File with the recorded edits.")
+    apply_parser.add_argument('-o', '--output', required=True, help="Merged examples, JSONL.")
+    args = parser.parse_args()
+
+    diffs = load_diffs(args.diffs)
+    if args.command == 'diff':
+        if args.edited:
+            pairs = pairs_by_id(args.base, args.edited)
+        else:
+            pairs = ((base, edited) for _, base, edited in AnnotationStore(args.base, args.journal).edits())
+        before = len(diffs)
+        collect_diffs(pairs, diffs)
+        save_diffs(diffs, args.diffs)
+        logger.info(f"{len(diffs)} edited examples in {args.diffs} ({len(diffs) - before} new)")
+    else:
+        stats = merge_file(args.input, diffs, args.output)
+        logger.info(
+            f"{stats['edited']} of {stats['examples']} examples edited: {stats['added']} entities added, "
+            f"{stats['removed']} LLM entities removed; {stats['unmatched']} edits found no example"
+        )
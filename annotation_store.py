@@ -0,0 +1,235 @@
+import copy
+import hashlib
+import json
+import logging
+import os
+from collections import Counter, OrderedDict
+
+# Версия формата файла индекса; при изменении формата индекс перестраивается
+INDEX_VERSION = 1
+
+logger = logging.getLogger(__name__)
+
+
+def example_id(example):
+    """Стабильный id примера: SHA-256 от его токенов (не зависит от форматирования файла)."""
+    return hashlib.sha256('\x1f'.join(example['tokenized_text']).encode('utf-8')).hexdigest()
+
+
+class AnnotationStore:
+    """
+    Примеры GLiNER для редактора разметки с загрузкой по требованию.
+
+    JSONL-файл не читается целиком: при открытии строится индекс смещений строк (и счетчик меток),
+    который сохраняется рядом в {path}.index и перестраивается только при изменении файла.
+    Пример читается с диска при обращении, последние cache_size примеров держатся в LRU.
+
+    Исходный файл не переписывается. Правки копятся в памяти и при save() дописываются в журнал
+    {path}.edits.jsonl строками {"index": номер, "id": example_id, "base": [размер, mtime_ns файла],
+    "example": пример}; при открытии журнал применяется поверх файла (побеждает последняя запись).
+    Если файл с тех пор переписан (новый экспорт), запись применяется, только если на ее месте
+    пример с теми же токенами; остальные пропускаются (их число — stale). Слить файл с журналом — export().
+
+    Обычный JSON-массив (старый output/gliner.json) тоже открывается, но читается в память целиком.
+
+    :param path: Файл примеров (.jsonl или .json).
+    :param journal_path: Журнал правок, по умолчанию {path}.edits.jsonl.
+    :param cache_size: Сколько прочитанных примеров держать в памяти.
+    """
+
+    def __init__(self, path, journal_path=None, cache_size=256):
+        self.path = path
+        self.journal_path = journal_path or f"{path}.edits.jsonl"
+        self.cache_size = cache_size
+        self._cache = OrderedDict()
+        self._dirty = {}
+        self._edits = {}  # номер примера -> смещение последней правки в журнале
+        self._examples = None
+        self.stale = 0  # записи журнала, сделанные для другой версии файла и пропущенные
+        stat = os.stat(path)
+        self._fingerprint = [stat.st_size, stat.st_mtime_ns]
+        if path.endswith('.jsonl'):
+            self._offsets, self._labels = self._load_index()
+        else:
+            with open(path, 'r', encoding='utf-8') as f:
+                self._examples = json.load(f)
+            self._offsets = None
+            self._labels = Counter(label for example in self._examples for label in set(example.get('label', [])))
+        self._file = open(path, 'rb') if self._examples is None else None
+        self._replay_journal()
+
+    def close(self):
+        if self._file:
+            self._file.close()
+            self._file = None
+
+    def __len__(self):
+        return len(self._examples) if self._examples is not None else len(self._offsets)
+
+    def __getitem__(self, index):
+        """Копия примера: изменения не видны хранилищу до update()."""
+        return copy.deepcopy(self._get(index))
+
+    def labels(self):
+        """Метки, которые встречаются хотя бы в одном примере, по алфавиту."""
+        return sorted(label for label, count in self._labels.items() if count > 0)
+
+    def update(self, index, example):
+        """
+        Заменяет пример (на диск попадет при save()) и обновляет счетчик меток.
+
+        :return: Множество меток, которых до этой правки не было ни в одном примере.
+        """
+        old = set(self._get(index).get('label', []))
+        new = set(example.get('label', []))
+        added = {label for label in new - old if self._labels[label] <= 0}
+        self._labels.subtract(old)
+        self._labels.update(new)
+        self._dirty[index] = copy.deepcopy(example)
+        self._cache.pop(index, None)
+        return added
+
+    @property
+    def unsaved(self):
+        """Число правок, еще не записанных в журнал."""
+        return len(self._dirty)
+
+    def save(self):
+        """
+        Дописывает в журнал примеры, измененные после прошлого сохранения.
+
+        :return: Число записанных примеров.
+        """
+        if not self._dirty:
+            return 0
+        with open(self.journal_path, 'ab') as f:
+            for index, example in sorted(self._dirty.items()):
+                self._edits[index] = f.tell()
+                record = {"index": index, "id": example_id(example), "base": self._fingerprint, "example": example}
+                line = json.dumps(record, ensure_ascii=False)
+                f.write(line.encode('utf-8') + b'\n')
+            f.flush()
+            os.fsync(f.fileno())
+        count = len(self._dirty)
+        self._dirty.clear()
+        return count
+
+    def edits(self):
+        """
+        Сохраненные в журнале правки (для annotation_merge) с теми же токенами, что у примера в файле.
+
+        :return: Генератор троек (номер, пример из исходного файла, исправленный пример).
+        """
+        for index in sorted(self._edits):
+            base = self._examples[index] if self._examples is not None else self._read_base(index)
+            edited = self._read_edit(self._edits[index])
+            if example_id(base) == example_id(edited):
+                yield index, base, edited
+
+    def export(self, output_path):
+        """
+        Записывает все примеры с учетом правок в JSONL-файл (построчно, без загрузки всего набора).
+
+        :return: Число записанных примеров.
+        """
+        with open(output_path, 'wb') as out:
+            for index in range(len(self)):
+                if index in self._dirty or index in self._edits or self._examples is not None:
+                    out.write(json.dumps(self._get(index), ensure_ascii=False).encode('utf-8') + b'\n')
+                else:
+                    # Неизмененные строки копируются как есть, без разбора JSON
+                    self._file.seek(self._offsets[index])
+                    out.write(self._file.readline().rstrip(b'\r\n') + b'\n')
+        return len(self)
+
+    def _get(self, index):
+        if not 0 <= index < len(self):
+            raise IndexError(index)
+        if index in self._dirty:
+            return self._dirty[index]
+        if index in self._cache:
+            self._cache.move_to_end(index)
+            return self._cache[index]
+        if index in self._edits:
+            example = self._read_edit(self._edits[index])
+        elif self._examples is not None:
+            return self._examples[index]
+        else:
+            example = self._read_base(index)
+        self._cache[index] = example
+        if len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+        return example
+
+    def _read_base(self, index):
+        self._file.seek(self._offsets[index])
+        return json.loads(self._file.readline())
+
+    def _read_edit(self, offset):
+        with open(self.journal_path, 'rb') as f:
+            f.seek(offset)
+            return json.loads(f.readline())['example']
+
+    def _load_index(self):
+        """Смещения строк и счетчик меток из {path}.index или, если файл изменился, новым проходом по файлу."""
+        stat = os.stat(self.path)
+        index_path = f"{self.path}.index"
+        try:
+            with open(index_path, 'r', encoding='utf-8') as f:
+                index = json.load(f)
+            if (index.get('version'), index.get('size'), index.get('mtime_ns')) == \
+                    (INDEX_VERSION, stat.st_size, stat.st_mtime_ns):
+                return index['offsets'], Counter(index['labels'])
+        except (OSError, ValueError):
+            pass
+
+        offsets, labels = [], Counter()
+        with open(self.path, 'rb') as f:
+            offset = 0
+            for line in f:
+                if line.strip():
+                    offsets.append(offset)
+                    labels.update(set(json.loads(line).get('label', [])))
+                offset += len(line)
+        try:
+            with open(index_path, 'w', encoding='utf-8') as f:
+                json.dump({'version': INDEX_VERSION, 'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns,
+                           'offsets': offsets, 'labels': labels}, f, ensure_ascii=False)
+        except OSError:
+            pass  # индекс — только ускорение следующего открытия
+        return offsets, labels
+
+    def _matches(self, record):
+        """Запись журнала сделана для этой версии файла или на ее месте пример с теми же токенами."""
+        index = record['index']
+        if not 0 <= index < len(self):
+            return False
+        if record.get('base') == self._fingerprint or 'id' not in record:
+            return True
+        base = self._examples[index] if self._examples is not None else self._read_base(index)
+        return example_id(base) == record['id']
+
+    def _replay_journal(self):
+        if not os.path.exists(self.journal_path):
+            return
+        with open(self.journal_path, 'r+b') as f:
+            offset = 0
+            for line in f:
+                if not line.endswith(b'\n'):
+                    # Недописанная строка после сбоя во время save: отрезаем, чтобы следующие правки легли с новой строки
+                    f.truncate(offset)
+                    break
+                if line.strip():
+                    record = json.loads(line)
+                    if self._matches(record):
+                        self._edits[record['index']] = offset
+                    else:
+                        self.stale += 1
+                offset += len(line)
+        if self.stale:
+            logger.warning(f"Skipped {self.stale} edit(s) from {self.journal_path}: {self.path} was rewritten "
+                           f"since and has other examples at their positions")
+        for index, edit_offset in self._edits.items():
+            base = self._examples[index] if self._examples is not None else self._read_base(index)
+            self._labels.subtract(set(base.get('label', [])))
+            self._labels.update(set(self._read_edit(edit_offset).get('label', [])))
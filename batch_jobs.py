@@ -0,0 +1,292 @@
+import json
+import logging
+import os
+import time
+import uuid
+from datetime import datetime
+
+from fill_engine import is_empty, parse_score
+from providers.usage import track_stage
+
+logger = logging.getLogger(__name__)
+
+ENDPOINT = '/v1/chat/completions'
+# Лимиты Batch API на один входной файл
+MAX_REQUESTS = 50000
+MAX_BYTES = 190 * 1024 * 1024
+
+TERMINAL = ('completed', 'failed', 'expired', 'cancelled')
+
+# Стадия в custom_id -> (стадия провайдера, колонка с текстом запроса)
+STAGES = {
+    'rate': ('rate', 'full text'),
+    'summarize': ('summarize', 'full text'),
+    'annotate': ('annotate', 'full text'),
+    'annotate_summary': ('annotate', 'summary'),
+}
+
+
+def stage_values(stage, content):
+    """Переводит ответ модели на запрос стадии в значения колонок таблицы."""
+    if stage == 'rate':
+        return parse_score(content)
+    if stage == 'summarize':
+        return {'summary': content}
+    if stage == 'annotate':
+        return {'LLM json': content}
+    return {'LLM summary json': content}
+
+
+def strict_schema(schema):
+    """JSON Schema в строгом виде Structured Outputs: у каждого объекта все поля обязательны, лишние запрещены."""
+    if isinstance(schema, list):
+        return [strict_schema(value) for value in schema]
+    if not isinstance(schema, dict):
+        return schema
+    schema = {key: strict_schema(value) for key, value in schema.items()}
+    if schema.get('type') == 'object' and 'properties' in schema:
+        schema['additionalProperties'] = False
+        schema['required'] = list(schema['properties'])
+    return schema
+
+
+def batch_body(request):
+    """Тело запроса для файла Batch API: Pydantic-схема response_format заменяется строгой JSON Schema, как это делает parse()."""
+    body = dict(request)
+    model = body.get('response_format')
+    if hasattr(model, 'model_json_schema'):
+        body['response_format'] = {
+            'type': 'json_schema',
+            'json_schema': {'name': model.__name__, 'schema': strict_schema(model.model_json_schema()), 'strict': True},
+        }
+    return body
+
+
+def pending_requests(store, provider):
+    """
+    Запросы всех незаполненных стадий хранилища.
+
+    Разметка краткого содержания попадает сюда только для строк, у которых краткое содержание
+    уже есть, поэтому для остальных строк она уходит следующей партией, после разбора этой.
+
+    :return: Генератор пар (custom_id "<id строки>:<стадия>", тело запроса).
+    """
+    for key, row in store.pending():
+        stages = []
+        if is_empty(row.get('score_reason')):
+            stages.append('rate')
+        if is_empty(row.get('summary')):
+            stages.append('summarize')
+        elif is_empty(row.get('LLM summary json')):
+            stages.append('annotate_summary')
+        if is_empty(row.get('LLM json')):
+            stages.append('annotate')
+        for stage in stages:
+            provider_stage, column = STAGES[stage]
+            yield f"{key}:{stage}", batch_body(provider.stage_request(provider_stage, row[column]))
+
+
+class BatchJob:
+    """
+    Заполнение таблицы через OpenAI Batch API, без интерактивных запросов.
+
+    Незаполненные стадии пишутся в JSONL-файлы (custom_id — "<id строки>:<стадия>"), файлы
+    загружаются и ставятся в пакетные задания, задания опрашиваются до завершения, а ответы
+    записываются в хранилище. Разметка кратких содержаний идет второй партией. Состояние
+    (загруженные файлы, id заданий, что уже разобрано) сохраняется в state_path после каждого шага,
+    поэтому перезапущенный процесс продолжает ждать уже отправленные задания, а не создает новые.
+
+    :param provider: Провайдер с клиентом OpenAI (provider.client) и stage_request: openai или structured_openai.
+    :param store: ResultStore.
+    :param state_path: Файл состояния.
+    :param work_dir: Папка для входных JSONL-файлов.
+    :param poll_interval: Пауза между опросами статуса задания, секунды.
+    :param model_name: Значение для колонки 'model' (по умолчанию модель провайдера).
+    """
+
+    def __init__(self, provider, store, state_path='batch_state.json', work_dir='batch_jobs',
+                 poll_interval=30, model_name=None, max_requests=MAX_REQUESTS, max_bytes=MAX_BYTES):
+        self.provider = provider
+        self.client = getattr(provider, 'client', None)
+        if self.client is None:
+            raise NotImplementedError(
+                f"{type(provider).__name__} has no OpenAI client; batch jobs need the openai or structured_openai provider")
+        self.store = store
+        self.state_path = state_path
+        self.work_dir = work_dir
+        self.poll_interval = poll_interval
+        self.model_name = model_name or getattr(provider, 'model', None)
+        self.max_requests = max_requests
+        self.max_bytes = max_bytes
+        self.state = self._load_state()
+
+    def _load_state(self):
+        if os.path.exists(self.state_path):
+            with open(self.state_path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        return {'batches': []}
+
+    def _save_state(self):
+        with open(self.state_path + '.tmp', 'w', encoding='utf-8') as f:
+            json.dump(self.state, f, ensure_ascii=False, indent=2)
+        os.replace(self.state_path + '.tmp', self.state_path)
+
+    def run(self):
+        """
+        Отправляет, ждет и разбирает партии, пока в таблице есть незаполненные стадии.
+
+        :return: Словарь со счетчиками: batches, succeeded, failed.
+        :raises RuntimeError: Если партия не принесла ни одного успешного ответа.
+        """
+        stats = {'batches': 0, 'succeeded': 0, 'failed': 0}
+        while True:
+            active = [batch for batch in self.state['batches'] if not batch.get('ingested')]
+            if active:
+                logger.info(f"Resuming {len(active)} unfinished batch(es)")
+            else:
+                active = self.prepare()
+                if not active:
+                    break
+            succeeded = 0
+            for batch in active:
+                self.submit(batch)
+                self.wait(batch)
+                ok, failed = self.ingest(batch)
+                succeeded += ok
+                stats['failed'] += failed
+                stats['batches'] += 1
+            stats['succeeded'] += succeeded
+            self.finish_rows()
+            if not succeeded:
+                raise RuntimeError(f"Batch round produced no results, see {self.state_path} and the error files")
+        return stats
+
+    def prepare(self):
+        """Пишет запросы незаполненных стадий во входные файлы и регистрирует их в состоянии."""
+        os.makedirs(self.work_dir, exist_ok=True)
+        batches = []
+        out = None
+        try:
+            for custom_id, body in pending_requests(self.store, self.provider):
+                line = json.dumps({'custom_id': custom_id, 'method': 'POST', 'url': ENDPOINT, 'body': body},
+                                  ensure_ascii=False) + '\n'
+                size = len(line.encode('utf-8'))
+                batch = batches[-1] if batches else None
+                if batch is None or batch['requests'] >= self.max_requests or batch['bytes'] + size > self.max_bytes:
+                    if out:
+                        out.close()
+                    local_id = uuid.uuid4().hex
+                    batch = {'local_id': local_id, 'input_path': os.path.join(self.work_dir, f'batch-{local_id}.jsonl'),
+                             'requests': 0, 'bytes': 0}
+                    batches.append(batch)
+                    out = open(batch['input_path'], 'w', encoding='utf-8')
+                out.write(line)
+                batch['requests'] += 1
+                batch['bytes'] += size
+        finally:
+            if out:
+                out.close()
+        if batches:
+            self.state['batches'].extend(batches)
+            self._save_state()
+            logger.info(f"Prepared {sum(b['requests'] for b in batches)} requests in {len(batches)} batch file(s)")
+        return batches
+
+    def submit(self, batch):
+        """Загружает входной файл и создает задание (каждый шаг — один раз, даже после перезапуска)."""
+        if batch.get('batch_id'):
+            return
+        if not batch.get('input_file_id'):
+            with open(batch['input_path'], 'rb') as f:
+                batch['input_file_id'] = self.client.files.create(file=f, purpose='batch').id
+            self._save_state()
+        # Процесс мог упасть между созданием задания и сохранением его id: ищем задание по метке
+        remote = self._find_remote(batch['local_id']) if batch.get('creating') else None
+        if remote is None:
+            batch['creating'] = True
+            self._save_state()
+            remote = self.client.batches.create(
+                input_file_id=batch['input_file_id'],
+                endpoint=ENDPOINT,
+                completion_window='24h',
+                metadata={'local_id': batch['local_id']},
+            )
+        batch['batch_id'] = remote.id
+        batch['status'] = remote.status
+        self._save_state()
+        logger.info(f"Submitted batch {remote.id} with {batch['requests']} requests")
+
+    def _find_remote(self, local_id):
+        # Задание создано только что, поэтому достаточно первой страницы списка
+        for remote in self.client.batches.list(limit=100).data:
+            if (remote.metadata or {}).get('local_id') == local_id:
+                return remote
+        return None
+
+    def wait(self, batch):
+        """Опрашивает задание, пока оно не завершится."""
+        while True:
+            remote = self.client.batches.retrieve(batch['batch_id'])
+            if remote.status != batch.get('status'):
+                counts = remote.request_counts
+                logger.info(f"Batch {remote.id}: {remote.status}"
+                            + (f" ({counts.completed}/{counts.total} done, {counts.failed} failed)" if counts else ""))
+            batch['status'] = remote.status
+            batch['output_file_id'] = remote.output_file_id
+            batch['error_file_id'] = remote.error_file_id
+            self._save_state()
+            if remote.status in TERMINAL:
+                return
+            time.sleep(self.poll_interval)
+
+    def ingest(self, batch):
+        """
+        Записывает ответы задания в хранилище. Повторный разбор безопасен: те же значения пишутся еще раз.
+
+        :return: Пара (успешных ответов, неуспешных запросов).
+        """
+        succeeded = failed = 0
+        # У истекших и отмененных заданий тоже может быть файл с частью ответов
+        if batch.get('output_file_id'):
+            for line in self.client.files.content(batch['output_file_id']).text.splitlines():
+                if not line.strip():
+                    continue
+                result = json.loads(line)
+                key, stage = result['custom_id'].rsplit(':', 1)
+                response = result.get('response') or {}
+                if result.get('error') or response.get('status_code') != 200:
+                    logger.error(f"Request {result['custom_id']} failed: {result.get('error') or response.get('body')}")
+                    failed += 1
+                    continue
+                # Имена стадий в usage — как у FillEngine ('annotate summary')
+                with track_stage(stage.replace('_', ' ')) as usage:
+                    self.provider.record_usage(response['body'].get('usage'))
+                self.store.add_usage(int(key), {stage.replace('_', ' '): usage})
+                try:
+                    values = stage_values(stage, response['body']['choices'][0]['message']['content'])
+                except Exception as e:
+                    logger.error(f"Could not parse the answer to {result['custom_id']}: {e}")
+                    failed += 1
+                    continue
+                self.store.update(int(key), values)
+                succeeded += 1
+        if batch.get('error_file_id'):
+            for line in self.client.files.content(batch['error_file_id']).text.splitlines():
+                if line.strip():
+                    result = json.loads(line)
+                    logger.error(f"Request {result.get('custom_id')} failed: {result.get('error') or result.get('response')}")
+                    failed += 1
+        batch['ingested'] = True
+        self._save_state()
+        logger.info(f"Batch {batch['batch_id']} ({batch['status']}): {succeeded} answers saved, {failed} failed")
+        return succeeded, failed
+
+    def finish_rows(self):
+        """Проставляет model и time строкам, у которых готовы все стадии (как FillEngine)."""
+        now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        done = [
+            key for key, row in self.store.pending()
+            if not any(is_empty(row.get(column)) for column in ('score_reason', 'summary', 'LLM json', 'LLM summary json'))
+        ]
+        for key in done:
+            self.store.update(key, {'model': self.model_name, 'time': now})
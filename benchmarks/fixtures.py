@@ -0,0 +1,136 @@
+"""
+Входные данные бенчмарков: ответы LLM в формате {"text": ..., "entities": [...]}.
+
+Синтетические ответы строятся детерминированно (random.Random(seed)) под заданное число токенов
+и сущностей, реальные — из закрепленной выборки benchmarks/texts_sample.json (ответы 'LLM json'
+из texts.csv), склеенные до нужного размера. Результаты теперь хранятся в texts.sqlite,
+а texts.csv — старая таблица в репозитории, которую заменяет каждая выгрузка main.py --export-csv.
+Поэтому бенчмарк читает копию: иначе результаты нельзя было бы сравнивать с базовой линией.
+Обновить выборку: python -m benchmarks.fixtures (после этого базовую линию нужно пересохранить).
+"""
+import csv
+import json
+import os
+import random
+
+from parse_LLM_output import tokenize_text
+
+TEXTS_CSV = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'texts.csv')
+TEXTS_SAMPLE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'texts_sample.json')
+
+_SYLLABLES = ['ка', 'ро', 'ми', 'на', 'то', 'ве', 'ль', 'ст', 'ор', 'ан', 'ск', 'ий', 'ов', 'ен', 'ди', 'за']
+_PUNCTUATION = [',', '.', '«', '»', '—', '(', ')', ':', '№']
+_TYPES = ['Лицо', 'Организация', 'Место', 'Дата', 'Документ', 'Сумма', 'Событие', 'Продукт']
+
+
+def _word(rng):
+    return ''.join(rng.choice(_SYLLABLES) for _ in range(rng.randint(1, 4)))
+
+
+def synthetic_answer(n_tokens, n_entities, seed=0):
+    """
+    Синтетический ответ LLM: текст примерно из n_tokens токенов и n_entities различных сущностей
+    длиной от 1 до 3 слов, каждая из которых встречается в тексте.
+
+    :return: JSON-строка ответа.
+    """
+    rng = random.Random(seed)
+    entities = {}
+    while len(entities) < n_entities:
+        name = ' '.join(_word(rng).capitalize() for _ in range(rng.randint(1, 3)))
+        entities[name] = rng.sample(_TYPES, rng.randint(1, 2))
+    names = list(entities)
+    parts = []
+    tokens = 0
+    while tokens < n_tokens:
+        if names and rng.random() < 0.08:
+            part = rng.choice(names)
+        elif rng.random() < 0.12:
+            part = rng.choice(_PUNCTUATION)
+        else:
+            part = _word(rng)
+        parts.append(part)
+        tokens += part.count(' ') + 1
+    # Каждая сущность встречается хотя бы раз
+    for name in names:
+        parts.insert(rng.randrange(len(parts) + 1), name)
+    return json.dumps({
+        "text": ' '.join(parts),
+        "entities": [{"entity": name, "types": types} for name, types in entities.items()],
+    }, ensure_ascii=False)
+
+
+def real_answers(path=TEXTS_CSV):
+    """Разбираемые ответы 'LLM json' из texts.csv (пустой список, если файла нет)."""
+    if not os.path.exists(path):
+        return []
+    answers = []
+    with open(path, 'r', encoding='utf-8', newline='') as f:
+        for row in csv.DictReader(f):
+            answer = (row.get('LLM json') or '').replace('```json', '').replace('```', '').strip()
+            try:
+                js = json.loads(answer)
+            except ValueError:
+                continue
+            if js.get('text') and js.get('entities') is not None:
+                answers.append(js)
+    return answers
+
+
+def sample_answers(path=TEXTS_SAMPLE):
+    """Закрепленная выборка ответов (пустой список, если файла нет)."""
+    if not os.path.exists(path):
+        return []
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def real_answer(answers, copies):
+    """
+    Реальный ответ большего размера: тексты ответов подряд, повторенные copies раз, и объединение их сущностей.
+
+    :return: JSON-строка ответа.
+    """
+    texts, entities = [], {}
+    for _ in range(copies):
+        for js in answers:
+            texts.append(js['text'])
+            for entity in js['entities']:
+                entities.setdefault(str(entity['entity']), entity['types'])
+    return json.dumps({
+        "text": '\n'.join(texts),
+        "entities": [{"entity": name, "types": types} for name, types in entities.items()],
+    }, ensure_ascii=False)
+
+
+def fixtures(quick=False):
+    """
+    Наборы входных данных.
+
+    :param quick: Только маленькие размеры (для быстрой проверки).
+    :return: Список словарей {'name', 'group', 'answer', 'tokens', 'entities'}; group — кривая масштабирования.
+    """
+    result = []
+
+    def add(name, group, answer):
+        js = json.loads(answer)
+        result.append({'name': name, 'group': group, 'answer': answer,
+                       'tokens': len(tokenize_text(js['text'])), 'entities': len(js['entities'])})
+
+    lengths = [500, 2000, 8000] if quick else [500, 2000, 8000, 32000]
+    for n_tokens in lengths:
+        add(f'synthetic-{n_tokens}t', 'synthetic length', synthetic_answer(n_tokens, n_tokens // 40, seed=n_tokens))
+    for n_entities in ([10, 100] if quick else [10, 100, 1000]):
+        add(f'synthetic-{n_entities}e', 'synthetic entities', synthetic_answer(4000, n_entities, seed=n_entities))
+    answers = sample_answers()
+    if answers:
+        for copies in ([1, 4] if quick else [1, 4, 16]):
+            add(f'sample-x{copies}', 'texts sample', real_answer(answers, copies))
+    return result
+
+
+if __name__ == '__main__':
+    answers = real_answers()
+    with open(TEXTS_SAMPLE, 'w', encoding='utf-8') as f:
+        json.dump(answers, f, ensure_ascii=False, indent=1)
+    print(f"Saved {len(answers)} answers from {TEXTS_CSV} to {TEXTS_SAMPLE}")
@@ -0,0 +1,261 @@
+"""
+Нагрузочный прогон всего конвейера против локальной заглушки LLM (mock_server.py).
+
+Заглушка запускается в этом же процессе на свободном порту с заданными задержкой, долей ошибок 500
+и ответов 429, провайдер ходит в нее по HTTP, как в настоящий API. Прогон повторяет шаги main.py:
+тексты добавляются во временное хранилище (ingest), строки заполняются FillEngine (fill),
+затем выгружаются примеры GLiNER и CSV (export).
+
+В отчете:
+- строки в секунду по каждому шагу и от начала до конца;
+- перцентили времени строки в FillEngine (от постановки в очередь до последней стадии),
+  ответа заглушки и записи результата в хранилище;
+- глубина очередей по ходу fill: строки в работе и запросы в обработке у заглушки (среднее и максимум);
+- счетчики заглушки, состояние RateLimiter и usage по стадиям.
+
+Заглушка в том же процессе делит GIL с клиентом, поэтому на коротких задержках время запросов завышено.
+Чтобы измерить только клиента, заглушку можно запустить отдельно и передать ее адрес в --base-url
+(параметры задержки и ошибок тогда задаются при запуске mock_server.py).
+
+Запуск из корня репозитория:
+    python -m benchmarks.pipeline --rows 500 --workers 16 --latency 0.2 --latency-sigma 0.5 --error-rate 0.02
+    python mock_server.py --port 8000 --latency 0.2 & python -m benchmarks.pipeline --base-url http://127.0.0.1:8000/v1
+"""
+import argparse
+import json
+import os
+import tempfile
+import threading
+import time
+import urllib.request
+
+import mock_server
+from benchmarks.fixtures import real_answers, synthetic_answer
+from export import export_examples
+from fill_engine import FillEngine
+from providers import get_provider
+from providers.usage import tracker
+from result_store import ResultStore
+
+# Как часто записывается глубина очередей, секунды
+SAMPLE_INTERVAL = 0.05
+
+# Сколько раз fill повторяется после ошибок стадий, прежде чем прогон сдается
+MAX_FILL_PASSES = 5
+
+
+def make_texts(rows, tokens=300, source='synthetic'):
+    """
+    Тексты для ingest: синтетические (со словами с заглавной буквы, чтобы разметка находила сущности)
+    или full text из texts.csv, повторенные до нужного числа строк. Все тексты различны.
+    """
+    if source == 'texts.csv':
+        base = [js['text'] for js in real_answers()]
+        if not base:
+            raise SystemExit("texts.csv has no parsable answers, use --texts synthetic")
+        return [f"{base[i % len(base)]}\n#{i}" for i in range(rows)]
+    return [json.loads(synthetic_answer(tokens, max(1, tokens // 40), seed=i))['text'] for i in range(rows)]
+
+
+class QueueSampler(threading.Thread):
+    """Фоновый поток, который периодически записывает глубину очередей."""
+
+    def __init__(self, depths, interval=SAMPLE_INTERVAL):
+        super().__init__(daemon=True)
+        self.depths = depths
+        self.interval = interval
+        self.samples = {name: [] for name in depths}
+        self._done = threading.Event()
+
+    def run(self):
+        while not self._done.wait(self.interval):
+            for name, depth in self.depths.items():
+                self.samples[name].append(depth())
+
+    def stop(self):
+        self._done.set()
+        self.join()
+
+    def summary(self):
+        return {name: {'mean': sum(values) / len(values) if values else 0.0, 'max': max(values, default=0)}
+                for name, values in self.samples.items()}
+
+
+def fill(store, provider, workers, batch_size, state):
+    """
+    Заполняет строки хранилища, как main.fill_table (с повтором после ошибок стадий, но не больше MAX_FILL_PASSES раз).
+
+    :param state: MockState заглушки, для глубины ее очереди (None — заглушка в другом процессе).
+    :return: Словарь с перцентилями времени строк и записи в хранилище, глубиной очередей,
+             числом повторов и числом так и не заполненных строк.
+    """
+    started, row_times, write_times = {}, [], []
+
+    def on_result(row_id, values):
+        write_started = time.perf_counter()
+        store.update(row_id, values)
+        write_times.append(time.perf_counter() - write_started)
+
+    def on_row_done(row_id):
+        row_times.append(time.perf_counter() - started.pop(row_id))
+
+    def timed(rows):
+        for row_id, row in rows:
+            started[row_id] = time.perf_counter()
+            yield row_id, row
+
+    depths = {'rows in flight': lambda: len(started)}
+    if state is not None:
+        depths['mock in flight'] = lambda: state.in_flight
+    sampler = QueueSampler(depths)
+    sampler.start()
+    retries = 0
+    try:
+        for _ in range(MAX_FILL_PASSES):
+            engine = FillEngine(
+                provider,
+                on_result=on_result,
+                on_row_done=on_row_done,
+                max_in_flight=workers,
+                model_name=provider.model,
+                batch_size=batch_size,
+                on_usage=lambda row_id, stage, usage: store.add_usage(row_id, {stage: usage}),
+            )
+            try:
+                engine.run(timed(store.pending()))
+                break
+            except RuntimeError as e:
+                # Строки с упавшими стадиями остались незаполненными — следующий проход их доделает
+                retries += 1
+                started.clear()
+                print(f"Fill pass failed, retrying: {e}")
+    finally:
+        sampler.stop()
+    return {'row_latency': mock_server.percentiles(row_times), 'store_write': mock_server.percentiles(write_times),
+            'store_write_total': sum(write_times), 'queues': sampler.summary(), 'retries': retries,
+            'unfilled': sum(1 for _ in store.pending())}
+
+
+def run(rows=200, workers=8, batch_size=1, texts='synthetic', tokens=300,
+        client_rpm=None, base_url=None, **mock_options):
+    """
+    Запускает заглушку и прогоняет через нее ingest -> fill -> export с провайдером structured_openai
+    (ответы заглушки строятся по схеме response_format).
+
+    :param client_rpm: Лимит запросов в минуту на стороне клиента (RateLimiter провайдера).
+    :param base_url: Адрес уже запущенной заглушки (None — запустить ее в этом процессе).
+    :param mock_options: Параметры mock_server.MockState (latency, latency_sigma, error_rate, rate_limit_rate, rpm, seed).
+    :return: Словарь с результатами прогона.
+    """
+    server = state = None
+    if base_url is None:
+        server = mock_server.serve(port=0, **mock_options)
+        state = server.RequestHandlerClass.state
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        host, port = server.server_address[:2]
+        base_url = f'http://{host}:{port}/v1'
+    os.environ.update({'MODEL': 'mock-model', 'BASE_URL': base_url, 'OPENAI_API_KEY': 'mock'})
+
+    provider = get_provider('structured_openai')
+    provider.batch_size = batch_size
+    if provider.limiter:
+        provider.limiter.configure(rpm=client_rpm)
+    input_texts = make_texts(rows, tokens, texts)
+    result = {'rows': rows, 'workers': workers, 'batch_size': batch_size}
+    try:
+        with tempfile.TemporaryDirectory() as work_dir:
+            store = ResultStore(os.path.join(work_dir, 'bench.sqlite'))
+            total_started = time.perf_counter()
+
+            started = time.perf_counter()
+            store.add_texts(input_texts)
+            result['ingest_s'] = time.perf_counter() - started
+
+            started = time.perf_counter()
+            result.update(fill(store, provider, workers, batch_size, state))
+            result['fill_s'] = time.perf_counter() - started
+
+            started = time.perf_counter()
+            rows_iter = ((row_id, row['LLM json'], row['LLM summary json'])
+                         for row_id, row in store.iter_rows(complete=True))
+            result['export'] = export_examples(rows_iter, os.path.join(work_dir, 'gliner.jsonl'), workers=1)
+            result['export_s'] = time.perf_counter() - started
+
+            started = time.perf_counter()
+            store.export_csv(os.path.join(work_dir, 'texts.csv'))
+            result['csv_s'] = time.perf_counter() - started
+
+            result['total_s'] = time.perf_counter() - total_started
+            store.close()
+        if state is None:
+            with urllib.request.urlopen(f"{base_url.rstrip('/')}/mock/stats") as response:
+                result['mock'] = json.load(response)
+        else:
+            result['mock'] = state.stats()
+    finally:
+        if server:
+            server.shutdown()
+            server.server_close()
+    result['limiter'] = provider.limiter.metrics() if provider.limiter else None
+    result['usage'] = tracker.summary()
+    return result
+
+
+def _ms(latency):
+    return '  '.join(f"{name} {value * 1000:,.1f}" for name, value in latency.items())
+
+
+def print_report(result):
+    rows = result['rows']
+    print(f"{rows} rows, {result['workers']} workers, batch size {result['batch_size']}")
+    print(f"{'step':<10}{'seconds':>10}{'rows/s':>12}")
+    for step in ('ingest', 'fill', 'export', 'csv', 'total'):
+        seconds = result[f'{step}_s']
+        print(f"{step:<10}{seconds:>10.2f}{rows / seconds if seconds else 0:>12,.1f}")
+    print(f"\nLatency, ms:\n  row in fill   {_ms(result['row_latency'])}")
+    print(f"  mock answer   {_ms(result['mock']['latency'])}")
+    print(f"  store write   {_ms(result['store_write'])}  (total {result['store_write_total']:.2f}s)")
+    print("\nQueue depth:")
+    for name, depth in result['queues'].items():
+        print(f"  {name:<16} mean {depth['mean']:.1f}, max {depth['max']}")
+    mock = result['mock']
+    print(f"\nMock: {mock['requests']} requests, {mock['ok']} ok, {mock['server_errors']} server errors, "
+          f"{mock['rate_limited']} rate limited, max {mock['max_in_flight']} in flight; fill retries: {result['retries']}, "
+          f"rows left unfilled: {result['unfilled']}")
+    export = result['export']
+    print(f"Export: {export['rows']} rows, {export['examples']} examples, {export['errors']} parse errors")
+    if result['limiter']:
+        print(f"Rate limiter: {result['limiter']}")
+    for usage in result['usage']:
+        print(f"Usage {usage['model']} / {usage['stage']}: {usage['calls']:.0f} calls, "
+              f"{usage['prompt_tokens']} prompt tokens, {usage['avg_latency'] * 1000:.0f} ms per call")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Load-test ingest -> fill -> export against the local mock LLM server.")
+    parser.add_argument('--rows', type=int, default=200, help="Number of texts to ingest.")
+    parser.add_argument('--texts', choices=('synthetic', 'texts.csv'), default='synthetic', help="Where the texts come from.")
+    parser.add_argument('--tokens', type=int, default=300, help="Approximate tokens per synthetic text.")
+    parser.add_argument('--workers', type=int, default=8, help="Maximum number of concurrent LLM requests.")
+    parser.add_argument('--batch-size', type=int, default=1, help="Pack up to this many texts into one annotate/rate request.")
+    parser.add_argument('--rpm', type=float, help="Client-side requests per minute limit.")
+    parser.add_argument('--base-url', help="Use an already running mock_server.py instead of starting one (the mock options below are then ignored).")
+    parser.add_argument('--latency', type=float, default=0.05, help="Median mock latency, seconds.")
+    parser.add_argument('--latency-sigma', type=float, default=0.5, help="Sigma of the log-normal mock latency.")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="Share of mock answers with status 500.")
+    parser.add_argument('--rate-limit-rate', type=float, default=0.0, help="Share of mock answers with status 429.")
+    parser.add_argument('--mock-rpm', type=int, help="Mock answers 429 above this many requests per minute.")
+    parser.add_argument('--seed', type=int, default=0, help="Seed of the mock latency and error generator.")
+    parser.add_argument('--json', metavar='PATH', help="Also write the raw results to a JSON file.")
+    args = parser.parse_args()
+
+    result = run(
+        rows=args.rows, workers=args.workers, batch_size=args.batch_size,
+        texts=args.texts, tokens=args.tokens, client_rpm=args.rpm, base_url=args.base_url,
+        latency=args.latency, latency_sigma=args.latency_sigma, error_rate=args.error_rate,
+        rate_limit_rate=args.rate_limit_rate, rpm=args.mock_rpm, seed=args.seed,
+    )
+    print_report(result)
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
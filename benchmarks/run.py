@@ -0,0 +1,217 @@
+"""
+Бенчмарки разбора ответов LLM и экспорта примеров GLiNER.
+
+Для каждого случая (tokenize, split, process, export) и каждого набора из benchmarks.fixtures
+измеряются время вызова (медиана нескольких раундов), пропускная способность в документах
+и токенах в секунду и пиковая память (tracemalloc, отдельным прогоном). По наборам одной группы
+строится кривая масштабирования: показатель степени k в time ~ size^k.
+
+Результаты сравниваются с benchmarks/baseline.json: падение пропускной способности или рост памяти
+больше порогов из baseline считается регрессией. Базовая линия зависит от машины — после смены
+машины ее нужно пересохранить.
+
+Запуск из корня репозитория:
+    python -m benchmarks.run                  # отчет и сравнение с baseline
+    python -m benchmarks.run --check          # код выхода 1 при регрессии
+    python -m benchmarks.run --save-baseline  # записать текущие результаты как baseline
+"""
+import argparse
+import gc
+import json
+import statistics
+import math
+import os
+import platform
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from benchmarks.fixtures import fixtures
+from export import export_examples
+from parse_LLM_output import process_json_answer, split_with_overlap, tokenize_text
+
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baseline.json')
+
+# Пороги по умолчанию: время зашумлено (даже медиана раундов гуляет на десятки процентов), память детерминирована
+DEFAULT_THRESHOLDS = {'throughput': 0.5, 'memory': 0.1}
+
+# Длительность раунда замера и число раундов, из которых берется медиана
+MIN_TIME = 0.5
+ROUNDS = 5
+
+# Строк в прогоне export: полный путь от ответов до JSONL-файла
+EXPORT_ROWS = 8
+
+
+def _cases(fixture, work_dir):
+    """Функции без аргументов для каждого случая; подготовка входа в замер не входит."""
+    answer = fixture['answer']
+    text = json.loads(answer)['text']
+    tokens = tokenize_text(text)
+    rows = [(i, answer, answer) for i in range(EXPORT_ROWS)]
+    output = os.path.join(work_dir, 'bench.jsonl')
+    return {
+        'tokenize': (lambda: tokenize_text(text), 1),
+        'split': (lambda: split_with_overlap(tokens, 384, 50), 1),
+        'process': (lambda: process_json_answer(answer), 1),
+        'export': (lambda: export_examples(rows, output, workers=1), 2 * EXPORT_ROWS),
+    }
+
+
+def _round(fn, number):
+    started = time.perf_counter()
+    for _ in range(number):
+        fn()
+    return time.perf_counter() - started
+
+
+def measure(fn, min_time=MIN_TIME, rounds=ROUNDS):
+    """
+    Медианное время одного вызова по rounds раундам: число вызовов в раунде подбирается так,
+    чтобы раунд шел не меньше min_time. Сборщик мусора на время замера выключается, как в timeit.
+    """
+    gc_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        number = 1
+        while True:
+            elapsed = _round(fn, number)
+            if elapsed >= min_time:
+                break
+            number = max(number * 2, int(number * min_time / max(elapsed, 1e-9)))
+        times = [elapsed / number] + [_round(fn, number) / number for _ in range(rounds - 1)]
+        return statistics.median(times)
+    finally:
+        if gc_enabled:
+            gc.enable()
+
+
+def peak_memory(fn):
+    """Пиковый прирост выделенной Python-памяти за один вызов, в байтах."""
+    tracemalloc.start()
+    try:
+        fn()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def run(quick=False, only=None, min_time=MIN_TIME):
+    """
+    :param only: Имена случаев, которые нужно выполнить (None — все).
+    :return: Словарь {'случай/набор': результат}.
+    """
+    results = {}
+    with tempfile.TemporaryDirectory() as work_dir:
+        for fixture in fixtures(quick):
+            for case, (fn, docs) in _cases(fixture, work_dir).items():
+                if only and case not in only:
+                    continue
+                seconds = measure(fn, min_time)
+                results[f"{case}/{fixture['name']}"] = {
+                    'case': case, 'fixture': fixture['name'], 'group': fixture['group'],
+                    'tokens': fixture['tokens'], 'entities': fixture['entities'],
+                    'seconds': seconds,
+                    'docs_per_s': docs / seconds,
+                    'tokens_per_s': docs * fixture['tokens'] / seconds,
+                    'peak_kb': peak_memory(fn) / 1024,
+                }
+    return results
+
+
+def scaling(results):
+    """
+    Показатель степени k в time ~ size^k по каждой группе наборов (МНК в логарифмах);
+    size — число сущностей для группы 'synthetic entities', иначе число токенов.
+
+    :return: Словарь {(случай, группа): k}.
+    """
+    points = {}
+    for result in results.values():
+        size = result['entities'] if result['group'] == 'synthetic entities' else result['tokens']
+        points.setdefault((result['case'], result['group']), []).append((math.log(size), math.log(result['seconds'])))
+    curves = {}
+    for key, xy in points.items():
+        if len(xy) < 2:
+            continue
+        mean_x = sum(x for x, _ in xy) / len(xy)
+        mean_y = sum(y for _, y in xy) / len(xy)
+        var = sum((x - mean_x) ** 2 for x, _ in xy)
+        curves[key] = sum((x - mean_x) * (y - mean_y) for x, y in xy) / var if var else 0.0
+    return curves
+
+
+def compare(results, baseline):
+    """
+    Сравнивает результаты с базовой линией.
+
+    :return: Список описаний регрессий (пустой — регрессий нет).
+    """
+    thresholds = {**DEFAULT_THRESHOLDS, **baseline.get('thresholds', {})}
+    regressions = []
+    for key, result in results.items():
+        base = baseline.get('results', {}).get(key)
+        if base is None:
+            continue
+        if result['tokens_per_s'] < base['tokens_per_s'] * (1 - thresholds['throughput']):
+            regressions.append(f"{key}: {result['tokens_per_s']:,.0f} tokens/s, baseline {base['tokens_per_s']:,.0f}")
+        if result['peak_kb'] > base['peak_kb'] * (1 + thresholds['memory']):
+            regressions.append(f"{key}: peak {result['peak_kb']:,.0f} KB, baseline {base['peak_kb']:,.0f} KB")
+    return regressions
+
+
+def machine():
+    return {'python': platform.python_version(), 'platform': platform.platform(), 'cpu': platform.processor()}
+
+
+def print_report(results, baseline):
+    base_results = baseline.get('results', {})
+    print(f"{'case/fixture':<34}{'tokens':>8}{'ents':>6}{'docs/s':>11}{'tokens/s':>13}{'peak KB':>10}{'vs base':>9}")
+    for key, result in results.items():
+        base = base_results.get(key)
+        change = f"{result['tokens_per_s'] / base['tokens_per_s'] - 1:+.0%}" if base else ''
+        print(f"{key:<34}{result['tokens']:>8}{result['entities']:>6}{result['docs_per_s']:>11,.1f}"
+              f"{result['tokens_per_s']:>13,.0f}{result['peak_kb']:>10,.0f}{change:>9}")
+    print("\nScaling, time ~ size^k:")
+    for (case, group), k in sorted(scaling(results).items()):
+        print(f"  {case:<10} {group:<20} k = {k:.2f}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark the parse/align/export path against a stored baseline.")
+    parser.add_argument('--quick', action='store_true', help="Only the small fixtures.")
+    parser.add_argument('--case', action='append', choices=('tokenize', 'split', 'process', 'export'), help="Run only this case (repeatable).")
+    parser.add_argument('--min-time', type=float, default=MIN_TIME, help="Minimum seconds per timing round.")
+    parser.add_argument('--baseline', default=BASELINE, help="Baseline file.")
+    parser.add_argument('--save-baseline', action='store_true', help="Store the results as the new baseline.")
+    parser.add_argument('--check', action='store_true', help="Exit with code 1 if a result regressed past the thresholds.")
+    parser.add_argument('--json', metavar='PATH', help="Also write the raw results to a JSON file.")
+    args = parser.parse_args()
+
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+        if baseline.get('machine') != machine():
+            print(f"Note: the baseline was recorded on {baseline.get('machine')}, timings may not be comparable.\n")
+
+    results = run(args.quick, args.case, args.min_time)
+    print_report(results, baseline)
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+    if args.save_baseline:
+        with open(args.baseline, 'w', encoding='utf-8') as f:
+            json.dump({'machine': machine(), 'thresholds': baseline.get('thresholds', DEFAULT_THRESHOLDS),
+                       'results': results}, f, ensure_ascii=False, indent=2)
+        print(f"\nBaseline saved to {args.baseline}")
+
+    regressions = compare(results, baseline)
+    if regressions:
+        print("\nRegressions:")
+        for regression in regressions:
+            print(f"  {regression}")
+        if args.check:
+            sys.exit(1)
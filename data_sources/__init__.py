@@ -1,21 +1,26 @@
-from .telegram_channel import load_texts
-from .load_from_txt import load_txt
-from .load_from_folder import load_from_folder
-from .load_n_split_txt import split_text
+from .base import SourceItem, batched
+from .telegram_channel import iter_texts, load_texts
+from .load_from_txt import iter_txt, load_txt
+from .load_from_folder import iter_folder, load_from_folder
+from .load_n_split_txt import iter_chunks, split_text
 
 def get_source(source: str):
     """
-    Возвращает функцию загрузки данных для указанного источника.
+    Возвращает генератор данных для указанного источника.
 
-    :param source: Название источника данных ("telegram", "txt", "folder").
-    :return: Функцию загрузки данных.
+    Все источники возвращают итераторы SourceItem (text, source_id, offset, metadata)
+    и читают данные лениво, по одному тексту. Если у итератора есть метод commit() (источник "folder"),
+    его нужно вызывать после сохранения полученных текстов — так источник запоминает, что уже прочитано.
+
+    :param source: Название источника данных ("telegram", "txt", "folder", "splitter").
+    :return: Функцию, которая по пути к данным возвращает генератор SourceItem.
     :raises ValueError: Если источник данных не поддерживается.
     """
     providers = {
-        "telegram": load_texts,
-        "txt": load_txt,
-        "folder": load_from_folder,
-        "splitter": split_text,
+        "telegram": iter_texts,
+        "txt": iter_txt,
+        "folder": iter_folder,
+        "splitter": iter_chunks,
     }
     provider_function = providers.get(source.lower())
     if not provider_function:
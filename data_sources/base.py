@@ -0,0 +1,27 @@
+from itertools import islice
+from typing import NamedTuple, Optional
+
+
+class SourceItem(NamedTuple):
+    """
+    Один текст из источника данных.
+
+    :param text: Текст.
+    :param source_id: Откуда текст: путь к файлу или экспорту.
+    :param offset: Положение внутри источника: id сообщения, смещение чанка в символах, 0 для целого файла.
+    :param metadata: Дополнительные поля источника (дата сообщения и т.п.) или None.
+    """
+    text: str
+    source_id: str
+    offset: int = 0
+    metadata: Optional[dict] = None
+
+
+def batched(items, batch_size):
+    """Разбивает итерируемое на списки длиной не больше batch_size, не материализуя его целиком."""
+    items = iter(items)
+    while True:
+        batch = list(islice(items, batch_size))
+        if not batch:
+            return
+        yield batch
@@ -1,34 +1,231 @@
+import codecs
+import hashlib
+import mmap
 import os
+import sqlite3
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 
-def load_from_folder(folder_path):
+from .base import SourceItem
+
+try:
+    from charset_normalizer import from_bytes
+except ImportError:  # необязательная зависимость: без нее неизвестные кодировки читаются как cp1251
+    from_bytes = None
+
+DEFAULT_MANIFEST = 'folder_manifest.sqlite'
+
+# Файлы больше этого размера читаются через mmap
+MMAP_THRESHOLD = 1 << 20
+
+_BOMS = (
+    (codecs.BOM_UTF8, 'utf-8-sig'),
+    (codecs.BOM_UTF16_LE, 'utf-16'),
+    (codecs.BOM_UTF16_BE, 'utf-16'),
+)
+
+
+def decode_bytes(data):
     """
-    Загружает все текстовые файлы из папки и возвращает их содержимое в виде списка.
+    Определяет кодировку и декодирует содержимое файла.
+
+    Порядок: BOM, строгий UTF-8, charset_normalizer (если установлен), cp1251.
+
+    :param data: bytes или memoryview (например, над mmap): декодируется без промежуточной копии.
+    :return: Пара (текст, кодировка).
+    """
+    head = bytes(data[:3])
+    for bom, encoding in _BOMS:
+        if head.startswith(bom):
+            return str(data, encoding), encoding
+    try:
+        return str(data, 'utf-8'), 'utf-8'
+    except UnicodeDecodeError:
+        pass
+    if from_bytes is not None:
+        best = from_bytes(bytes(data)).best()
+        if best is not None:
+            return str(best), best.encoding
+    return str(data, 'cp1251', errors='replace'), 'cp1251'
+
+
+def read_file(file_path, size):
+    """
+    Читает файл целиком (большие файлы — через mmap) и декодирует его.
+
+    :return: Тройка (текст, кодировка, хэш содержимого).
+    """
+    with open(file_path, 'rb') as file:
+        if size >= MMAP_THRESHOLD:
+            with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapped, memoryview(mapped) as view:
+                digest = hashlib.blake2b(view, digest_size=16).hexdigest()
+                text, encoding = decode_bytes(view)
+        else:
+            data = file.read()
+            digest = hashlib.blake2b(data, digest_size=16).hexdigest()
+            text, encoding = decode_bytes(data)
+    return text, encoding, digest
+
+
+def scan_folder(folder_path, extensions=('.txt',), recursive=True):
+    """
+    Обходит папку (рекурсивно) через os.scandir.
+
+    :return: Генератор троек (путь, размер, mtime в наносекундах) для файлов с нужными расширениями.
+    """
+    stack = [folder_path]
+    while stack:
+        current = stack.pop()
+        try:
+            entries = sorted(os.scandir(current), key=lambda entry: entry.name)
+        except OSError as e:
+            print(f"Ошибка при чтении папки '{current}': {e}")
+            continue
+        for entry in entries:
+            if entry.is_dir(follow_symlinks=False):
+                if recursive:
+                    stack.append(entry.path)
+            elif entry.is_file() and entry.name.endswith(extensions):
+                stat = entry.stat()
+                yield entry.path, stat.st_size, stat.st_mtime_ns
+
+
+class FolderManifest:
+    """
+    Манифест (путь, размер, mtime, хэш) уже прочитанных файлов.
+
+    Новые записи копятся в памяти и сохраняются по commit(), который потребитель вызывает
+    после того, как сохранил выданные тексты (см. FolderSource): если загрузка прервалась,
+    несохраненные файлы будут прочитаны заново (хранилище все равно отсечет дубликаты),
+    но ни один файл не будет потерян.
+    """
+
+    def __init__(self, path):
+        self.conn = sqlite3.connect(path)
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS files (path TEXT PRIMARY KEY, size INTEGER, mtime_ns INTEGER, hash TEXT)")
+        self._pending = []
+
+    def lookup(self, path):
+        return self.conn.execute("SELECT size, mtime_ns, hash FROM files WHERE path = ?", (path,)).fetchone()
+
+    def record(self, path, size, mtime_ns, digest):
+        self._pending.append((path, size, mtime_ns, digest))
+
+    def commit(self):
+        with self.conn:
+            self.conn.executemany("INSERT OR REPLACE INTO files (path, size, mtime_ns, hash) VALUES (?, ?, ?, ?)",
+                                  self._pending)
+        self._pending = []
+
+    def close(self):
+        self.conn.close()
+
+
+class FolderSource:
+    """
+    Итератор SourceItem источника "folder" с подтверждением сохранения.
+
+    Файл попадает в манифест только по commit(): его нужно вызывать после того, как тексты,
+    полученные из итератора до этого момента, сохранены. Файлы, которые были прочитаны,
+    но не дали текста (пустые или с прежним содержимым), сохраняются тем же commit().
+    """
+
+    def __init__(self, items, manifest=None):
+        self._items = items
+        self.manifest = manifest
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        return next(self._items)
+
+    def commit(self):
+        """Сохраняет в манифест все файлы, выданные итератором до сих пор."""
+        if self.manifest:
+            self.manifest.commit()
+
+    def close(self):
+        self._items.close()
+        if self.manifest:
+            self.manifest.close()
+            self.manifest = None
+
+
+def iter_folder(folder_path, manifest_path=DEFAULT_MANIFEST, workers=8, extensions=('.txt',), recursive=True):
+    """
+    Источник данных "folder": текстовые файлы папки и подпапок по одному.
+
+    Файлы читаются параллельно в пуле потоков. Если задан манифест, файлы с теми же размером
+    и mtime, что и в прошлый раз, не читаются вовсе, а файлы с тем же содержимым не выдаются повторно.
+    Прочитанные файлы попадают в манифест, только когда потребитель вызовет commit() у результата.
 
     :param folder_path: Путь к папке с текстовыми файлами.
-    :return: Список, где каждый элемент — содержимое одного файла.
+    :param manifest_path: Путь к манифесту прочитанных файлов (None — читать все файлы каждый раз).
+    :param workers: Число потоков чтения.
+    :param extensions: Расширения файлов, которые нужно читать.
+    :param recursive: Обходить подпапки.
+    :return: FolderSource — итератор SourceItem, source_id — путь к файлу, в metadata — кодировка.
     """
-    texts = []  # Список для хранения содержимого файлов
+    manifest = FolderManifest(manifest_path) if manifest_path and os.path.exists(folder_path) else None
+    return FolderSource(_read_folder(folder_path, manifest, workers, extensions, recursive), manifest)
 
+
+def _read_folder(folder_path, manifest, workers, extensions, recursive):
     # Проверяем, существует ли папка
     if not os.path.exists(folder_path):
         print(f"Ошибка: Папка '{folder_path}' не найдена.")
-        return texts
+        return
+
+    def changed_files():
+        for file_path, size, mtime_ns in scan_folder(folder_path, extensions, recursive):
+            known = manifest.lookup(os.path.abspath(file_path)) if manifest else None
+            if known and known[:2] == (size, mtime_ns):
+                continue
+            yield file_path, size, mtime_ns, known
+
+    def read(file_path, size):
+        try:
+            return read_file(file_path, size)
+        except Exception as e:
+            print(f"Ошибка при чтении файла '{file_path}': {e}")
+            return None
 
-    # Итерируемся по всем файлам в папке
-    for filename in os.listdir(folder_path):
-        file_path = os.path.join(folder_path, filename)  # Полный путь к файлу
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        pending = deque()
+        files = changed_files()
+        while True:
+            # Держим в работе ограниченное число файлов, чтобы не читать всю папку в память
+            for file_path, size, mtime_ns, known in files:
+                pending.append((file_path, size, mtime_ns, known, executor.submit(read, file_path, size)))
+                if len(pending) >= workers * 4:
+                    break
+            if not pending:
+                break
+            file_path, size, mtime_ns, known, future = pending.popleft()
+            result = future.result()
+            if result is None:
+                continue
+            text, encoding, digest = result
+            if manifest:
+                manifest.record(os.path.abspath(file_path), size, mtime_ns, digest)
+            # Файл трогали, но содержимое не изменилось
+            if known and known[2] == digest:
+                continue
+            if text.strip():
+                yield SourceItem(text, file_path, 0, {'encoding': encoding})
 
-        # Проверяем, что это файл (а не подпапка) и имеет расширение .txt
-        if os.path.isfile(file_path) and filename.endswith('.txt'):
-            try:
-                with open(file_path, 'r', encoding='utf-8') as file:
-                    text_content = file.read()  # Читаем содержимое файла
-                    texts.append(text_content)  # Добавляем в список
-            except Exception as e:
-                print(f"Ошибка при чтении файла '{filename}': {e}")
 
-    return texts
+def load_from_folder(folder_path):
+    """
+    Загружает все текстовые файлы из папки и возвращает их содержимое в виде списка.
+
+    :param folder_path: Путь к папке с текстовыми файлами.
+    :return: Список, где каждый элемент — содержимое одного файла.
+    """
+    return [item.text for item in iter_folder(folder_path, manifest_path=None)]
 
 # Пример использования:
 # texts = load_from_folder('path/to/folder')
-# print(texts)
\ No newline at end of file
+# print(texts)
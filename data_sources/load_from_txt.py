@@ -1,3 +1,17 @@
+from .base import SourceItem
+
+
+def iter_txt(file_path):
+    """
+    Источник данных "txt": весь файл как один текст.
+
+    :param file_path: Path to the text file.
+    :return: A generator yielding a single SourceItem (nothing if the file can't be read).
+    """
+    for text_content in load_txt(file_path):
+        yield SourceItem(text_content, file_path)
+
+
 def load_txt(file_path):
     """
     Loads a text file and returns its content as the only element of a list.
@@ -1,38 +1,222 @@
 import os
+import re
 
-def split_text(filepath, chunk_size_chars=1000, overlap_chars=200):
+from .base import SourceItem
+
+# Блок чтения файла в символах
+BLOCK_SIZE = 1 << 16
+
+# Граница абзаца, конец предложения (с закрывающими кавычками и скобками) или перенос строки.
+# Пробелы после границы остаются в конце предыдущего сегмента, поэтому сегменты склеиваются без потерь
+_BOUNDARY = re.compile(r'\n[ \t\r]*\n\s*|[.!?…]+["»”\')\]]*\s+|\n')
+_SPACE = re.compile(r'\s+')
+
+
+def token_counter(unit='chars'):
     """
-    Читает файл, разбивает его текст на части с перекрытием и возвращает список чанков.
+    Возвращает функцию, которая меряет размер текста.
+
+    :param unit: 'chars' — символы; 'tokens' — токены GLiNER (parse_LLM_output.tokenize_text, по ним
+                 считаются окна max_tokens=384); 'tiktoken' — токены модели LLM (нужен пакет tiktoken,
+                 кодировка берется по MODEL из окружения).
+    :raises ValueError: Если единица измерения не поддерживается.
+    """
+    if unit == 'chars':
+        return len
+    if unit == 'tokens':
+        from parse_LLM_output import tokenize_text
+        return lambda text: len(tokenize_text(text))
+    if unit == 'tiktoken':
+        import tiktoken
+        try:
+            encoding = tiktoken.encoding_for_model(os.environ.get('MODEL', ''))
+        except KeyError:
+            encoding = tiktoken.get_encoding('cl100k_base')
+        return lambda text: len(encoding.encode(text, disallowed_special=()))
+    raise ValueError(f"Единица измерения {unit} не поддерживается")
+
+
+def iter_segments(file, block_size=BLOCK_SIZE, max_segment=None):
+    """
+    Потоково режет текст файла на сегменты по границам предложений и абзацев.
+
+    :param file: Открытый текстовый файл.
+    :param block_size: Размер блока чтения в символах.
+    :param max_segment: Максимальная длина сегмента в символах (текст без знаков препинания
+                        и переносов строк режется принудительно, по последнему пробелу).
+    :return: Генератор пар (сегмент, смещение начала сегмента в символах).
+    """
+    max_segment = max_segment or block_size
+    buffer = ''
+    offset = 0
+    eof = False
+
+    def force_cuts(start, end):
+        # Режем слишком длинный участок без границ по последнему пробелу (или жестко)
+        while end - start > max_segment:
+            cut = buffer.rfind(' ', start, start + max_segment) + 1 or start + max_segment
+            yield buffer[start:cut], offset + start
+            start = cut
+
+    while not eof:
+        block = file.read(block_size)
+        eof = not block
+        buffer += block
+        start = 0
+        for match in _BOUNDARY.finditer(buffer):
+            # Пробелы в самом конце буфера могут продолжиться в следующем блоке
+            if match.end() == len(buffer) and not eof:
+                break
+            for segment in force_cuts(start, match.end()):
+                yield segment
+                start += len(segment[0])
+            yield buffer[start:match.end()], offset + start
+            start = match.end()
+        for segment in force_cuts(start, len(buffer)):
+            yield segment
+            start += len(segment[0])
+        if eof and start < len(buffer):
+            yield buffer[start:], offset + start
+            start = len(buffer)
+        buffer = buffer[start:]
+        offset += start
+
+
+def _split_long(segment, offset, measure, chunk_size):
+    """Режет сегмент, который сам по себе больше чанка, по границам слов на части не больше chunk_size."""
+    ends = [match.end() for match in _SPACE.finditer(segment)] + [len(segment)]
+    start = 0
+    while start < len(segment):
+        # Бинарный поиск самой длинной части из целых слов, которая помещается в чанк
+        candidates = [end for end in ends if end > start]
+        lo, hi = 0, len(candidates) - 1
+        best = candidates[0]
+        while lo <= hi:
+            mid = (lo + hi) // 2
+            if measure(segment[start:candidates[mid]]) <= chunk_size:
+                best = candidates[mid]
+                lo = mid + 1
+            else:
+                hi = mid - 1
+        part = segment[start:best]
+        yield part, offset + start, measure(part)
+        start = best
+
+
+def iter_line_chunks(filepath, chunk_size=1000, overlap=200):
+    """
+    Прежняя нарезка (режим 'lines'): чанк из chunk_size символов продлевается до последнего переноса
+    строки в следующих overlap символах. Чанки совпадают с теми, что уже лежат в хранилище.
+
+    :return: Генератор SourceItem, offset — смещение начала чанка в символах.
     """
     try:
         with open(filepath, 'r', encoding='utf-8') as f:
             text = f.read()
+    except FileNotFoundError:
+        print(f"Ошибка: Файл '{filepath}' не найден.")
+        return
+    except Exception as e:
+        print(f"Ошибка при чтении или разбиении файла '{filepath}': {e}")
+        return
 
-        start = 0
-        chunks = []
-        while start < len(text):
-            end = min(start + chunk_size_chars, len(text))
+    start = 0
+    while start < len(text):
+        end = min(start + chunk_size, len(text))
+
+        # Находим последний перенос строки в пределах overlap
+        if end + overlap < len(text):
+            newline_pos = text[end:end + overlap].rfind('\n')
+            if newline_pos != -1:
+                end = end + newline_pos + 1
+
+        yield SourceItem(text[start:end], filepath, start)
+        start = end
+
+
+def iter_chunks(filepath, chunk_size=1000, overlap=200, unit='chars', block_size=BLOCK_SIZE, mode='lines'):
+    """
+    Источник данных "splitter": перекрывающиеся чанки файла по одному.
+
+    В режиме 'sentences' файл читается блоками, поэтому в памяти одновременно только блок и текущий чанк.
+    Чанк собирается из целых предложений и абзацев, пока не превысит chunk_size;
+    следующий чанк начинается с последних предложений предыдущего общим размером не больше overlap.
+    Режим 'lines' (по умолчанию) — прежняя нарезка по символам и переносам строк (iter_line_chunks):
+    переход на 'sentences' меняет все чанки файла, и при следующем запуске они размечаются заново.
 
-            # Находим последний перенос строки в пределах overlap
-            if end + overlap_chars < len(text):
-                overlap = text[end:end + overlap_chars]
-                newline_pos = overlap.rfind('\n')
+    :param filepath: Путь к текстовому файлу.
+    :param chunk_size: Максимальный размер чанка.
+    :param overlap: Размер перекрытия соседних чанков.
+    :param unit: В чем мерить chunk_size и overlap (см. token_counter); в режиме 'lines' — только 'chars'.
+    :param block_size: Размер блока чтения в символах.
+    :param mode: 'lines' или 'sentences'.
+    :return: Генератор SourceItem, offset — смещение начала чанка в символах.
+    :raises ValueError: Если режим не поддерживается или не поддерживает unit.
+    """
+    if mode == 'lines':
+        if unit != 'chars':
+            raise ValueError("Режим lines меряет чанки только в символах, для токенов нужен режим sentences")
+        return iter_line_chunks(filepath, chunk_size, overlap)
+    if mode != 'sentences':
+        raise ValueError(f"Режим нарезки {mode} не поддерживается")
+    if overlap >= chunk_size:
+        raise ValueError("overlap должен быть меньше chunk_size")
+    return _iter_sentence_chunks(filepath, chunk_size, overlap, unit, block_size)
 
-                if newline_pos != -1:
-                    end = end + newline_pos + 1
 
-            chunk = text[start:end]
-            chunks.append(chunk)
-            start = end
+def _iter_sentence_chunks(filepath, chunk_size, overlap, unit, block_size):
+    measure = token_counter(unit)
 
-        return chunks
+    def emit(parts):
+        text = ''.join(part for part, _, _ in parts)
+        if text.strip():
+            return SourceItem(text.strip(), filepath, parts[0][1] + len(text) - len(text.lstrip()))
 
+    try:
+        with open(filepath, 'r', encoding='utf-8') as f:
+            # Сегмент длиннее чанка в символах заведомо придется резать; в токенах — с запасом
+            max_segment = chunk_size if unit == 'chars' else chunk_size * 8
+            chunk = []
+            size = 0
+            for segment, offset in iter_segments(f, block_size, max_segment):
+                segment_size = measure(segment)
+                pieces = ([(segment, offset, segment_size)] if segment_size <= chunk_size
+                          else _split_long(segment, offset, measure, chunk_size))
+                for piece in pieces:
+                    if chunk and size + piece[2] > chunk_size:
+                        item = emit(chunk)
+                        if item:
+                            yield item
+                        # Перекрытие: хвост из целых сегментов, но не весь чанк, иначе не будет продвижения
+                        tail = []
+                        tail_size = 0
+                        for part in reversed(chunk[1:]):
+                            if tail_size + part[2] > overlap:
+                                break
+                            tail.insert(0, part)
+                            tail_size += part[2]
+                        while tail and tail_size + piece[2] > chunk_size:
+                            tail_size -= tail.pop(0)[2]
+                        chunk, size = tail, tail_size
+                    chunk.append(piece)
+                    size += piece[2]
+            if chunk:
+                item = emit(chunk)
+                if item:
+                    yield item
     except FileNotFoundError:
         print(f"Ошибка: Файл '{filepath}' не найден.")
-        return []
+        return
     except Exception as e:
         print(f"Ошибка при чтении или разбиении файла '{filepath}': {e}")
-        return []
+        return
+
+
+def split_text(filepath, chunk_size_chars=1000, overlap_chars=200, mode='lines'):
+    """
+    Читает файл, разбивает его текст на части с перекрытием и возвращает список чанков.
+    """
+    return [item.text for item in iter_chunks(filepath, chunk_size_chars, overlap_chars, mode=mode)]
 
 
 
@@ -41,10 +225,10 @@ if __name__ == "__main__":
     chunk_size = 1000
     overlap = 200
 
-    chunks = split_text_in_memory(filepath, chunk_size, overlap)
+    chunks = split_text(filepath, chunk_size, overlap)
 
     for i, chunk in enumerate(chunks):
         print(f"Обработка чанка {i+1}:")
         # ... ваш код для обработки chunk ...
         print(chunk)
-        print("\n" * 4)
\ No newline at end of file
+        print("\n" * 4)
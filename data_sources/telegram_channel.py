@@ -1,7 +1,11 @@
 import json
 import logging
+import re
+from datetime import datetime
 import colorlog
 
+from .base import SourceItem
+
 # Создаем форматтер с цветовыми кодами
 formatter = colorlog.ColoredFormatter(
     "%(log_color)s%(asctime)s - %(name)s - %(levelname)s - %(message)s",
@@ -24,22 +28,111 @@ logger = logging.getLogger('news logger')
 logger.setLevel(logging.INFO)
 logger.addHandler(handler)
 
-def load_texts(path):
+_MESSAGES_KEY = re.compile(r'"messages"\s*:\s*\[')
+_decoder = json.JSONDecoder()
+
+
+def iter_json_array(path, key_pattern=_MESSAGES_KEY, chunk_size=1 << 20):
+    """
+    Потоково читает элементы массива из большого JSON-файла, не загружая файл целиком.
+
+    Файл читается блоками, начало массива ищется по key_pattern, а каждый элемент
+    разбирается json.JSONDecoder.raw_decode, как только он целиком оказался в буфере.
+
+    :param path: Путь к JSON-файлу.
+    :param key_pattern: Регулярное выражение, которое заканчивается открывающей скобкой массива.
+    :param chunk_size: Размер блока чтения в символах.
+    :return: Генератор элементов массива.
+    """
     with open(path, 'r', encoding='utf-8') as file:
-        data = json.load(file)
-
-    texts = []
-
-    for i in (data['messages']):
-        i = i['text']
-        message = ''
-        for q in i:
-            if type(q) == str:
-                message += q
-            if type(q) == dict:
-                message += q['text']
-        message = message.strip()
-        if message:
-            logger.debug(message)
-            texts.append(message)
-    return texts
+        buffer = ''
+        # Ищем начало массива; заголовок экспорта небольшой, поэтому держим его в буфере целиком
+        while True:
+            match = key_pattern.search(buffer)
+            if match:
+                buffer = buffer[match.end():]
+                break
+            chunk = file.read(chunk_size)
+            if not chunk:
+                return
+            buffer += chunk
+
+        pos = 0
+        eof = False
+        while True:
+            # Пропускаем пробелы и запятые между элементами
+            while pos < len(buffer) and buffer[pos] in ' \t\r\n,':
+                pos += 1
+            if pos < len(buffer) and buffer[pos] == ']':
+                return
+            try:
+                if pos >= len(buffer):
+                    raise ValueError("buffer is empty")
+                item, end = _decoder.raw_decode(buffer, pos)
+            except ValueError:
+                if eof:
+                    raise ValueError(f"Неожиданный конец файла '{path}' внутри массива")
+                chunk = file.read(chunk_size)
+                eof = not chunk
+                buffer = buffer[pos:] + chunk
+                pos = 0
+                continue
+            yield item
+            pos = end
+
+
+def message_text(message):
+    """Собирает текст сообщения из строки или списка строк и словарей с ключом 'text'."""
+    text = message.get('text', '')
+    if isinstance(text, str):
+        return text.strip()
+    return ''.join(part if isinstance(part, str) else part.get('text', '') for part in text).strip()
+
+
+def _to_datetime(value):
+    if value is None or isinstance(value, datetime):
+        return value
+    return datetime.fromisoformat(str(value))
+
+
+def iter_messages(path, since_id=None, date_from=None, date_to=None):
+    """
+    Потоково читает сообщения из result.json экспорта Telegram.
+
+    :param path: Путь к файлу экспорта.
+    :param since_id: Пропускать сообщения с id не больше этого (для загрузки только новых сообщений).
+    :param date_from: Пропускать сообщения раньше этой даты (datetime или строка ISO).
+    :param date_to: Пропускать сообщения позже этой даты (datetime или строка ISO).
+    :return: Генератор словарей с ключами 'id', 'date' и 'text'; пустые сообщения пропускаются.
+    """
+    date_from, date_to = _to_datetime(date_from), _to_datetime(date_to)
+    for message in iter_json_array(path):
+        if since_id is not None and message.get('id', 0) <= since_id:
+            continue
+        if date_from or date_to:
+            date = _to_datetime(message.get('date'))
+            if date is None or (date_from and date < date_from) or (date_to and date > date_to):
+                continue
+        text = message_text(message)
+        if text:
+            logger.debug(text)
+            yield {'id': message.get('id'), 'date': message.get('date'), 'text': text}
+
+
+def iter_texts(path, since_id=None, date_from=None, date_to=None):
+    """
+    Источник данных "telegram": сообщения экспорта в виде SourceItem.
+
+    :return: Генератор SourceItem с id сообщения в offset и датой в metadata (фильтры см. iter_messages).
+    """
+    for message in iter_messages(path, since_id, date_from, date_to):
+        yield SourceItem(message['text'], path, message['id'] or 0, {'date': message['date']})
+
+
+def load_texts(path, since_id=None, date_from=None, date_to=None):
+    """
+    Загружает тексты сообщений из экспорта Telegram.
+
+    :return: Список текстов (см. iter_messages).
+    """
+    return [message['text'] for message in iter_messages(path, since_id, date_from, date_to)]
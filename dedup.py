@@ -0,0 +1,80 @@
+import hashlib
+import re
+import struct
+import unicodedata
+
+_WHITESPACE = re.compile(r'\s+')
+_WORDS = re.compile(r'\w+')
+
+# Простое число Мерсенна 2^61 - 1 для универсального хэширования MinHash
+_PRIME = (1 << 61) - 1
+
+
+def normalize_text(text):
+    """Приводит текст к каноническому виду: NFKC, casefold, ё → е, схлопнутые пробелы."""
+    text = unicodedata.normalize('NFKC', text).casefold().replace('ё', 'е')
+    return _WHITESPACE.sub(' ', text).strip()
+
+
+def normalized_hash(text):
+    """Хэш нормализованного текста: одинаков у текстов, различающихся только регистром и пробелами."""
+    return hashlib.blake2b(normalize_text(text).encode('utf-8'), digest_size=16).hexdigest()
+
+
+def _hash64(value):
+    return struct.unpack('<Q', hashlib.blake2b(value.encode('utf-8'), digest_size=8).digest())[0]
+
+
+class MinHasher:
+    """
+    MinHash-сигнатуры по словесным шинглам и их разбиение на полосы для LSH.
+
+    Два текста попадают в одну корзину хотя бы одной полосы с вероятностью,
+    которая резко растет около сходства Жаккара (1 / bands) ** (1 / rows).
+
+    :param num_perm: Длина сигнатуры.
+    :param bands: Число полос LSH (num_perm должно делиться на bands).
+    :param shingle_size: Длина шингла в словах.
+    """
+
+    def __init__(self, num_perm=64, bands=16, shingle_size=3):
+        if num_perm % bands:
+            raise ValueError("num_perm должно делиться на bands")
+        self.num_perm = num_perm
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.shingle_size = shingle_size
+        # Фиксированные коэффициенты, чтобы сигнатуры в базе оставались сравнимыми между запусками
+        self._perms = [(_hash64(f"a{i}") % (_PRIME - 1) + 1, _hash64(f"b{i}") % _PRIME) for i in range(num_perm)]
+
+    def shingles(self, text):
+        words = _WORDS.findall(normalize_text(text))
+        if len(words) <= self.shingle_size:
+            return {' '.join(words)} if words else set()
+        return {' '.join(words[i:i + self.shingle_size]) for i in range(len(words) - self.shingle_size + 1)}
+
+    def signature(self, text):
+        """:return: Кортеж из num_perm минимальных хэшей (пустой текст — все значения _PRIME)."""
+        hashes = [_hash64(s) for s in self.shingles(text)]
+        if not hashes:
+            return tuple([_PRIME] * self.num_perm)
+        return tuple(min((a * h + b) % _PRIME for h in hashes) for a, b in self._perms)
+
+    def band_keys(self, signature):
+        """:return: Список пар (номер полосы, ключ корзины)."""
+        keys = []
+        for band in range(self.bands):
+            chunk = signature[band * self.rows:(band + 1) * self.rows]
+            keys.append((band, hashlib.blake2b(struct.pack(f'<{self.rows}Q', *chunk), digest_size=8).hexdigest()))
+        return keys
+
+    @staticmethod
+    def similarity(sig_a, sig_b):
+        """Оценка сходства Жаккара по двум сигнатурам."""
+        return sum(a == b for a, b in zip(sig_a, sig_b)) / len(sig_a)
+
+    def pack(self, signature):
+        return struct.pack(f'<{self.num_perm}Q', *signature)
+
+    def unpack(self, blob):
+        return struct.unpack(f'<{self.num_perm}Q', blob)
@@ -0,0 +1,111 @@
+import json
+import logging
+import os
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+from data_sources import batched
+from parse_LLM_output import process_json_answer
+
+logger = logging.getLogger(__name__)
+
+
+def convert_rows(rows):
+    """
+    Превращает ответы LLM нескольких строк в примеры GLiNER. Выполняется в процессах пула.
+
+    :param rows: Список троек (id строки, 'LLM json', 'LLM summary json').
+    :return: Список пар (id строки, результат), где результат — словарь с ключами
+        'examples' (примеры полного текста и краткого содержания) и 'errors' (имена колонок, которые не разобрались).
+    """
+    results = []
+    for row_id, llm_json, summary_json in rows:
+        examples = []
+        errors = []
+        for column, answer in (('LLM json', llm_json), ('LLM summary json', summary_json)):
+            result = process_json_answer(answer)
+            if result:
+                examples += result
+            else:
+                errors.append(column)
+        results.append((row_id, {'examples': examples, 'errors': errors}))
+    return results
+
+
+def convert_stream(rows, workers=None, ordered=True, batch_size=64):
+    """
+    Параллельно конвертирует поток строк, держа в работе ограниченное число пачек,
+    поэтому расход памяти не зависит от размера таблицы.
+
+    :param rows: Итерируемое из троек (id строки, 'LLM json', 'LLM summary json').
+    :param workers: Число процессов; 0 или 1 — конвертировать в текущем процессе.
+    :param ordered: Выдавать результаты в порядке входных строк.
+    :param batch_size: Число строк в одной задаче пула.
+    :return: Генератор пар (id строки, результат convert_rows).
+    """
+    if workers is not None and workers <= 1:
+        for batch in batched(rows, batch_size):
+            yield from convert_rows(batch)
+        return
+
+    workers = workers or os.cpu_count() or 1
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        max_pending = workers * 2
+        pending = deque()
+        for batch in batched(rows, batch_size):
+            pending.append(executor.submit(convert_rows, batch))
+            while len(pending) >= max_pending:
+                yield from _take(pending, ordered)
+        while pending:
+            yield from _take(pending, ordered)
+
+
+def _take(pending, ordered):
+    if ordered:
+        return pending.popleft().result()
+    done, _ = wait(pending, return_when=FIRST_COMPLETED)
+    results = []
+    for future in done:
+        pending.remove(future)
+        results += future.result()
+    return results
+
+
+def export_examples(rows, output_path, json_path=None, workers=None, ordered=True, batch_size=64):
+    """
+    Пишет примеры GLiNER в JSONL по мере конвертации (и, опционально, в компактный JSON-массив).
+    Файлы пишутся во временные и атомарно подменяются в конце.
+
+    :param rows: Итерируемое из троек (id строки, 'LLM json', 'LLM summary json').
+    :param output_path: Путь к JSONL-файлу.
+    :param json_path: Путь к компактному JSON-файлу (None — не писать).
+    :return: Словарь со счетчиками rows, examples, errors.
+    """
+    stats = {'rows': 0, 'examples': 0, 'errors': 0}
+    os.makedirs(os.path.dirname(output_path) or '.', exist_ok=True)
+    jsonl = open(output_path + '.tmp', 'w', encoding='utf-8')
+    compact = open(json_path + '.tmp', 'w', encoding='utf-8') if json_path else None
+    try:
+        if compact:
+            compact.write('[')
+        for row_id, result in convert_stream(rows, workers=workers, ordered=ordered, batch_size=batch_size):
+            stats['rows'] += 1
+            for column in result['errors']:
+                stats['errors'] += 1
+                logger.error(f"Error processing '{column}' in row {row_id}")
+            for example in result['examples']:
+                line = json.dumps(example, ensure_ascii=False, separators=(',', ':'))
+                jsonl.write(line + '\n')
+                if compact:
+                    compact.write((',' if stats['examples'] else '') + line)
+                stats['examples'] += 1
+        if compact:
+            compact.write(']')
+    finally:
+        jsonl.close()
+        if compact:
+            compact.close()
+    os.replace(output_path + '.tmp', output_path)
+    if json_path:
+        os.replace(json_path + '.tmp', json_path)
+    return stats
@@ -0,0 +1,215 @@
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from providers.base_provider import parse_score
+from providers.usage import split_usage, track_stage
+
+logger = logging.getLogger(__name__)
+
+
+def is_empty(value):
+    """Пустая ячейка таблицы: после .astype(str) пропуски превращаются в 'nan'."""
+    return value is None or str(value) in ('nan', 'NaN', '')
+
+
+class FillEngine:
+    """
+    Конкурентно заполняет строки таблицы ответами LLM.
+
+    Для каждой строки независимые стадии (rate, summarize, annotate полного текста)
+    запускаются параллельно, а annotate краткого содержания стартует сразу после
+    того, как готово само краткое содержание. Одновременно выполняется не больше
+    max_in_flight запросов к провайдеру.
+
+    При batch_size > 1 строки обрабатываются группами: rate и annotate группы идут одним
+    вызовом rate_many / annotate_many (провайдер упаковывает тексты в общие запросы),
+    а краткие содержания группы размечаются вместе, когда готовы все они.
+
+    :param provider: Экземпляр BaseLLMProvider.
+    :param on_result: Функция (key, {колонка: значение}), вызывается под блокировкой для каждой готовой стадии.
+    :param on_row_done: Функция (key), вызывается под блокировкой, когда у строки готовы все стадии.
+    :param max_in_flight: Максимальное число одновременных запросов к провайдеру.
+    :param model_name: Значение для колонки 'model'.
+    :param batch_size: Число строк в группе для пакетных вызовов провайдера.
+    :param on_usage: Функция (key, stage, usage): токены и задержка вызовов стадии для строки.
+                     Usage пакетного вызова делится поровну между строками группы; ответы из кэша не учитываются.
+    """
+
+    def __init__(self, provider, on_result, on_row_done, max_in_flight=4, model_name=None, batch_size=1,
+                 on_usage=None):
+        self.provider = provider
+        self.on_result = on_result
+        self.on_row_done = on_row_done
+        self.max_in_flight = max(1, int(max_in_flight))
+        self.model_name = model_name
+        self.batch_size = max(1, int(batch_size))
+        self.on_usage = on_usage
+        self._lock = threading.Lock()
+        # Ограничиваем число строк в очереди, чтобы не ставить в пул всю таблицу сразу
+        self._slot_count = self.max_in_flight * 2 * self.batch_size
+        self._row_slots = threading.BoundedSemaphore(self._slot_count)
+        self._errors = []
+
+    def run(self, rows):
+        """
+        Обрабатывает строки и блокируется до завершения всех стадий.
+
+        :param rows: Итерируемое из пар (key, row), где row — словарь с колонками таблицы.
+        :raises RuntimeError: Если хотя бы одна стадия завершилась ошибкой (остальные строки при этом сохранены).
+        """
+        self._errors = []
+        with ThreadPoolExecutor(max_workers=self.max_in_flight, thread_name_prefix='llm') as executor:
+            self._executor = executor
+            group = []
+            for key, row in rows:
+                self._row_slots.acquire()
+                group.append((key, row))
+                if len(group) >= self.batch_size:
+                    self._submit_group(group)
+                    group = []
+            if group:
+                self._submit_group(group)
+            # Ждем, пока освободятся все слоты, то есть завершатся все строки
+            for _ in range(self._slot_count):
+                self._row_slots.acquire()
+            for _ in range(self._slot_count):
+                self._row_slots.release()
+
+        if self._errors:
+            raise RuntimeError(f"{len(self._errors)} stage(s) failed, first error: {self._errors[0]!r}")
+
+    def _submit_group(self, group):
+        stages = {'rate': [], 'summarize': [], 'annotate summary': [], 'annotate': []}
+        # Краткие содержания группы, которые еще пишутся, и готовые к разметке
+        summaries = {'pending': 0, 'ready': []}
+        entries = []
+        for key, row in group:
+            state = {'pending': 0, 'failed': False}
+            entry = (key, row, state)
+            entries.append(entry)
+            needed = []
+            if is_empty(row.get('score_reason')):
+                needed.append(('rate', row['full text']))
+            if is_empty(row.get('summary')):
+                needed.append(('summarize', row['full text']))
+                summaries['pending'] += 1
+            elif is_empty(row.get('LLM summary json')):
+                needed.append(('annotate summary', row['summary']))
+            if is_empty(row.get('LLM json')):
+                needed.append(('annotate', row['full text']))
+            for name, text in needed:
+                stages[name].append((entry, text))
+            state['pending'] = len(needed)
+
+        calls = []
+        if stages['rate']:
+            calls.append(('rate', stages['rate']))
+        # Краткое содержание — свободный текст, пакетом его не запросить
+        calls.extend(('summarize', [item]) for item in stages['summarize'])
+        if stages['annotate summary']:
+            calls.append(('annotate summary', stages['annotate summary']))
+        if stages['annotate']:
+            calls.append(('annotate', stages['annotate']))
+
+        for entry in entries:
+            if not entry[2]['pending']:
+                self._finish_row(*entry)
+        for name, items in calls:
+            self._executor.submit(self._run_stage, name, items, summaries)
+
+    def _call(self, name, texts):
+        if name == 'rate':
+            return [parse_score(answer) for answer in self.provider.rate_many(texts)]
+        if name == 'summarize':
+            return [{'summary': self.provider.summarize(text)} for text in texts]
+        if name == 'annotate summary':
+            return [{'LLM summary json': answer} for answer in self.provider.annotate_many(texts)]
+        return [{'LLM json': answer} for answer in self.provider.annotate_many(texts)]
+
+    def _run_stage(self, name, items, summaries):
+        try:
+            with track_stage(name) as usage:
+                results = self._call(name, [text for _, text in items])
+        except Exception as e:
+            keys = ', '.join(str(entry[0]) for entry, _ in items)
+            logger.error(f"Stage '{name}' failed for row(s) {keys}: {e}")
+            with self._lock:
+                self._errors.append(e)
+                for entry, _ in items:
+                    entry[2]['failed'] = True
+            if name == 'summarize':
+                self._summary_done(summaries, None)
+            for entry, _ in items:
+                self._stage_done(*entry)
+            return
+
+        if self.on_usage and usage['calls']:
+            share = split_usage(usage, len(items))
+            for entry, _ in items:
+                try:
+                    self.on_usage(entry[0], name, share)
+                except Exception as e:
+                    self._callback_failed(f"Saving usage of stage '{name}'", entry[0], e)
+        for (entry, _), values in zip(items, results):
+            key, row, state = entry
+            ready = None
+            try:
+                with self._lock:
+                    row.update(values)
+                    self.on_result(key, values)
+                    # Краткое содержание готово — его разметка уйдет вместе с остальными краткими содержаниями группы
+                    if name == 'summarize' and is_empty(row.get('LLM summary json')):
+                        state['pending'] += 1
+                        ready = (entry, values['summary'])
+            except Exception as e:
+                # Строка не записана: она останется незаполненной, а run() сообщит об ошибке
+                state['failed'] = True
+                self._callback_failed(f"Saving stage '{name}'", key, e)
+            finally:
+                if name == 'summarize':
+                    self._summary_done(summaries, ready)
+                self._stage_done(*entry)
+
+    def _callback_failed(self, what, key, error):
+        """Ошибка on_result / on_usage / on_row_done (например, занятая база) — в список ошибок run()."""
+        logger.error(f"{what} failed for row {key}: {error}")
+        with self._lock:
+            self._errors.append(error)
+
+    def _summary_done(self, summaries, ready):
+        with self._lock:
+            summaries['pending'] -= 1
+            if ready:
+                summaries['ready'].append(ready)
+            if summaries['pending'] > 0 or not summaries['ready']:
+                return
+            items, summaries['ready'] = summaries['ready'], []
+        self._executor.submit(self._run_stage, 'annotate summary', items, summaries)
+
+    def _stage_done(self, key, row, state):
+        with self._lock:
+            state['pending'] -= 1
+            if state['pending'] > 0:
+                return
+        self._finish_row(key, row, state)
+
+    def _finish_row(self, key, row, state):
+        try:
+            if state['failed']:
+                return
+            values = {}
+            if is_empty(row.get('model')):
+                values['model'] = self.model_name
+            if is_empty(row.get('time')):
+                values['time'] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+            with self._lock:
+                if values:
+                    row.update(values)
+                    self.on_result(key, values)
+                    self.on_row_done(key)
+        except Exception as e:
+            self._callback_failed("Finishing row", key, e)
+        finally:
+            self._row_slots.release()
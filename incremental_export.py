@@ -0,0 +1,173 @@
+import json
+import os
+import shutil
+import sqlite3
+
+from export import convert_stream
+
+# Меняется, когда меняется формат примеров (process_json_answer, параметры окон): тогда экспорт строится заново
+EXPORT_VERSION = '1'
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (
+    name TEXT PRIMARY KEY,
+    value TEXT
+);
+-- status: 'done' — примеры строки лежат в шарде, 'writing' — запись была прервана
+CREATE TABLE IF NOT EXISTS exported (
+    key TEXT PRIMARY KEY,
+    answer_hash TEXT NOT NULL,
+    shard INTEGER NOT NULL,
+    examples INTEGER NOT NULL,
+    status TEXT NOT NULL
+);
+"""
+
+
+class IncrementalExporter:
+    """
+    Инкрементальный экспорт примеров GLiNER в шарды JSONL.
+
+    Строка таблицы попадает в шард по своему хэшу текста. Рядом с каждым шардом
+    shard-XX.jsonl лежит shard-XX.keys — ключ строки для каждой строки JSONL. Манифест
+    (manifest.sqlite) помнит для каждой строки хэш ответов LLM, из которых она сконвертирована.
+    Хранилище ведет такой же хэш завершенных строк в колонке answer_hash, поэтому новые
+    и изменившиеся строки находятся одним запросом по индексу (ключ, хэш) без чтения самих
+    ответов, и читаются и разбираются только они. Шарды, из которых нужно убрать устаревшие
+    или удаленные строки, переписываются без разбора JSON.
+
+    :param shard_dir: Папка с шардами и манифестом.
+    :param num_shards: Число шардов.
+    """
+
+    def __init__(self, shard_dir='output/gliner', num_shards=64):
+        self.shard_dir = shard_dir
+        self.num_shards = num_shards
+        os.makedirs(shard_dir, exist_ok=True)
+        self.conn = sqlite3.connect(os.path.join(shard_dir, 'manifest.sqlite'))
+        self.conn.executescript(SCHEMA)
+        self._check_layout()
+
+    def _check_layout(self):
+        meta = dict(self.conn.execute("SELECT name, value FROM meta"))
+        layout = {'version': EXPORT_VERSION, 'num_shards': str(self.num_shards)}
+        if all(meta.get(name) == value for name, value in layout.items()):
+            return
+        # Другая версия формата или другое число шардов — начинаем с чистого листа
+        with self.conn:
+            self.conn.execute("DELETE FROM exported")
+            self.conn.executemany("INSERT OR REPLACE INTO meta (name, value) VALUES (?, ?)", layout.items())
+        for name in os.listdir(self.shard_dir):
+            if name.startswith('shard-'):
+                os.remove(os.path.join(self.shard_dir, name))
+
+    def shard_of(self, key):
+        return int(key[:8], 16) % self.num_shards
+
+    def _paths(self, shard):
+        base = os.path.join(self.shard_dir, f'shard-{shard:02d}')
+        return base + '.jsonl', base + '.keys'
+
+    def export(self, store, workers=None, ordered=True):
+        """
+        Приводит шарды в соответствие с текущим содержимым таблицы.
+
+        :param store: ResultStore; экспортируются его завершенные строки.
+        :param workers: Число процессов для разбора ответов (см. export.convert_stream).
+        :return: Словарь со счетчиками: unchanged, added, changed, deleted, examples, errors.
+        """
+        stats = {'unchanged': 0, 'added': 0, 'changed': 0, 'deleted': 0, 'examples': 0, 'errors': 0}
+        known_rows = self.conn.execute("SELECT COUNT(*) FROM exported").fetchone()[0]
+        self.conn.execute("ATTACH DATABASE ? AS store", (store.path,))
+        files = {}
+        try:
+            # 1. Находим дельту: строки, которых нет в манифесте или у которых изменились ответы
+            # (в том числе недописанные прошлым запуском), и строки, удаленные из таблицы.
+            # Оба запроса идут по индексу texts_answers, сами ответы не читаются
+            delta = self.conn.execute(
+                "SELECT t.hash, t.answer_hash, e.key IS NOT NULL FROM store.texts t "
+                "LEFT JOIN exported e ON e.key = t.hash "
+                "WHERE t.answer_hash IS NOT NULL "
+                "AND (e.key IS NULL OR e.answer_hash != t.answer_hash OR e.status != 'done')"
+            ).fetchall()
+            deleted = self.conn.execute(
+                "SELECT key, shard FROM exported "
+                "WHERE key NOT IN (SELECT hash FROM store.texts WHERE answer_hash IS NOT NULL)"
+            ).fetchall()
+            stats['changed'] = sum(1 for _, _, known in delta if known)
+            stats['added'] = len(delta) - stats['changed']
+            stats['deleted'] = len(deleted)
+            stats['unchanged'] = known_rows - stats['changed'] - stats['deleted']
+
+            # 2. Убираем из шардов удаленные строки и старые примеры строк из дельты
+            removals = {}
+            for key, shard in deleted:
+                removals.setdefault(shard, set()).add(key)
+            for key, _, known in delta:
+                if known:
+                    removals.setdefault(self.shard_of(key), set()).add(key)
+            for shard, keys in removals.items():
+                self._remove_keys(shard, keys)
+            with self.conn:
+                self.conn.executemany("DELETE FROM exported WHERE key = ?", ((key,) for key, _ in deleted))
+                self.conn.executemany(
+                    "INSERT OR REPLACE INTO exported (key, answer_hash, shard, examples, status) "
+                    "VALUES (?, ?, ?, 0, 'writing')",
+                    ((key, digest, self.shard_of(key)) for key, digest, _ in delta),
+                )
+
+            # 3. Читаем и разбираем ответы только строк дельты и дописываем примеры в конец шардов
+            answers = ((key, *self.conn.execute(
+                "SELECT llm_json, llm_summary_json FROM store.texts WHERE hash = ?", (key,)).fetchone())
+                for key, _, _ in delta)
+            done = []
+            for key, result in convert_stream(answers, workers=workers, ordered=ordered):
+                shard = self.shard_of(key)
+                if shard not in files:
+                    jsonl_path, keys_path = self._paths(shard)
+                    files[shard] = (open(jsonl_path, 'a', encoding='utf-8'), open(keys_path, 'a', encoding='utf-8'))
+                jsonl, keys = files[shard]
+                for example in result['examples']:
+                    jsonl.write(json.dumps(example, ensure_ascii=False, separators=(',', ':')) + '\n')
+                    keys.write(key + '\n')
+                stats['examples'] += len(result['examples'])
+                stats['errors'] += len(result['errors'])
+                done.append((len(result['examples']), key))
+        finally:
+            for jsonl, keys in files.values():
+                jsonl.close()
+                keys.close()
+            self.conn.execute("DETACH DATABASE store")
+        with self.conn:
+            self.conn.executemany(
+                "UPDATE exported SET examples = ?, status = 'done' WHERE key = ?", done)
+        return stats
+
+    def _remove_keys(self, shard, keys):
+        """Переписывает шард без строк с ключами keys (потоково, без разбора JSON)."""
+        jsonl_path, keys_path = self._paths(shard)
+        if not os.path.exists(jsonl_path):
+            return
+        with open(jsonl_path, 'r', encoding='utf-8') as jsonl, open(keys_path, 'r', encoding='utf-8') as key_lines, \
+                open(jsonl_path + '.tmp', 'w', encoding='utf-8') as jsonl_out, \
+                open(keys_path + '.tmp', 'w', encoding='utf-8') as keys_out:
+            for line, key in zip(jsonl, key_lines):
+                if key.rstrip('\n') in keys:
+                    continue
+                jsonl_out.write(line)
+                keys_out.write(key)
+        os.replace(jsonl_path + '.tmp', jsonl_path)
+        os.replace(keys_path + '.tmp', keys_path)
+
+    def merge(self, output_path):
+        """Склеивает все шарды в один JSONL-файл (для инструментов, которым нужен единый файл)."""
+        with open(output_path + '.tmp', 'w', encoding='utf-8') as out:
+            for shard in range(self.num_shards):
+                jsonl_path, _ = self._paths(shard)
+                if os.path.exists(jsonl_path):
+                    with open(jsonl_path, 'r', encoding='utf-8') as f:
+                        shutil.copyfileobj(f, out)
+        os.replace(output_path + '.tmp', output_path)
+
+    def close(self):
+        self.conn.close()
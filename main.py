@@ -1,28 +1,26 @@
-import pandas as pd
 import os
-from time import sleep
-from datetime import datetime
 from dotenv import load_dotenv
 import logging
-import json
 import argparse
 import traceback
 
-from data_sources import get_source
-from providers import get_provider
-from parse_LLM_output import process_json_answer
+from data_sources import get_source, batched
+from providers import get_provider, ResponseCache
+from providers import clients
+from providers.usage import summarize_rows, tracker
+from fill_engine import FillEngine
+from result_store import ResultStore
+from export import export_examples
+from incremental_export import IncrementalExporter
+from batch_jobs import BatchJob
 
 load_dotenv()
 
-# llm_provider = get_provider("openai")
-llm_provider = get_provider("structured_openai")
-
-
 # input_file = 'input_data/2023.json'
 # input_file = 'input_data/shorter.json'
 input_file = "input_data/4pages.txt"
 
-output_file = "output/gliner.json"
+output_file = "output/gliner.jsonl"
 
 
 # load_data = get_source("telegram")
@@ -31,17 +29,6 @@ output_file = "output/gliner.json"
 load_data = get_source("splitter")
 
 
-
-parser = argparse.ArgumentParser()
-parser.add_argument('--export', action='store_true', help="Skip csv creation, just export the existing one.")
-parser.add_argument('--delay', type=int, help="Set the delay time in seconds.", default=0)
-args = parser.parse_args()
-
-delay = args.delay
-
-column_names = ['full text', 'summary', 'LLM json', 'LLM summary json', 'score_reason', 'score', 'model', 'time']
-
-
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.DEBUG)
 
@@ -55,100 +42,245 @@ ch.setFormatter(formatter)
 
 # Add the handler to the logger
 logger.addHandler(ch)
+# Сообщения модулей (fill_engine, export, ...) выводим тем же обработчиком
+logging.getLogger().addHandler(ch)
+logging.getLogger().setLevel(logging.WARNING)
+# Модули проекта пишут INFO редко (ход пакетных заданий Batch API, состояние бэкендов роутера),
+# а сторонние библиотеки (openai, httpx) остаются на WARNING, иначе INFO пишется о каждом запросе
+for name in ('batch_jobs', 'fill_engine', 'export', 'incremental_export', 'dedup', 'result_store',
+             'providers', 'data_sources'):
+    logging.getLogger(name).setLevel(logging.INFO)
+logger.propagate = False
+
+
+def add_texts_to_table(store):
+    # Фильтры по id и дате поддерживает источник telegram, размеры чанков — источник splitter
+    source_options = {
+        name: value
+        for name, value in (
+            ('since_id', args.since_id), ('date_from', args.date_from), ('date_to', args.date_to),
+            ('chunk_size', args.chunk_size), ('overlap', args.chunk_overlap), ('unit', args.chunk_unit),
+            ('mode', args.chunk_mode),
+        )
+        if value is not None
+    }
+    new_texts = load_data(input_file, **source_options)
+
+    # Источник читается лениво и добавляется пачками, поэтому в памяти только одна пачка.
+    # Тексты, которые уже есть в хранилище, отсекаются по индексу хэшей
+    stats = {'added': 0, 'duplicates': 0, 'near_duplicates': 0}
+    # Источник folder отмечает файлы прочитанными только после того, как пачка сохранена
+    commit = getattr(new_texts, 'commit', None)
+    for batch in batched(new_texts, args.ingest_batch):
+        batch_stats = store.add_texts(
+            batch,
+            near_duplicates=args.near_duplicates,
+            threshold=args.near_duplicate_threshold,
+        )
+        if commit:
+            commit()
+        for name, value in batch_stats.items():
+            stats[name] += value
+    if hasattr(new_texts, 'close'):
+        new_texts.close()
+
+    logger.info(
+        f"Added {stats['added']} new texts (skipped {stats['duplicates']} duplicates, "
+        f"{stats['near_duplicates']} near-duplicates), total rows in store: {len(store)}"
+    )
+
+
+def fill_table(store):
+    total = len(store)
+
+    def on_result(row_id, values):
+        store.update(row_id, values)
+
+    def on_row_done(row_id):
+        logger.info(f"Row number {row_id}/{total} processed...")
+        if llm_provider.limiter:
+            logger.debug(f"Rate limiter: {llm_provider.limiter.metrics()}")
+
+    engine = FillEngine(
+        llm_provider,
+        on_result=on_result,
+        on_row_done=on_row_done,
+        max_in_flight=args.workers,
+        model_name=llm_provider.model,
+        batch_size=args.batch_size,
+        on_usage=lambda row_id, stage, usage: store.add_usage(row_id, {stage: usage}),
+    )
+    engine.run(store.pending())
+
+
+def log_usage(title, totals):
+    """Логирует суммы usage по (модель, стадия), см. providers.usage."""
+    for usage in totals:
+        per_row = ""
+        if usage.get('rows'):
+            per_row = f", {(usage['prompt_tokens'] + usage['completion_tokens']) / usage['rows']:.0f} tokens per row"
+        logger.info(
+            f"{title} {usage['model']} / {usage['stage']}: {usage['calls']:.0f} calls, "
+            f"{usage['prompt_tokens']} prompt tokens ({usage['cached_tokens']} cached), "
+            f"{usage['completion_tokens']} completion tokens, {usage['avg_latency']:.2f}s per call{per_row}"
+        )
+
+
+def fill_table_batch(store):
+    job = BatchJob(
+        llm_provider,
+        store,
+        state_path=args.batch_state,
+        poll_interval=args.poll_interval,
+    )
+    stats = job.run()
+    logger.info(
+        f"Batch jobs done: {stats['batches']} batch(es), {stats['succeeded']} answers saved, "
+        f"{stats['failed']} failed requests"
+    )
+
+
+def export_table_incremental(store):
+    exporter = IncrementalExporter(args.shard_dir)
+    stats = exporter.export(store, workers=args.export_workers, ordered=not args.unordered)
+    logger.info(
+        f"Updated shards in {args.shard_dir}: {stats['added']} added, {stats['changed']} changed, "
+        f"{stats['deleted']} deleted, {stats['unchanged']} unchanged rows; "
+        f"{stats['examples']} new examples, parse errors: {stats['errors']}"
+    )
+    if args.merge:
+        exporter.merge(args.output)
+        logger.info(f"Merged shards into {args.output}")
+    exporter.close()
+
+
+def export_table(store):
+    rows = (
+        (row_id, row['LLM json'], row['LLM summary json'])
+        for row_id, row in store.iter_rows(complete=True)
+    )
+    stats = export_examples(
+        rows,
+        args.output,
+        json_path=args.json_output,
+        workers=args.export_workers,
+        ordered=not args.unordered,
+    )
+    logger.info(
+        f"Saved data to {args.output}. Rows: {stats['rows']}, examples: {stats['examples']}, "
+        f"parse errors: {stats['errors']}"
+    )
 
 
-
-def save_data_to_file(data, filepath):
-    """Saves the processed data to a JSON file."""
-    with open(filepath, 'w', encoding='utf-8') as f:
-        json.dump(data, f, ensure_ascii=False, indent=4)
-
-
-def add_texts_to_table(file_path = 'texts.csv'):
-    # Check if the file exists
-    if os.path.exists(file_path):
-        existing_df = pd.read_csv(file_path)
-    else:
-        existing_df = pd.DataFrame(columns=column_names)
-
-    new_texts = (load_data(input_file))
-
-    # Filter out texts that are already in the DataFrame
-    new_texts_to_add = [text for text in new_texts if text not in existing_df['full text'].values]
-
-    # Create a DataFrame from the new texts to add
-    new_df = pd.DataFrame({'full text': new_texts_to_add})
-
-    # Append the new DataFrame to the existing DataFrame
-    updated_df = pd.concat([existing_df, new_df], ignore_index=True)
-
-    # Save the updated DataFrame back to the CSV file
-    updated_df.to_csv(file_path, index=False)
-
-    logger.info(f"Length of CSV file is: {len(updated_df)}")
-
-
-def fill_table(file_path='texts.csv'):
-    df = pd.read_csv(file_path).astype(str)
-
-    for index, row in df.iterrows():
-        if (df.at[index, 'score_reason'] == 'nan'):
-            score = llm_provider.rate(df.at[index, 'full text'])
-            score = score.replace("```json", '').replace("```", '')
-            logger.debug(score)
-            score = json.loads(score)
-            df.at[index, 'score_reason'] = score['reasoning_behind_score']
-            df.at[index, 'score'] = score['score']
-            sleep(delay)
-
-        if (df.at[index, 'summary'] == 'nan'):
-            df.at[index, 'summary'] = llm_provider.summarize(df.at[index, 'full text'])
-            logger.debug(df.at[index, 'summary'])
-            sleep(delay)
-        if (df.at[index, 'LLM json'] == 'nan'):
-            df.at[index, 'LLM json'] = llm_provider.annotate(df.at[index, 'full text'])
-            sleep(delay)
-        if (df.at[index, 'LLM summary json'] == 'nan'):
-            df.at[index, 'LLM summary json'] = llm_provider.annotate(df.at[index, 'summary'])
-            sleep(delay)
-        
-        # add info about model and time
-        if (df.at[index, 'model'] == 'nan'):
-            df.at[index, 'model'] = os.environ["MODEL"]
-        if (df.at[index, 'time'] == 'nan'): 
-            df.at[index, 'time'] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-            full = False
-            df.to_csv('texts.csv', index=False)
-            logger.info(f"Row number {index+1}/{len(df)} processed...")
-
-if not args.export:
-    # создает таблицу с текстами, или добавлет те которых нет
-    add_texts_to_table()
-    logger.info("CSV file created...")
-    while True: 
-        try:
-            fill_table()
-            break
-        except Exception as e:
-            logger.error(f"Got Exception: {e}\n{traceback.format_exc()}")
-        
-df = pd.read_csv('texts.csv')
-
-df.replace(['nan', 'NaN'], pd.NA, inplace=True)
-df = df.dropna(how='any')
-processed_output = []
-for index, text in enumerate(df['LLM json']):
-    result = (process_json_answer(text))
-    if result:
-        processed_output += result
-    else:
-        logger.error(f"Error processing text: {text} in row {index}")
-for index, text in enumerate(df['LLM summary json']):
-    result = (process_json_answer(text))
-    if result:
-        processed_output += result
+parser = argparse.ArgumentParser()
+parser.add_argument('--export', action='store_true', help="Skip filling the table, just export the existing one.")
+parser.add_argument('--delay', type=int, help="Deprecated: minimum seconds between requests, same as --rpm 60/delay.", default=0)
+parser.add_argument('--provider', help="LLM provider: structured_openai, openai, gemini, local (llama.cpp) or router (several backends from ROUTER_* in .env).", default='structured_openai')
+parser.add_argument('--rpm', type=float, help="Requests per minute limit for the provider (default: <PROVIDER>_RPM / RPM from .env).")
+parser.add_argument('--tpm', type=float, help="Tokens per minute limit for the provider (default: <PROVIDER>_TPM / TPM from .env).")
+parser.add_argument('--workers', type=int, help="Maximum number of concurrent LLM requests.", default=4)
+parser.add_argument('--max-connections', type=int, help="Connection pool size of the shared HTTP client (default: OPENAI_MAX_CONNECTIONS or 100).")
+parser.add_argument('--http2', action='store_true', help="Use HTTP/2 for LLM requests (needs the h2 package).")
+parser.add_argument('--batch-size', type=int, help="Pack up to this many texts into one annotate/rate request.", default=1)
+parser.add_argument('--batch-tokens', type=int, help="Token budget of the texts packed into one batched request.")
+parser.add_argument('--batch-job', action='store_true', help="Fill the table through the OpenAI Batch API instead of synchronous requests.")
+parser.add_argument('--batch-state', help="State file of the batch job mode, lets an interrupted run resume.", default='batch_state.json')
+parser.add_argument('--poll-interval', type=float, help="Seconds between batch status checks.", default=30)
+parser.add_argument('--since-id', type=int, help="Telegram: only ingest messages with a larger id.")
+parser.add_argument('--date-from', help="Telegram: only ingest messages from this date (ISO format).")
+parser.add_argument('--date-to', help="Telegram: only ingest messages up to this date (ISO format).")
+parser.add_argument('--chunk-size', type=int, help="Splitter: maximum chunk size in --chunk-unit (default: 1000).")
+parser.add_argument('--chunk-overlap', type=int, help="Splitter: overlap between neighbouring chunks in --chunk-unit (default: 200).")
+parser.add_argument('--chunk-unit', choices=('chars', 'tokens', 'tiktoken'), help="Splitter: measure chunks in characters, GLiNER tokens or LLM tokens (tiktoken); tokens need --chunk-mode sentences.")
+parser.add_argument('--chunk-mode', choices=('lines', 'sentences'), help="Splitter: 'lines' keeps the old character chunks (default), 'sentences' cuts at sentence boundaries; switching re-annotates the whole input once.")
+parser.add_argument('--ingest-batch', type=int, help="Number of source texts added to the store per transaction.", default=1000)
+parser.add_argument('--near-duplicates', action='store_true', help="Skip reposts with small edits (MinHash/LSH).")
+parser.add_argument('--near-duplicate-threshold', type=float, help="Jaccard similarity above which a text is a near-duplicate.", default=0.8)
+parser.add_argument('--cache', metavar='PATH', help="LLM response cache file (default: LLM_CACHE from .env or llm_cache.sqlite).")
+parser.add_argument('--no-cache', action='store_true', help="Do not use the LLM response cache.")
+parser.add_argument('--cache-read-only', action='store_true', help="Use cached responses but never write new ones.")
+parser.add_argument('--cache-ttl', type=float, help="Ignore cached responses older than this many seconds.")
+parser.add_argument('--usage-report', action='store_true', help="Log token usage and latency per model and stage, summed over the rows in the store.")
+parser.add_argument('--db', help="Path to the SQLite result store.", default='texts.sqlite')
+parser.add_argument('--import-csv', metavar='PATH', help="Import an existing texts.csv into the store.")
+parser.add_argument('--export-csv', metavar='PATH', help="Export the store to a CSV file in the texts.csv format.")
+parser.add_argument('--output', help="GLiNER examples in JSONL format.", default=output_file)
+parser.add_argument('--json-output', metavar='PATH', help="Also write the examples as one compact JSON array.")
+parser.add_argument('--export-workers', type=int, help="Processes used to parse LLM answers (default: CPU count, 1 disables the pool).")
+parser.add_argument('--incremental', action='store_true', help="Only convert new or changed rows, keeping examples in JSONL shards.")
+parser.add_argument('--shard-dir', help="Directory with incremental export shards.", default='output/gliner')
+parser.add_argument('--merge', action='store_true', help="With --incremental, also concatenate the shards into --output.")
+parser.add_argument('--unordered', action='store_true', help="Write examples as soon as they are parsed, not in table order.")
+
+
+if __name__ == '__main__':
+    args = parser.parse_args()
+
+    # Соединения держим открытыми хотя бы для всех одновременных запросов (по умолчанию пул хранит 20)
+    clients.configure(
+        max_connections=args.max_connections,
+        max_keepalive_connections=args.workers if args.workers > 20 else None,
+        http2=args.http2 or None,
+    )
+
+    llm_provider = get_provider(args.provider)
+
+    if llm_provider.limiter:
+        rpm = args.rpm or (60 / args.delay if args.delay else None)
+        llm_provider.limiter.configure(rpm=rpm, tpm=args.tpm)
+    elif args.rpm or args.tpm or args.delay:
+        logger.warning(f"Provider '{args.provider}' has no rate limiter, --rpm/--tpm/--delay are ignored")
+
+    llm_provider.batch_size = args.batch_size
+    if args.batch_tokens:
+        llm_provider.batch_tokens = args.batch_tokens
+
+    if not args.no_cache:
+        llm_provider.cache = ResponseCache.from_env(
+            path=args.cache,
+            read_only=args.cache_read_only or None,
+            ttl=args.cache_ttl,
+        )
+
+    # Первый запуск после перехода на SQLite: переносим накопленную таблицу
+    first_run = not os.path.exists(args.db)
+    store = ResultStore(args.db)
+    if args.import_csv or (first_run and os.path.exists('texts.csv')):
+        imported = store.import_csv(args.import_csv or 'texts.csv')
+        logger.info(f"Imported {imported} rows from CSV into {args.db}")
+
+    if not args.export:
+        # добавляет в хранилище тексты, которых там еще нет
+        add_texts_to_table(store)
+        if args.batch_job:
+            fill_table_batch(store)
+        else:
+            while True:
+                try:
+                    fill_table(store)
+                    break
+                except Exception as e:
+                    logger.error(f"Got Exception: {e}\n{traceback.format_exc()}")
+        if llm_provider.cache:
+            logger.info(f"LLM cache: {llm_provider.cache.stats()}")
+        usage = llm_provider.usage_stats()
+        logger.info(
+            f"LLM usage: {usage['requests']} requests, {usage['prompt_tokens']} prompt tokens "
+            f"({usage['cached_tokens']} served from the provider's prefix cache, {usage['cached_share']:.0%}), "
+            f"{usage['completion_tokens']} completion tokens"
+        )
+        log_usage("This run:", tracker.summary())
+        if args.provider == 'router':
+            logger.info(f"Router: {llm_provider.metrics()}")
+
+    if args.usage_report:
+        log_usage("Stored usage:", summarize_rows(store.iter_usage()))
+
+    if args.export_csv:
+        exported = store.export_csv(args.export_csv)
+        logger.info(f"Exported {exported} rows to {args.export_csv}")
+
+    if args.incremental:
+        export_table_incremental(store)
     else:
-        logger.error(f"Error processing summary text: {text} in row {index}")
-
-save_data_to_file(processed_output, output_file)
-logger.info(f"Saved data to {output_file}. Total rows: {len(processed_output)}, Full text rows: {len(processed_output) / 2}")
\ No newline at end of file
+        export_table(store)
@@ -0,0 +1,411 @@
+"""
+Локальная заглушка OpenAI API для проверки провайдеров и пакетного режима без сети.
+
+Поддерживает /v1/chat/completions, /v1/files (загрузка и содержимое) и /v1/batches
+(создание, статус, список). Ответы детерминированы: для запросов со схемой response_format
+строится объект по схеме, в котором текст берется из запроса, сущности — слова текста с заглавной
+буквы, а пакетные ответы (items) содержат по элементу на каждый id запроса; без схемы
+возвращается начало текста. Повторный системный промпт отмечается в usage как взятый из кэша префиксов.
+Задание проходит статусы validating -> in_progress -> completed за несколько опросов.
+
+Для нагрузочных прогонов chat.completions можно замедлить (логнормальная задержка с медианой
+--latency), отвечать 500 с вероятностью --error-rate и 429 с Retry-After — случайно
+(--rate-limit-rate) или при превышении --rpm. Счетчики заглушки — GET /v1/mock/stats.
+
+Запуск: python mock_server.py --port 8000, затем BASE_URL=http://127.0.0.1:8000/v1
+"""
+import argparse
+import hashlib
+import json
+import math
+import random
+import re
+import threading
+import time
+import uuid
+from collections import Counter, deque
+from contextlib import nullcontext
+from email.parser import BytesParser
+from email.policy import HTTP
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+# Типы «сущностей» заглушки; тип выбирается по хэшу слова
+ENTITY_TYPES = ['Лицо', 'Организация', 'Место', 'Дата', 'Документ']
+
+_CAPITALIZED = re.compile(r'\b[A-ZА-ЯЁ][\w-]+')
+
+
+def _digest(text):
+    return int(hashlib.sha256(text.encode('utf-8')).hexdigest()[:8], 16)
+
+
+def mock_entities(text, limit=8):
+    """Детерминированные сущности текста: первые limit различных слов с заглавной буквы."""
+    names = list(dict.fromkeys(_CAPITALIZED.findall(text)))[:limit]
+    return [{'entity': name, 'types': [ENTITY_TYPES[_digest(name) % len(ENTITY_TYPES)]]} for name in names]
+
+
+def request_texts(body):
+    """
+    Тексты из сообщения пользователя.
+
+    :return: Список пар (id, текст): для пакетного запроса — по элементу JSON-списка, иначе [(None, текст)].
+    """
+    user = ''.join(str(m.get('content', '')) for m in body.get('messages', []) if m.get('role') == 'user')
+    start = user.find('[{')
+    if start != -1:
+        try:
+            return [(item['id'], item['text']) for item in json.loads(user[start:])]
+        except (ValueError, KeyError, TypeError):
+            pass
+    # Одиночные промпты: «Входной текст:\n...», «Текст для анализа: ...», «Text:\n...»
+    _, sep, text = user.partition(':')
+    return [(None, text.strip() if sep else user)]
+
+
+def example_from_schema(schema, defs=None, seed='', context=None):
+    """
+    Объект, удовлетворяющий JSON Schema.
+
+    :param context: Словарь с ключами texts (список пар (id, текст) запроса), id и text — текущий текст.
+                    Свойства text, id, entities и items заполняются по нему, enum выбирается по хэшу текста.
+                    Без context строится минимальный объект (строки детерминированно зависят от seed).
+    """
+    defs = defs if defs is not None else schema.get('$defs', {})
+    context = context or {}
+    if '$ref' in schema:
+        return example_from_schema(defs[schema['$ref'].split('/')[-1]], defs, seed, context)
+    if 'anyOf' in schema:
+        return example_from_schema(schema['anyOf'][0], defs, seed, context)
+    if 'enum' in schema:
+        if context.get('text') is None:
+            return schema['enum'][0]
+        return schema['enum'][_digest(context['text'] + seed) % len(schema['enum'])]
+    kind = schema.get('type')
+    if kind == 'object':
+        result = {}
+        for name, prop in schema.get('properties', {}).items():
+            if name == 'items' and context.get('texts'):
+                item_schema = prop.get('items', {})
+                result[name] = [example_from_schema(item_schema, defs, f'{seed}.{name}', dict(context, id=i, text=text))
+                                for i, text in context['texts']]
+            elif name == 'entities' and context.get('text') is not None:
+                result[name] = mock_entities(context['text'])
+            elif name == 'text' and context.get('text') is not None:
+                result[name] = context['text']
+            elif name == 'id' and context.get('id') is not None:
+                result[name] = context['id']
+            else:
+                result[name] = example_from_schema(prop, defs, f'{seed}.{name}', context)
+        return result
+    if kind == 'array':
+        return [example_from_schema(schema.get('items', {}), defs, seed + '[0]', context)]
+    if kind == 'integer':
+        return 0
+    if kind == 'number':
+        return 0.0
+    if kind == 'boolean':
+        return False
+    if kind == 'null':
+        return None
+    return f"stub{seed}"
+
+
+def complete(body, prefix_cache=None, lock=None):
+    """
+    Детерминированный ответ chat.completions на тело запроса.
+
+    :param prefix_cache: Множество уже виденных системных промптов: если системный промпт
+                         запроса уже был, его токены считаются взятыми из кэша префиксов (cached_tokens).
+    :param lock: Блокировка, под которой читается и обновляется prefix_cache (None — вызывающий уже держит ее).
+    """
+    prompt = ''.join(str(m.get('content', '')) for m in body.get('messages', []))
+    system = ''.join(str(m.get('content', '')) for m in body.get('messages', []) if m.get('role') == 'system')
+    cached_tokens = 0
+    if prefix_cache is not None and system:
+        with lock or nullcontext():
+            seen = system in prefix_cache
+            prefix_cache.add(system)
+        if seen:
+            cached_tokens = len(system) // 3
+    digest = hashlib.sha256(prompt.encode('utf-8')).hexdigest()[:12]
+    texts = request_texts(body)
+    response_format = body.get('response_format') or {}
+    if response_format.get('type') == 'json_schema':
+        context = {'texts': texts if texts[0][0] is not None else None, 'id': texts[0][0], 'text': texts[0][1]}
+        content = json.dumps(example_from_schema(response_format['json_schema']['schema'], context=context),
+                             ensure_ascii=False)
+    else:
+        # Вместо краткого содержания — начало текста, чтобы его разметка тоже находила сущности
+        content = ' '.join(texts[0][1].split()[:40]) or f"stub answer {digest}"
+    prompt_tokens = max(1, len(prompt) // 3)
+    completion_tokens = max(1, len(content) // 3)
+    return {
+        'id': f'chatcmpl-{digest}',
+        'object': 'chat.completion',
+        'created': int(time.time()),
+        'model': body.get('model', 'stub'),
+        'choices': [{
+            'index': 0,
+            'message': {'role': 'assistant', 'content': content, 'refusal': None},
+            'finish_reason': 'stop',
+            'logprobs': None,
+        }],
+        'usage': {
+            'prompt_tokens': prompt_tokens,
+            'completion_tokens': completion_tokens,
+            'total_tokens': prompt_tokens + completion_tokens,
+            'prompt_tokens_details': {'cached_tokens': cached_tokens},
+        },
+    }
+
+
+def percentiles(values, points=(50, 90, 99)):
+    """Перцентили (ближайший ранг) и максимум списка чисел; пустой список — нули."""
+    values = sorted(values)
+    result = {f'p{point}': values[min(len(values) - 1, math.ceil(point / 100 * len(values)) - 1)] if values else 0.0
+              for point in points}
+    result['max'] = values[-1] if values else 0.0
+    return result
+
+
+class MockState:
+    """
+    Файлы и задания заглушки в памяти и поведение chat.completions под нагрузкой.
+
+    :param latency: Медиана задержки ответа chat.completions в секундах (0 — без задержки).
+    :param latency_sigma: Сигма логнормального распределения задержки (0 — всегда latency).
+    :param error_rate: Доля ответов 500.
+    :param rate_limit_rate: Доля ответов 429 (Retry-After: 1).
+    :param rpm: Лимит запросов в минуту; сверх него — 429 с Retry-After до освобождения окна.
+    :param seed: Зерно генератора случайных задержек и ошибок.
+    """
+
+    # Сколько опросов задание проводит в каждом незавершенном статусе
+    polls_per_status = 1
+
+    def __init__(self, latency=0.0, latency_sigma=0.0, error_rate=0.0, rate_limit_rate=0.0, rpm=None, seed=0):
+        self.lock = threading.Lock()
+        self.files = {}
+        self.batches = {}
+        self.prefixes = set()
+        self.latency = latency
+        self.latency_sigma = latency_sigma
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.rpm = rpm
+        self.random = random.Random(seed)
+        self.counts = Counter()
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.latencies = []
+        self._sent = deque()
+
+    def admit(self):
+        """
+        Решает судьбу очередного запроса chat.completions (вызывается под lock).
+
+        :return: Тройка (HTTP-статус, задержка в секундах, Retry-After или None).
+        """
+        self.counts['requests'] += 1
+        now = time.monotonic()
+        if self.rpm:
+            while self._sent and self._sent[0] <= now - 60:
+                self._sent.popleft()
+            if len(self._sent) >= self.rpm:
+                self.counts['rate_limited'] += 1
+                return 429, 0.0, max(1, math.ceil(self._sent[0] + 60 - now))
+            self._sent.append(now)
+        if self.random.random() < self.rate_limit_rate:
+            self.counts['rate_limited'] += 1
+            return 429, 0.0, 1
+        delay = self.latency * math.exp(self.random.gauss(0, self.latency_sigma)) if self.latency else 0.0
+        if self.random.random() < self.error_rate:
+            self.counts['server_errors'] += 1
+            return 500, delay, None
+        return 200, delay, None
+
+    def stats(self):
+        """Счетчики запросов, текущая и максимальная очередь и перцентили времени обработки chat.completions."""
+        return {
+            'requests': self.counts['requests'], 'ok': self.counts['ok'],
+            'server_errors': self.counts['server_errors'], 'rate_limited': self.counts['rate_limited'],
+            'in_flight': self.in_flight, 'max_in_flight': self.max_in_flight,
+            'latency': percentiles(self.latencies),
+        }
+
+    def add_file(self, data, filename, purpose):
+        file_id = f'file-{uuid.uuid4().hex[:24]}'
+        self.files[file_id] = {
+            'object': {
+                'id': file_id, 'object': 'file', 'bytes': len(data), 'created_at': int(time.time()),
+                'filename': filename, 'purpose': purpose, 'status': 'processed',
+            },
+            'data': data,
+        }
+        return self.files[file_id]['object']
+
+    def create_batch(self, request):
+        batch_id = f'batch_{uuid.uuid4().hex[:24]}'
+        lines = self.files[request['input_file_id']]['data'].decode('utf-8').splitlines()
+        self.batches[batch_id] = {
+            'object': {
+                'id': batch_id, 'object': 'batch', 'endpoint': request['endpoint'],
+                'input_file_id': request['input_file_id'], 'completion_window': request['completion_window'],
+                'status': 'validating', 'created_at': int(time.time()), 'output_file_id': None,
+                'error_file_id': None, 'errors': None, 'metadata': request.get('metadata'),
+                'request_counts': {'total': len([line for line in lines if line.strip()]), 'completed': 0, 'failed': 0},
+            },
+            'polls': 0,
+        }
+        return self.batches[batch_id]['object']
+
+    def poll_batch(self, batch_id):
+        batch = self.batches[batch_id]
+        obj = batch['object']
+        batch['polls'] += 1
+        if obj['status'] in ('validating', 'in_progress') and batch['polls'] > self.polls_per_status:
+            batch['polls'] = 0
+            if obj['status'] == 'validating':
+                obj['status'] = 'in_progress'
+            else:
+                self._run_batch(obj)
+        return obj
+
+    def _run_batch(self, obj):
+        output = []
+        for line in self.files[obj['input_file_id']]['data'].decode('utf-8').splitlines():
+            if not line.strip():
+                continue
+            request = json.loads(line)
+            output.append(json.dumps({
+                'id': f'batch_req_{uuid.uuid4().hex[:24]}',
+                'custom_id': request['custom_id'],
+                'response': {'status_code': 200, 'request_id': uuid.uuid4().hex, 'body': complete(request['body'], self.prefixes)},
+                'error': None,
+            }, ensure_ascii=False))
+        data = ('\n'.join(output) + '\n').encode('utf-8')
+        obj['output_file_id'] = self.add_file(data, f"{obj['id']}_output.jsonl", 'batch_output')['id']
+        obj['request_counts']['completed'] = len(output)
+        obj['status'] = 'completed'
+        obj['completed_at'] = int(time.time())
+
+
+class MockHandler(BaseHTTPRequestHandler):
+    state = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, payload, status=200, headers=None):
+        data = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, str(value))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _not_found(self):
+        self._send_json({'error': {'message': f'Unknown path {self.path}', 'type': 'invalid_request_error'}}, 404)
+
+    def _body(self):
+        return self.rfile.read(int(self.headers.get('Content-Length', 0)))
+
+    def _chat_completion(self):
+        state = self.state
+        started = time.perf_counter()
+        # Блокировка нужна только счетчикам и кэшу префиксов: чтение тела, задержка и сборка ответа
+        # идут параллельно, как у настоящего API
+        body = json.loads(self._body())
+        with state.lock:
+            status, delay, retry_after = state.admit()
+            state.in_flight += 1
+            state.max_in_flight = max(state.max_in_flight, state.in_flight)
+        time.sleep(delay)
+        response = complete(body, state.prefixes, state.lock) if status == 200 else None
+        with state.lock:
+            state.in_flight -= 1
+            state.latencies.append(time.perf_counter() - started)
+            if status == 200:
+                state.counts['ok'] += 1
+        if status == 429:
+            return self._send_json({'error': {'message': 'Rate limit reached (mock)', 'type': 'requests',
+                                              'code': 'rate_limit_exceeded'}}, 429, {'Retry-After': retry_after})
+        if status != 200:
+            return self._send_json({'error': {'message': 'Internal server error (mock)', 'type': 'server_error'}}, status)
+        self._send_json(response)
+
+    def do_POST(self):
+        path = self.path.split('?')[0].rstrip('/')
+        if path.endswith('/chat/completions'):
+            return self._chat_completion()
+        with self.state.lock:
+            if path.endswith('/files'):
+                message = BytesParser(policy=HTTP).parsebytes(
+                    f"Content-Type: {self.headers['Content-Type']}\r\n\r\n".encode('utf-8') + self._body())
+                fields = {part.get_param('name', header='content-disposition'): part for part in message.iter_parts()}
+                file_part = fields['file']
+                return self._send_json(self.state.add_file(
+                    file_part.get_payload(decode=True), file_part.get_filename(),
+                    fields['purpose'].get_payload(decode=True).decode('utf-8')))
+            if path.endswith('/batches'):
+                return self._send_json(self.state.create_batch(json.loads(self._body())))
+        self._not_found()
+
+    def do_GET(self):
+        path = self.path.split('?')[0].rstrip('/')
+        parts = path.split('/')
+        with self.state.lock:
+            if path.endswith('/mock/stats'):
+                return self._send_json(self.state.stats())
+            if path.endswith('/batches'):
+                data = [batch['object'] for batch in reversed(list(self.state.batches.values()))]
+                return self._send_json({'object': 'list', 'data': data, 'has_more': False,
+                                        'first_id': data[0]['id'] if data else None,
+                                        'last_id': data[-1]['id'] if data else None})
+            if len(parts) >= 2 and parts[-2] == 'batches' and parts[-1] in self.state.batches:
+                return self._send_json(self.state.poll_batch(parts[-1]))
+            if len(parts) >= 3 and parts[-1] == 'content' and parts[-2] in self.state.files:
+                data = self.state.files[parts[-2]]['data']
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/octet-stream')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+                return
+            if len(parts) >= 2 and parts[-1] in self.state.files:
+                return self._send_json(self.state.files[parts[-1]]['object'])
+        self._not_found()
+
+
+def serve(host='127.0.0.1', port=8000, **options):
+    """
+    Создает сервер заглушки (запуск — server.serve_forever(), адрес — server.server_address,
+    состояние — server.RequestHandlerClass.state).
+
+    :param options: Параметры MockState (latency, latency_sigma, error_rate, rate_limit_rate, rpm, seed).
+    """
+    handler = type('Handler', (MockHandler,), {'state': MockState(**options)})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    return server
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Local stub of the OpenAI chat, files and batches API.")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--latency', type=float, default=0.0, help="Median chat.completions latency, seconds.")
+    parser.add_argument('--latency-sigma', type=float, default=0.0, help="Sigma of the log-normal latency distribution.")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="Share of chat.completions answered with 500.")
+    parser.add_argument('--rate-limit-rate', type=float, default=0.0, help="Share of chat.completions answered with 429.")
+    parser.add_argument('--rpm', type=int, help="Answer 429 above this many chat.completions per minute.")
+    parser.add_argument('--seed', type=int, default=0, help="Seed of the latency and error generator.")
+    args = parser.parse_args()
+    server = serve(args.host, args.port, latency=args.latency, latency_sigma=args.latency_sigma,
+                   error_rate=args.error_rate, rate_limit_rate=args.rate_limit_rate, rpm=args.rpm, seed=args.seed)
+    print(f"Mock OpenAI API on http://{args.host}:{args.port}/v1")
+    server.serve_forever()
@@ -1,40 +1,199 @@
+import argparse
+import logging
 import sys
-import json
+from bisect import bisect_right, bisect_left
 from PyQt5.QtWidgets import (
     QApplication, QMainWindow, QWidget, QVBoxLayout, QHBoxLayout,
-    QPushButton, QLabel, QComboBox, QListWidget, QMessageBox, QScrollArea, QLineEdit, QGridLayout
+    QPushButton, QLabel, QComboBox, QListWidget, QMessageBox, QScrollArea, QLineEdit
 )
-from PyQt5.QtCore import Qt
-from PyQt5.QtGui import QColor
-
-class WordButton(QPushButton):
-    def __init__(self, text, index):
-        super().__init__(text)
-        self.index = index
-        self.setCheckable(True)
-        self.setStyleSheet("""
-            QPushButton {
-                border: 1px solid #999;
-                padding: 2px;
-                margin: 1px;
-                border-radius: 3px;
-                min-width: 50px;
-            }
-            QPushButton:checked {
-                background-color: #ffd700;
-            }
-        """
-        )
+from PyQt5.QtCore import Qt, QRect, QTimer
+from PyQt5.QtGui import QColor, QFontMetrics, QPainter, QPalette, QRegion
+
+from annotation_store import AnnotationStore
+
+# Как часто несохраненные правки дописываются в журнал
+AUTOSAVE_INTERVAL_MS = 30_000
+
+class TokenView(QWidget):
+    """
+    Токены примера в одном виджете, который сам раскладывает, рисует и обрабатывает клики.
+
+    Раскладка (прямоугольники токенов по строкам) считается один раз при смене примера или ширины,
+    клики находят токен бинарным поиском по строкам, а при изменении разметки или выделения
+    перерисовываются только прямоугольники изменившихся токенов.
+
+    Выделение: первый клик ставит начало, второй — конец (можно и протянуть мышью).
+    """
+
+    padding = 4
+    spacing = 3
+    border_color = QColor('#999999')
+    selection_color = QColor('#ffd700')
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.tokens = []
+        self._widths = []
+        self._rects = []
+        self._row_tops = []  # верх каждой строки раскладки
+        self._row_starts = []  # номер первого токена каждой строки
+        self._colors = []  # цвет разметки каждого токена или None
+        self._layout_width = None
+        self._selection = None
+        self._anchor = None
+        self._dragging = False
+        self.setMouseTracking(False)
+        self.setCursor(Qt.PointingHandCursor)
+
+    def set_tokens(self, tokens, colors=None):
+        """Показывает новый пример; colors — цвет разметки каждого токена (None — без разметки)."""
+        metrics = QFontMetrics(self.font())
+        self.tokens = list(tokens)
+        self._widths = [metrics.horizontalAdvance(token) + 2 * self.padding for token in self.tokens]
+        self._colors = list(colors) if colors is not None else [None] * len(self.tokens)
+        self._selection = self._anchor = None
+        self._layout_width = None
+        self._relayout()
+        self.update()
+
+    def set_colors(self, colors):
+        """Меняет цвета разметки и перерисовывает только токены, у которых цвет изменился."""
+        colors = list(colors)
+        changed = [i for i, (old, new) in enumerate(zip(self._colors, colors)) if old != new]
+        self._colors = colors
+        self._repaint_tokens(changed)
+
+    def selection(self):
+        """Пара (начало, конец) выделенных токенов включительно или None, если выделение не закончено."""
+        if self._selection is None or self._anchor is not None:
+            return None
+        return self._selection
+
+    def clear_selection(self):
+        self._set_selection(None)
+        self._anchor = None
+
+    def token_at(self, pos):
+        """Номер токена под точкой виджета или None."""
+        row = bisect_right(self._row_tops, pos.y()) - 1
+        if row < 0:
+            return None
+        end = self._row_starts[row + 1] if row + 1 < len(self._row_starts) else len(self.tokens)
+        lefts = [self._rects[i].left() for i in range(self._row_starts[row], end)]
+        index = self._row_starts[row] + bisect_right(lefts, pos.x()) - 1
+        if self._row_starts[row] <= index < end and self._rects[index].contains(pos):
+            return index
+        return None
+
+    def _relayout(self):
+        width = max(self.width(), 1)
+        if width == self._layout_width:
+            return
+        self._layout_width = width
+        line_height = QFontMetrics(self.font()).height() + 2 * self.padding
+        self._rects, self._row_tops, self._row_starts = [], [], []
+        x = y = self.spacing
+        for i, token_width in enumerate(self._widths):
+            if x + token_width > width - self.spacing and x > self.spacing:
+                x = self.spacing
+                y += line_height + self.spacing
+            if not self._row_tops or self._row_tops[-1] != y:
+                self._row_tops.append(y)
+                self._row_starts.append(i)
+            self._rects.append(QRect(x, y, token_width, line_height))
+            x += token_width + self.spacing
+        self.setMinimumHeight(y + line_height + self.spacing if self.tokens else 0)
+
+    def _token_range(self, rect):
+        """Номера токенов в строках, пересекающих rect."""
+        if not self._rects:
+            return range(0)
+        line_height = self._rects[0].height()
+        first = max(bisect_right(self._row_tops, rect.top() - line_height) - 1, 0)
+        last = bisect_right(self._row_tops, rect.bottom())
+        end = self._row_starts[last] if last < len(self._row_starts) else len(self.tokens)
+        return range(self._row_starts[first], end)
+
+    def _repaint_tokens(self, indices):
+        region = QRegion()
+        for i in indices:
+            region += self._rects[i].adjusted(-1, -1, 1, 1)
+        if not region.isEmpty():
+            self.update(region)
+
+    def _set_selection(self, selection):
+        old = range(0) if self._selection is None else range(min(self._selection), max(self._selection) + 1)
+        self._selection = selection
+        new = range(0) if selection is None else range(min(selection), max(selection) + 1)
+        self._repaint_tokens(set(old).symmetric_difference(new))
+
+    def resizeEvent(self, event):
+        self._relayout()
+        super().resizeEvent(event)
+
+    def paintEvent(self, event):
+        painter = QPainter(self)
+        painter.setRenderHint(QPainter.Antialiasing)
+        selected = range(0) if self._selection is None else range(min(self._selection), max(self._selection) + 1)
+        for i in self._token_range(event.rect()):
+            rect = self._rects[i]
+            if not rect.intersects(event.rect()):
+                continue
+            if i in selected:
+                background = self.selection_color
+            elif self._colors[i]:
+                background = QColor(self._colors[i])
+            else:
+                background = self.palette().color(QPalette.Button)
+            painter.setPen(self.border_color)
+            painter.setBrush(background)
+            painter.drawRoundedRect(rect.adjusted(0, 0, -1, -1), 3, 3)
+            painter.setPen(self.palette().color(QPalette.ButtonText))
+            painter.drawText(rect, Qt.AlignCenter, self.tokens[i])
+
+    def mousePressEvent(self, event):
+        index = self.token_at(event.pos())
+        if event.button() != Qt.LeftButton or index is None:
+            return
+        if self._anchor is None:
+            self._anchor = index
+            self._dragging = True
+            self._set_selection((index, index))
+        else:
+            self._set_selection((self._anchor, index))
+            self._anchor = None
+
+    def mouseMoveEvent(self, event):
+        index = self.token_at(event.pos())
+        if self._dragging and index is not None and self._selection != (self._anchor, index):
+            self._set_selection((self._anchor, index))
+
+    def mouseReleaseEvent(self, event):
+        # Протянули мышью через несколько токенов — выделение закончено без второго клика
+        if self._dragging and self._selection is not None and self._selection[0] != self._selection[1]:
+            self._anchor = None
+        self._dragging = False
+
 
 class NEREditor(QMainWindow):
+    """
+    Редактор разметки.
+
+    :param data: AnnotationStore: пример берется по номеру, правки передаются через update()
+                 и раз в AUTOSAVE_INTERVAL_MS дописываются в журнал.
+    """
+
     def __init__(self, data):
         super().__init__()
         self.data = data
         self.current_index = 0
-        self.selected_start = None
+        self.example = None
         self.colors = {}
         self.init_ui()
         self.load_current_example()
+        self.autosave_timer = QTimer(self)
+        self.autosave_timer.timeout.connect(self.autosave)
+        self.autosave_timer.start(AUTOSAVE_INTERVAL_MS)
 
     def init_ui(self):
         self.setWindowTitle('NER Annotation Editor')
@@ -54,10 +213,8 @@ class NEREditor(QMainWindow):
         layout.addLayout(nav_layout)
 
         scroll = QScrollArea()
-        self.text_container = QWidget()
-        self.text_layout = QGridLayout(self.text_container)  # Используем таблицу для компактности
-        self.text_layout.setContentsMargins(2, 2, 2, 2)
-        scroll.setWidget(self.text_container)
+        self.token_view = TokenView()
+        scroll.setWidget(self.token_view)
         scroll.setWidgetResizable(True)
         layout.addWidget(scroll)
 
@@ -89,42 +246,36 @@ class NEREditor(QMainWindow):
         layout.addLayout(control_layout)
 
     def update_label_combo(self):
-        all_labels = set()
-        for item in self.data:
-            all_labels.update(item['label'])
         self.label_combo.clear()
-        self.label_combo.addItems(sorted(all_labels))
+        self.label_combo.addItems(self.data.labels())
+
+    def add_labels_to_combo(self, labels):
+        """Вставляет новые метки в список, сохраняя алфавитный порядок."""
+        for label in labels:
+            current = [self.label_combo.itemText(i) for i in range(self.label_combo.count())]
+            if label not in current:
+                self.label_combo.insertItem(bisect_left(current, label), label)
 
     def load_current_example(self):
-        example = self.data[self.current_index]
-        
-        for i in reversed(range(self.text_layout.count())): 
-            self.text_layout.itemAt(i).widget().deleteLater()
-        
-        self.word_buttons = []
-        row, col = 0, 0
-        for idx, word in enumerate(example['tokenized_text']):
-            btn = WordButton(word, idx)
-            btn.clicked.connect(self.on_word_click)
-            self.word_buttons.append(btn)
-            self.text_layout.addWidget(btn, row, col)
-            col += 1
-            if col > 7:  # Перенос на новую строку
-                col = 0
-                row += 1
-
-        self.color_map = {}
+        self.example = example = self.data[self.current_index]
+        self.token_view.set_tokens(example['tokenized_text'], self.token_colors(example))
+        self.ner_list.clear()
         for ner in example['ner']:
-            start, end, label = ner
+            self.ner_list.addItem(self.entity_title(example, ner))
+
+    def token_colors(self, example):
+        """Цвет каждого токена по разметке примера (при пересечении побеждает последняя сущность)."""
+        colors = [None] * len(example['tokenized_text'])
+        for start, end, label in example['ner']:
             color = self.get_color_for_label(label)
-            for i in range(start, end+1):
-                self.word_buttons[i].setStyleSheet(f"background-color: {color};")
+            for i in range(start, end + 1):
+                colors[i] = color
+        return colors
 
-        self.ner_list.clear()
-        for ner in example['ner']:
-            start, end, label = ner
-            text = ' '.join(example['tokenized_text'][start:end+1])
-            self.ner_list.addItem(f"{label}: [{start}-{end}] {text}")
+    def entity_title(self, example, ner):
+        start, end, label = ner
+        text = ' '.join(example['tokenized_text'][start:end+1])
+        return f"{label}: [{start}-{end}] {text}"
 
     def get_color_for_label(self, label):
         if label not in self.colors:
@@ -133,52 +284,37 @@ class NEREditor(QMainWindow):
             self.colors[label] = color.name()
         return self.colors[label]
 
-    def on_word_click(self):
-        clicked_btn = self.sender()
-        index = clicked_btn.index
-        
-        if self.selected_start is None:
-            self.clear_selection()
-            self.selected_start = index
-            clicked_btn.setChecked(True)
-        else:
-            self.selected_end = index
-            self.show_selection_area()
-
     def clear_selection(self):
-        for btn in self.word_buttons:
-            btn.setChecked(False)
-        self.selected_start = None
-        self.selected_end = None
-
-    def show_selection_area(self):
-        start = min(self.selected_start, self.selected_end)
-        end = max(self.selected_start, self.selected_end)
-        
-        for i in range(start, end+1):
-            self.word_buttons[i].setChecked(True)
+        self.token_view.clear_selection()
 
     def confirm_entity(self):
-        if self.selected_start is None or self.selected_end is None:
+        selection = self.token_view.selection()
+        if selection is None:
             return
         
-        start = min(self.selected_start, self.selected_end)
-        end = max(self.selected_start, self.selected_end)
+        start, end = min(selection), max(selection)
         label = self.label_input.text().strip() or self.label_combo.currentText()
         
         if not label:
             QMessageBox.warning(self, "Error", "Please enter or select a label")
             return
 
-        self.data[self.current_index]['ner'].append([start, end, label])
-        
-        self.load_current_example()
+        example = self.example
+        example['ner'].append([start, end, label])
+        if label not in example.setdefault('label', []):
+            example['label'].append(label)
+        self.add_labels_to_combo(self.data.update(self.current_index, example))
+        self.ner_list.addItem(self.entity_title(example, example['ner'][-1]))
         self.clear_selection()
+        self.token_view.set_colors(self.token_colors(example))
 
     def remove_entity(self, item):
         row = self.ner_list.row(item)
-        del self.data[self.current_index]['ner'][row]
-        self.load_current_example()
+        example = self.example
+        del example['ner'][row]
+        self.data.update(self.current_index, example)
+        self.ner_list.takeItem(row)
+        self.token_view.set_colors(self.token_colors(example))
 
     def prev_example(self):
         if self.current_index > 0:
@@ -191,15 +327,34 @@ class NEREditor(QMainWindow):
             self.load_current_example()
 
     def save_changes(self):
-        with open('output/annotated_data.json', 'w', encoding='utf-8') as f:
-            json.dump(self.data, f, ensure_ascii=False, indent=2)
-        QMessageBox.information(self, 'Saved', 'All changes saved to annotated_data.json')
+        saved = self.data.save()
+        QMessageBox.information(self, 'Saved', f'{saved} edited example(s) saved to {self.data.journal_path}')
+
+    def autosave(self):
+        saved = self.data.save()
+        if saved:
+            self.statusBar().showMessage(f'Autosaved {saved} edited example(s)', 3000)
+
+    def closeEvent(self, event):
+        self.data.save()
+        super().closeEvent(event)
 
 if __name__ == '__main__':
-    with open('output/gliner.json', 'r', encoding='utf-8') as f:
-        data = json.load(f)
-    
+    parser = argparse.ArgumentParser(description="Edit GLiNER examples; edits are appended to a journal next to the file.")
+    parser.add_argument('path', nargs='?', default='output/gliner.jsonl', help="Examples in JSONL (or a JSON array).")
+    parser.add_argument('--journal', help="Edit journal (default: <path>.edits.jsonl).")
+    parser.add_argument('--export', metavar='PATH', help="Write the examples with all saved edits to a JSONL file and exit.")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING, format='%(message)s')
+    data = AnnotationStore(args.path, journal_path=args.journal)
+    if args.export:
+        print(f"Exported {data.export(args.export)} examples to {args.export}")
+        sys.exit()
+
     app = QApplication(sys.argv)
     editor = NEREditor(data)
     editor.show()
+    if data.stale:
+        editor.statusBar().showMessage(f'{data.stale} journal edit(s) skipped: {args.path} was re-exported since', 10000)
     sys.exit(app.exec_())
@@ -1,5 +1,7 @@
 import re
 import json
+from bisect import bisect_left
+from collections import deque
 
 # Эта функция делит на слова
 def tokenize_text(text):
@@ -7,6 +9,67 @@ def tokenize_text(text):
     return re.findall(r'\w+(?:[-_]\w+)*|\S', text)
 
 
+class EntityMatcher:
+    """
+    Автомат Ахо — Корасик над последовательностями токенов.
+
+    Шаблоны — токенизированные сущности в нижнем регистре. Поиск проходит по тексту один раз,
+    поэтому время линейно по числу токенов плюс число найденных совпадений, а совпадения
+    всегда начинаются и заканчиваются на границах токенов.
+    """
+
+    def __init__(self):
+        self.goto = [{}]
+        self.fail = [0]
+        self.out = [[]]  # для каждого состояния: список (длина шаблона, payload)
+
+    def add(self, tokens, payload):
+        """Добавляет шаблон из токенов; payload возвращается вместе с каждым совпадением."""
+        if not tokens:
+            return
+        state = 0
+        for token in tokens:
+            token = token.lower()
+            if token not in self.goto[state]:
+                self.goto.append({})
+                self.fail.append(0)
+                self.out.append([])
+                self.goto[state][token] = len(self.goto) - 1
+            state = self.goto[state][token]
+        self.out[state].append((len(tokens), payload))
+
+    def build(self):
+        """Строит суффиксные ссылки обходом в ширину; вызывается после добавления всех шаблонов."""
+        queue = deque(self.goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for token, child in self.goto[state].items():
+                queue.append(child)
+                fallback = self.fail[state]
+                while fallback and token not in self.goto[fallback]:
+                    fallback = self.fail[fallback]
+                target = self.goto[fallback].get(token, 0)
+                self.fail[child] = target if target != child else 0
+                self.out[child] = self.out[child] + self.out[self.fail[child]]
+        return self
+
+    def find_all(self, tokens):
+        """
+        Ищет все вхождения шаблонов.
+
+        :param tokens: Список токенов текста (регистр не важен).
+        :return: Генератор троек (индекс первого токена, индекс последнего токена, payload).
+        """
+        state = 0
+        for i, token in enumerate(tokens):
+            token = token.lower()
+            while state and token not in self.goto[state]:
+                state = self.fail[state]
+            state = self.goto[state].get(token, 0)
+            for length, payload in self.out[state]:
+                yield i - length + 1, i, payload
+
+
 def extract_unique_types_from_json(data):
     """
     Извлекает уникальные типы из JSON-данных.
@@ -21,30 +84,60 @@ def extract_unique_types_from_json(data):
             unique_types.add(t)  # Добавляем типы без изменения регистра
     return unique_types
 
-def split_with_overlap(tokenized_text, max_tokens, overlap):
+def split_with_overlap_bounds(length, max_tokens, overlap):
     """
-    Разделяет токенизированный текст на фрагменты длиной max_tokens или меньше, с наложением overlap токенов.
+    Границы фрагментов, на которые split_with_overlap делит текст из length токенов.
 
-    :param tokenized_text: Список токенов.
+    :param length: Число токенов в тексте.
     :param max_tokens: Максимальная длина фрагмента.
     :param overlap: Количество токенов для наложения.
-    :return: Список фрагментов.
+    :return: Список пар (начало, конец) — полуинтервалов индексов токенов.
     """
-    fragments = []
+    bounds = []
     start = 0
 
-    while start < len(tokenized_text):
-        end = min(start + max_tokens, len(tokenized_text))
-        fragment = tokenized_text[start:end]
+    while start < length:
+        end = min(start + max_tokens, length)
 
-        # Проверяем, если это последний фрагмент и он полностью дублируется в предыдущем фрагменте
-        if len(fragments) > 0 and fragment == fragments[-1][-overlap:]:
+        # Последний фрагмент целиком лежит в наложении предыдущего — он не нужен
+        if bounds and end == bounds[-1][1]:
             break
 
-        fragments.append(fragment)
+        bounds.append((start, end))
         start = end - overlap if end - overlap > start else end
 
-    return fragments
+    return bounds
+
+def split_with_overlap(tokenized_text, max_tokens, overlap):
+    """
+    Разделяет токенизированный текст на фрагменты длиной max_tokens или меньше, с наложением overlap токенов.
+
+    :param tokenized_text: Список токенов.
+    :param max_tokens: Максимальная длина фрагмента.
+    :param overlap: Количество токенов для наложения.
+    :return: Список фрагментов.
+    """
+    return [tokenized_text[start:end] for start, end in split_with_overlap_bounds(len(tokenized_text), max_tokens, overlap)]
+
+def project_spans(spans, span_starts, window_start, window_end):
+    """
+    Выбирает спаны, целиком попадающие в окно, и пересчитывает их индексы относительно начала окна.
+
+    Спаны, которые пересекают границу окна, отбрасываются: обрезанная сущность была бы неверной
+    разметкой, а целиком она попадает в соседнее окно благодаря наложению.
+
+    :param spans: Отсортированный по началу список (start, end, type) с индексами во всем документе.
+    :param span_starts: Список начал спанов (для двоичного поиска).
+    :param window_start: Индекс первого токена окна.
+    :param window_end: Индекс токена, следующего за последним токеном окна.
+    :return: Список спанов в координатах окна.
+    """
+    projected = []
+    for i in range(bisect_left(span_starts, window_start), bisect_left(span_starts, window_end)):
+        start, end, type_name = spans[i]
+        if end < window_end:
+            projected.append((start - window_start, end - window_start, type_name))
+    return projected
 
 def process_json_answer(text, max_tokens=384, overlap=50):
     try:
@@ -63,33 +156,31 @@ def process_json_answer(text, max_tokens=384, overlap=50):
         ents = [(k["entity"], k["types"]) for k in js['entities']]
         all_types = extract_unique_types_from_json(js)
 
+        # Автомат строится один раз на документ, сущности токенизируются тем же токенизатором, что и текст
+        entity_tokens = {}
+        matcher = EntityMatcher()
+        for entity, types in ents:
+            entity = str(entity)
+            if entity not in entity_tokens:
+                entity_tokens[entity] = tokenize_text(entity)
+            matcher.add(entity_tokens[entity], [type_name.replace('_', ' ') for type_name in types])
+        matcher.build()
+
+        # Спаны ищутся один раз по всему документу, окна получают их арифметикой индексов
+        spans = set()
+        for token_start, token_end, types in matcher.find_all(all_tokens):
+            for type_name in types:
+                spans.add((token_start, token_end, type_name))
+        spans = sorted(spans)
+        span_starts = [span[0] for span in spans]
+
         answer = []
-        for tokens in split_with_overlap(all_tokens, max_tokens, overlap):    
-            spans = []
-            # Создаем нижнерегистровую версию текста один раз
-            text_lower = " ".join(tokens).lower()
-            
-            for entity, types in ents:
-                entity_tokens = tokenize_text(str(entity))
-                entity_text = " ".join(entity_tokens).lower()
-                
-                # Используем более эффективный поиск
-                start_pos = 0
-                while True:
-                    pos = text_lower.find(entity_text, start_pos)
-                    if pos == -1:
-                        break
-                        
-                    # Подсчитываем токены до найденной позиции
-                    token_start = len(text_lower[:pos].split())
-                    token_end = token_start + len(entity_tokens) - 1
-                    
-                    for type_name in types:
-                        spans.append((token_start, token_end, type_name.replace('_', ' ')))
-                        
-                    start_pos = pos + 1
-                    
-            answer.append({"tokenized_text": tokens, "ner": spans, "label": list(all_types)})
+        for start, end in split_with_overlap_bounds(len(all_tokens), max_tokens, overlap):
+            answer.append({
+                "tokenized_text": all_tokens[start:end],
+                "ner": project_spans(spans, span_starts, start, end),
+                "label": list(all_types),
+            })
 
     except Exception as e:
         print(e)
@@ -1,13 +1,25 @@
 from .openai_provider import OpenAIProvider
 from .openai_structured_provider import OpenAIStructuredProvider
+from .local_provider import LocalProvider
+from .gemeni_provider import GeminiProvider
+from .router_provider import RouterProvider
+from .response_cache import ResponseCache
 
-def get_provider(provider_name: str):
+def get_provider(provider_name: str, **options):
+    """
+    Создает провайдера по имени.
+
+    :param options: Аргументы конструктора провайдера (model, base_url, api_key; для local — model, n_ctx, ...; для gemini — model, api_key; router без аргументов читает ROUTER_* из .env); по умолчанию берутся из .env.
+    """
     providers = {
         "openai": OpenAIProvider,
         "structured_openai": OpenAIStructuredProvider,
+        "local": LocalProvider,
+        "gemini": GeminiProvider,
+        "router": RouterProvider,
         # Добавьте другие провайдеры здесь
     }
     provider_class = providers.get(provider_name.lower())
     if not provider_class:
         raise ValueError(f"Провайдер {provider_name} не поддерживается")
-    return provider_class()
\ No newline at end of file
+    return provider_class(**options)
\ No newline at end of file
@@ -1,6 +1,237 @@
+import json
+import logging
+import threading
 from abc import ABC, abstractmethod
+from time import perf_counter, sleep
+
+from .rate_limiter import estimate_tokens, is_rate_limit_error, is_transient_error
+from .response_cache import make_key
+from .usage import tracker
+
+logger = logging.getLogger(__name__)
+
+USAGE_FIELDS = ('requests', 'prompt_tokens', 'cached_tokens', 'completion_tokens')
+
+
+def parse_score(answer):
+    """Разбирает ответ rate() в словарь с колонками 'score_reason' и 'score'."""
+    answer = answer.replace("```json", '').replace("```", '')
+    logger.debug(answer)
+    score = json.loads(answer)
+    return {'score_reason': score['reasoning_behind_score'], 'score': score['score']}
+
+
+def pack_batches(texts, budget, max_items):
+    """
+    Жадно делит тексты на пакеты подряд идущих текстов под бюджет токенов.
+
+    Текст, который один больше бюджета, уходит отдельным пакетом.
+
+    :param texts: Список текстов.
+    :param budget: Максимальная оценка числа токенов текстов в одном пакете.
+    :param max_items: Максимальное число текстов в пакете.
+    :return: Генератор списков индексов текстов.
+    """
+    batch, size = [], 0
+    for i, text in enumerate(texts):
+        tokens = estimate_tokens(text)
+        if batch and (size + tokens > budget or len(batch) >= max_items):
+            yield batch
+            batch, size = [], 0
+        batch.append(i)
+        size += tokens
+    if batch:
+        yield batch
+
 
 class BaseLLMProvider(ABC):
+    # Имя провайдера в get_provider, входит в ключ кэша ответов
+    name = None
+    # Общий RateLimiter провайдера (см. rate_limiter.get_rate_limiter); None — без ограничений
+    limiter = None
+    # ResponseCache, общий для всех провайдеров; None — без кэша
+    cache = None
+    max_retries = 5
+    # Пакетные запросы annotate_many / rate_many: бюджет токенов текстов и максимум текстов в одном запросе
+    batch_tokens = 3000
+    batch_size = 8
+    # Счетчики токенов (см. usage_stats); создаются у экземпляра при первом ответе
+    _usage = None
+    _usage_lock = threading.Lock()
+
+    def _complete(self, request, send, key=None, check=None):
+        """Выполняет запрос к чату через кэш ответов и лимитер.
+
+        :param request: Словарь параметров запроса (model, messages, temperature, response_format, ...).
+        :param send: Функция send(**request), возвращающая ответ API в формате chat.completions.
+        :param key: Ключ кэша, по которому уже был промах (повторно в кэш не смотрим, только сохраняем ответ).
+        :param check: Функция check(content), которая бросает исключение, если стадия не примет ответ.
+                      Такой ответ не попадает в кэш (исключение уходит вызывающему), а непрошедший проверку
+                      ответ из кэша считается промахом, чтобы повтор стадии снова пошел в API.
+        :return: Текст ответа модели.
+        """
+        if self.cache and key is None:
+            key = make_key(self.name, request)
+            cached = self._cached(key, check)
+            if cached is not None:
+                return cached
+        prompt = "".join(str(m.get("content", "")) for m in request.get("messages", []))
+        response = self._request(lambda: send(**request), prompt)
+        content = response.choices[0].message.content
+        if check:
+            check(content)
+        if self.cache:
+            self.cache.put(key, content, provider=self.name, model=request.get("model"))
+        return content
+
+    def _cached(self, key, check=None):
+        """Ответ из кэша по ключу; None — промах или ответ, который не прошел check."""
+        cached = self.cache.get(key)
+        if cached is not None and check:
+            try:
+                check(cached)
+            except Exception as e:
+                logger.debug(f"Cached answer {key} rejected, asking the API again: {e!r}")
+                return None
+        return cached
+
+    def _complete_many(self, texts, single_request, batch_request, split, send, check=None):
+        """Выполняет одну стадию для нескольких текстов, упаковывая их в общие запросы.
+
+        Кэш, как и для одиночных вызовов, хранит ответ под ключом того запроса, который его дал:
+        сначала ищутся ответы одиночных запросов каждого текста, затем для оставшихся текстов
+        строятся пакеты, и целиком кэшируется ответ пакетного запроса. Повторный запуск с теми же
+        текстами и batch_size собирает те же пакеты и берет их ответы из кэша, но ответ из пакета
+        не подставляется в одиночный вызов того же текста (его дал другой промпт).
+        Тексты, для которых пакетный ответ не прошел проверку (или не вернулся вовсе),
+        обрабатываются одиночными запросами. Пакетный ответ, который split не разобрал, не кэшируется.
+
+        :param texts: Список текстов.
+        :param single_request: Функция single_request(text), параметры одиночного запроса.
+        :param batch_request: Функция batch_request(texts), параметры пакетного запроса.
+        :param split: Функция split(content, texts) -> {номер текста в пакете: ответ}; при неверном ответе бросает исключение.
+        :param send: Функция send(**request), возвращающая ответ API (для пакетных и одиночных запросов).
+        :param check: Проверка ответа одиночного запроса, см. _complete.
+        :return: Список ответов в порядке texts.
+        """
+        results = [None] * len(texts)
+        keys = [None] * len(texts)
+        todo = []
+        for i, text in enumerate(texts):
+            if self.cache:
+                keys[i] = make_key(self.name, single_request(text))
+                results[i] = self._cached(keys[i], check)
+            if results[i] is None:
+                todo.append(i)
+
+        for group in pack_batches([texts[i] for i in todo], self.batch_tokens, self.batch_size):
+            indices = [todo[j] for j in group]
+            answers = {}
+            if len(indices) > 1:
+                batch_texts = [texts[i] for i in indices]
+                try:
+                    content = self._complete(batch_request(batch_texts), send,
+                                             check=lambda content: split(content, batch_texts))
+                    answers = split(content, batch_texts)
+                except Exception as e:
+                    # Исчерпанные повторы после 429/5xx не лечатся одиночными запросами
+                    if is_rate_limit_error(e) or is_transient_error(e):
+                        raise
+                    logger.warning(f"Batched request for {len(indices)} texts failed validation, "
+                                   f"falling back to single requests: {e}")
+            for position, i in enumerate(indices):
+                if position in answers:
+                    results[i] = answers[position]
+                else:
+                    # По ключу одиночного запроса уже был промах — второй раз в кэш не смотрим
+                    results[i] = self._complete(single_request(texts[i]), send, key=keys[i], check=check)
+        return results
+
+    def stage_request(self, stage, text):
+        """Параметры запроса стадии без отправки (для Batch API, см. batch_jobs).
+
+        :param stage: 'summarize', 'annotate' или 'rate'.
+        :return: Словарь параметров chat.completions (model, messages, response_format, ...).
+        :raises NotImplementedError: Если провайдер не строит запросы chat.completions.
+        """
+        builder = getattr(self, f'_{stage}_request', None)
+        if builder is None:
+            raise NotImplementedError(f"{type(self).__name__} does not support batch jobs")
+        return builder(text)
+
+    def annotate_many(self, texts):
+        """annotate() для списка текстов. Провайдеры со structured output упаковывают тексты в общие запросы."""
+        return [self.annotate(text) for text in texts]
+
+    def rate_many(self, texts):
+        """rate() для списка текстов. Провайдеры со structured output упаковывают тексты в общие запросы."""
+        return [self.rate(text) for text in texts]
+
+    def _request(self, send, prompt):
+        """Выполняет send() с учетом лимитов: ждет квоту, а после 429 или 5xx ждет и повторяет запрос.
+
+        :param send: Функция без аргументов, отправляющая запрос и возвращающая ответ API.
+        :param prompt: Текст запроса, по нему оценивается расход токенов.
+        :return: Ответ send().
+        """
+        estimated = estimate_tokens(prompt)
+        for attempt in range(self.max_retries + 1):
+            if self.limiter:
+                self.limiter.acquire(estimated)
+            started = perf_counter()
+            try:
+                response = send()
+            except Exception as e:
+                if attempt == self.max_retries:
+                    raise
+                if is_rate_limit_error(e) and self.limiter:
+                    self.limiter.on_rate_limited(e)
+                elif is_rate_limit_error(e) or is_transient_error(e):
+                    sleep(min(60, 2 ** attempt))
+                else:
+                    raise
+                continue
+            usage = getattr(response, 'usage', None)
+            if self.limiter:
+                self.limiter.on_success()
+                self.limiter.record_tokens(estimated, getattr(usage, 'total_tokens', None))
+            self.record_usage(usage, perf_counter() - started)
+            return response
+
+    def record_usage(self, usage, latency=None):
+        """Добавляет usage ответа (объект API или словарь) к счетчикам токенов провайдера и к usage.tracker.
+
+        cached_tokens — часть промпта, взятая из серверного кэша префиксов (prompt_tokens_details).
+
+        :param latency: Время ответа в секундах (для Batch API неизвестно).
+        """
+        if usage is None:
+            tracker.record(getattr(self, 'model', None), latency=latency)
+            return
+
+        def field(obj, name):
+            value = obj.get(name) if isinstance(obj, dict) else getattr(obj, name, None)
+            return value or 0
+
+        details = (usage.get('prompt_tokens_details') if isinstance(usage, dict)
+                   else getattr(usage, 'prompt_tokens_details', None))
+        with self._usage_lock:
+            if self._usage is None:
+                self._usage = dict.fromkeys(USAGE_FIELDS, 0)
+            self._usage['requests'] += 1
+            self._usage['prompt_tokens'] += field(usage, 'prompt_tokens')
+            self._usage['completion_tokens'] += field(usage, 'completion_tokens')
+            cached = field(details, 'cached_tokens') if details else 0
+            self._usage['cached_tokens'] += cached
+        tracker.record(getattr(self, 'model', None), field(usage, 'prompt_tokens'), field(usage, 'completion_tokens'),
+                       cached, latency)
+
+    def usage_stats(self):
+        """Счетчики токенов с начала работы: requests, prompt_tokens, cached_tokens, completion_tokens, cached_share."""
+        with self._usage_lock:
+            stats = dict(self._usage or dict.fromkeys(USAGE_FIELDS, 0))
+        stats['cached_share'] = stats['cached_tokens'] / stats['prompt_tokens'] if stats['prompt_tokens'] else 0.0
+        return stats
     @abstractmethod
     def summarize(self, input_text) -> str:
         """Returns summary of input text, just like a regular string"""
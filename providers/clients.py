@@ -0,0 +1,92 @@
+import importlib.util
+import logging
+import os
+import threading
+
+from openai import DefaultHttpxClient, OpenAI
+
+try:  # новые версии openai построены на httpx2 с тем же API
+    import httpx2 as httpx
+except ImportError:
+    import httpx
+
+logger = logging.getLogger(__name__)
+
+# Настройки пула соединений: имя -> (переменная окружения, значение по умолчанию, тип)
+SETTINGS = {
+    'max_connections': ('OPENAI_MAX_CONNECTIONS', 100, int),
+    'max_keepalive_connections': ('OPENAI_MAX_KEEPALIVE', 20, int),
+    'keepalive_expiry': ('OPENAI_KEEPALIVE_EXPIRY', 30.0, float),
+    'http2': ('OPENAI_HTTP2', False, lambda value: str(value).lower() in ('1', 'true', 'yes')),
+}
+
+_overrides = {}
+_clients = {}
+_lock = threading.Lock()
+
+
+def configure(**values):
+    """
+    Меняет настройки пула соединений: max_connections, max_keepalive_connections, keepalive_expiry, http2.
+    Значения None пропускаются. Действует на клиенты, созданные после вызова.
+    """
+    for name, value in values.items():
+        if name not in SETTINGS:
+            raise ValueError(f"Unknown client setting {name}")
+        if value is not None:
+            _overrides[name] = value
+
+
+def client_settings():
+    """Текущие настройки пула: заданные через configure, иначе из окружения (.env), иначе по умолчанию."""
+    result = {}
+    for name, (env_name, default, convert) in SETTINGS.items():
+        if name in _overrides:
+            result[name] = _overrides[name]
+        elif os.environ.get(env_name):
+            result[name] = convert(os.environ[env_name])
+        else:
+            result[name] = default
+    return result
+
+
+def get_client(base_url, api_key):
+    """
+    Общий клиент OpenAI для пары (base_url, api_key).
+
+    Все провайдеры и все потоки с одинаковым адресом и ключом делят один клиент и его пул
+    соединений, поэтому TLS-рукопожатие делается один раз на соединение, а не на провайдера.
+    Повторы после 429 делает общий лимитер, поэтому у клиента max_retries=0.
+    """
+    key = (base_url, api_key)
+    with _lock:
+        client = _clients.get(key)
+        if client is None:
+            settings = client_settings()
+            http2 = settings['http2']
+            if http2 and importlib.util.find_spec('h2') is None:
+                logger.warning("HTTP/2 requested but the 'h2' package is not installed, using HTTP/1.1")
+                http2 = False
+            http_client = DefaultHttpxClient(
+                limits=httpx.Limits(
+                    max_connections=settings['max_connections'],
+                    max_keepalive_connections=settings['max_keepalive_connections'],
+                    keepalive_expiry=settings['keepalive_expiry'],
+                ),
+                http2=http2,
+            )
+            client = OpenAI(base_url=base_url, api_key=api_key, max_retries=0, http_client=http_client)
+            _clients[key] = client
+        return client
+
+
+def reset_clients():
+    """Забывает созданные клиенты: следующий get_client создаст новые."""
+    global _lock
+    _clients.clear()
+    _lock = threading.Lock()
+
+
+# Сокеты пула родителя нельзя использовать в дочернем процессе: после fork начинаем с пустого реестра
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=reset_clients)
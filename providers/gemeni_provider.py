@@ -1,219 +1,130 @@
-#################
-# Should be remade, after I changed project structure
-#################
+import enum
+import os
+import threading
+import warnings
+from types import SimpleNamespace
+from typing import List
 
+import typing_extensions as typing
+from dotenv import load_dotenv
 
+from .base_provider import BaseLLMProvider, parse_score
+from .prompts import annotate_messages, rate_messages, summarize_messages
+from .rate_limiter import get_rate_limiter
 
+try:
+    # Пакет объявлен устаревшим и предупреждает при импорте, даже если провайдер не используется
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', FutureWarning)
+        import google.generativeai as genai
+except ImportError:  # необязательная зависимость: нужна только для провайдера "gemini"
+    genai = None
+
+load_dotenv()
 
 
-# @log_execution_time
-# def summarize_with_gemeni(text):
-#     import google.generativeai as genai
-#     import os
+# Gemini принимает только подмножество JSON Schema (без $defs), поэтому схемы описаны через TypedDict
+class Entity(typing.TypedDict):
+    entity: str
+    types: List[str]
 
-#     api_key = os.environ["GOOGLE_API_KEY"]
-#     model = os.environ["GOOGLE_MODEL"]
-
-#     genai.configure(api_key=api_key)
 
-#     generation_config = {
-#     "temperature": 0,
-#     "top_p": 0.95,
-#     "top_k": 40,
-#     "max_output_tokens": 8192,
-#     "response_mime_type": "text/plain",
-#     }
-
-#     model = genai.GenerativeModel(
-#         model_name=model,
-#         generation_config=generation_config,
-#         )
-    
-#     chat_session = model.start_chat(
-#         history=[
-#         ]
-#     )
-
-#     response = chat_session.send_message(f"Summarize the given text. Write summary without any introduction words. Твой ответ должен быть на русском языке.\n Text:{text}")
+class Entry(typing.TypedDict):
+    text: str
+    entities: List[Entity]
 
-#     update_token_count('token_usage/input', response.usage_metadata.prompt_token_count)
-#     update_token_count('token_usage/output', response.usage_metadata.candidates_token_count)
 
-#     return (response.text)
+class Choice(enum.Enum):
+    Excellent = "Excellent"
+    Good = "Good"
+    Average = "Average"
+    Poor = "Poor"
+    Unusable = "Unusable"
 
-# @log_execution_time
-# def annotate_with_gemeni(text):
-#     import google.generativeai as genai
-#     import os
-#     # import typing_extensions as typing  
 
-#     api_key = os.environ["GOOGLE_API_KEY"]
-#     model = os.environ["GOOGLE_MODEL"]
+class Score(typing.TypedDict):
+    reasoning_behind_score: str
+    score: Choice
 
-#     genai.configure(api_key=api_key)
 
-#     generation_config = {
-#     "temperature": 0,
-#     "top_p": 0.95,
-#     "top_k": 40,
-#     "max_output_tokens": 8192,
-#     "response_mime_type": "text/plain",
-#     }
+SCHEMAS = {'entry': Entry, 'rating': Score}
 
-#     model = genai.GenerativeModel(
-#         model_name=model,
-#         generation_config=generation_config,
-#         )
 
-#     # from typing import TypedDict, List
+def _as_response(response):
+    """Ответ generate_content в виде объекта, как у клиента OpenAI (choices[0].message.content и usage)."""
+    metadata = response.usage_metadata
+    usage = SimpleNamespace(
+        prompt_tokens=metadata.prompt_token_count,
+        completion_tokens=metadata.candidates_token_count,
+        total_tokens=metadata.total_token_count,
+        prompt_tokens_details=SimpleNamespace(cached_tokens=getattr(metadata, 'cached_content_token_count', 0)),
+    )
+    return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=response.text))], usage=usage)
 
-#     import typing_extensions as typing
 
-#     class Entity(typing.TypedDict):
-#         entity: str
-#         types: typing.List[str]
+class GeminiProvider(BaseLLMProvider):
+    """
+    Google Gemini через google-generativeai.
 
-#     class Entry(typing.TypedDict):
-#         text: str
-#         entities: typing.List[Entity]
+    Запросы строятся из тех же промптов, что и у провайдеров OpenAI: системный промпт передается
+    как system_instruction, поэтому модель создается один раз на промпт. Ответы annotate и rate
+    генерируются в JSON по схемам Entry и Score. Учет токенов — через usage_metadata ответа.
 
-#     response = model.generate_content(
-#         f"""Analyze the given text and extract named entities. Each entity should be meticulously labeled according to its type for straightforward extraction. Классы должны быть написаны с большой буквы, и на русском языке. 
-#         Классы могут быть любые, чем разнообразнее, тем лучше.
-#         text - это оригинальный текст
-        
-#         Входной текст:
-#         {text}""",
-#         generation_config=genai.GenerationConfig(
-#             response_mime_type="application/json", response_schema=Entry
-#         ),
-#     )
+    Настройки по умолчанию берутся из .env: GOOGLE_API_KEY, GOOGLE_MODEL; лимиты — GEMINI_RPM / GEMINI_TPM.
+    """
+    name = "gemini"
 
-#     update_token_count('token_usage/input', response.usage_metadata.prompt_token_count)
-#     update_token_count('token_usage/output', response.usage_metadata.candidates_token_count)
+    def __init__(self, model=None, api_key=None):
+        if genai is None:
+            raise ImportError("The 'gemini' provider needs google-generativeai: pip install google-generativeai")
+        genai.configure(api_key=api_key or os.environ["GOOGLE_API_KEY"])
+        self.model = model or os.environ["GOOGLE_MODEL"]
+        self.limiter = get_rate_limiter("gemini")
+        self._models = {}
+        self._models_lock = threading.Lock()
 
+    def _get_model(self, model, system):
+        with self._models_lock:
+            if (model, system) not in self._models:
+                self._models[(model, system)] = genai.GenerativeModel(model_name=model, system_instruction=system)
+            return self._models[(model, system)]
 
-#     return (response.text)
+    def _send(self, model, messages, temperature=0, schema=None):
+        system = "".join(m["content"] for m in messages if m["role"] == "system") or None
+        user = "".join(m["content"] for m in messages if m["role"] != "system")
+        config = dict(temperature=temperature, max_output_tokens=8192)
+        if schema is not None:
+            config.update(response_mime_type="application/json", response_schema=SCHEMAS[schema])
+        response = self._get_model(model, system).generate_content(
+            user, generation_config=genai.GenerationConfig(**config))
+        return _as_response(response)
 
-# @log_execution_time
-# def rate_with_gemeni(text):
-#     import typing_extensions as typing
-#     import google.generativeai as genai
-#     import enum
-#     import os
-    
-#     api_key = os.environ["GOOGLE_API_KEY"]
-#     model = os.environ["GOOGLE_MODEL"]
+    def stage_request(self, stage, text):
+        raise NotImplementedError("GeminiProvider does not support OpenAI batch jobs")
 
-#     genai.configure(api_key=api_key)
+    def _summarize_request(self, input_text):
+        return dict(model=self.model, messages=summarize_messages(input_text))
 
-#     generation_config = {
-#     "temperature": 0,
-#     "top_p": 0.95,
-#     "top_k": 40,
-#     "max_output_tokens": 8192,
-#     "response_mime_type": "text/plain",
-#     }
+    def _annotate_request(self, input_text):
+        return dict(model=self.model, messages=annotate_messages(input_text), schema='entry')
 
-#     model = genai.GenerativeModel(
-#         model_name=model,
-#         generation_config=generation_config,
-#         )
+    def _rate_request(self, input_text):
+        return dict(model=self.model, messages=rate_messages(input_text), schema='rating')
 
-#     class Choice(enum.Enum):
-#         Excellent = "Excellent"
-#         Good = "Good"
-#         Average = "Average"
-#         Poor = "Poor"
-#         Unusable = "Unusable"
+    def summarize(self, input_text) -> str:
+        """Returns summary of input text"""
+        return self._complete(self._summarize_request(input_text), self._send)
 
+    def annotate(self, input_text) -> str:
+        """Returns annotated text in the Entry format, см. OpenAIStructuredProvider.annotate."""
+        return self._complete(self._annotate_request(input_text), self._send)
 
-#     class Score(typing.TypedDict):
-#         reasoning_behind_score: str
-#         score: Choice
+    def rate(self, input_text) -> str:
+        """Оценивает текст для обучения NER, см. BaseLLMProvider.rate."""
+        return self._complete(self._rate_request(input_text), self._send, check=parse_score)
 
-#     response = model.generate_content(
-#         f"""Вы — модель, которая помогает оценивать тексты, используемые для обучения алгоритмов Named Entity Recognition (NER). Вам будет предоставлен текст. Ваша задача:
-
-#     Проанализировать текст и определить его качество с точки зрения пригодности для обучения NER.
-#     Рассуждать по предложенным критериям и обосновать свою оценку.
-#     Выдать окончательную оценку в формате JSON, где указываются причина оценки и сам класс из пяти вариантов.
-
-# Критерии оценки
-
-# Текст должен быть оценён по следующим параметрам:
-
-#     Количество сущностей
-#         Сущности — это имена людей, названия организаций, географические места, даты, события, продукты и другие подобные элементы.
-#         Чем больше сущностей содержится в тексте, тем выше его ценность.
-#         Минимальное количество для хорошего текста — три сущности. Если сущностей меньше, это снижает оценку.
-
-#     Разнообразие классов сущностей
-#         Текст должен содержать сущности из разных категорий (например, люди, организации, даты, места).
-#         Если все сущности относятся к одному классу (например, только имена людей), это снижает оценку.
-
-#     Ясность контекста
-#         Сущности должны упоминаться в понятном и связном контексте.
-#         Контекст позволяет отличить, например, человека с именем "Москва" от города Москва или компанию с названием "Яблоко" от фрукта.
-#         Оценивайте текст в целом. Даже если он выглядит вырванным из более широкого контекста, это не снижает его ценности, если он содержит полезные сущности.
-
-# Оценочные классы
-
-# Используйте один из пяти классов качества:
-
-#     Excellent
-#         Количество сущностей: 5 и больше.
-#         Разнообразие классов: несколько категорий (например, люди, места, события).
-#         Контекст: полностью понятный и связный.
-
-#     Good
-#         Количество сущностей: 3–4.
-#         Разнообразие классов: минимум две категории.
-#         Контекст: в целом понятный, но могут быть небольшие сомнения.
-
-#     Average
-#         Количество сущностей: 2–3.
-#         Разнообразие классов: однотипные или недостаточно разнообразные сущности.
-#         Контекст: иногда неясен, но текст всё ещё полезен.
-
-#     Poor
-#         Количество сущностей: 1–2.
-#         Разнообразие классов: все сущности однотипные.
-#         Контекст: недостаточно понятный для практического использования.
-
-#     Unusable
-#         Количество сущностей: нет или почти нет.
-#         Разнообразие классов: отсутствует.
-#         Контекст: текст бессвязный, бессмысленный или пустой.
-
-# Формат ответа
-
-# Сначала напишите рассуждения о тексте, обосновывая выбор оценки по каждому из трёх критериев.
-
-
-# Текст, который необходимо оценить:
-
-# {text}""",
-#         generation_config=genai.GenerationConfig(
-#             response_mime_type="application/json", response_schema=Score
-#         ),
-#     )
-
-    
-#     update_token_count('token_usage/input', response.usage_metadata.prompt_token_count)
-#     update_token_count('token_usage/output', response.usage_metadata.candidates_token_count)
-
-
-
-#     return response.text
-
-
-
-# if __name__ == "__main__":
-#     # annotate_with_mistral()
-#     # print(annotate_with_mistral("Каждый день приходится сталкиваться с таким случаем, когда человек, находясь внутри смертного греха, дерзает что-то просить у Бога. Очень часто вместо исполнения его просьбы бывает всё наоборот."))
-
-#     print(annotate_with_gemeni("Каждый день приходится сталкиваться с таким случаем, когда человек, находясь внутри смертного греха, дерзает что-то просить у Бога. Очень часто вместо исполнения его просьбы бывает всё наоборот."))
-
-#     print(annotate_with_gemeni("Атака беспилотников на Москву увеличила спрос на системы обнаружения и блокировки дронов среди промышленников, транспортников и граждан. Покупатели в основном используют устройства в зоне военных действий, но некоторые покупают их для личных нужд."))
 
+if __name__ == "__main__":
+    provider = GeminiProvider()
+    print(provider.annotate("Атака беспилотников на Москву увеличила спрос на системы обнаружения и блокировки "
+                            "дронов среди промышленников, транспортников и граждан."))
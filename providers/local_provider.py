@@ -0,0 +1,126 @@
+import json
+import os
+import queue
+import threading
+from concurrent.futures import Future
+from types import SimpleNamespace
+
+from dotenv import load_dotenv
+
+from .base_provider import BaseLLMProvider, parse_score
+from .prompts import annotate_messages, rate_messages, summarize_messages
+from .schemas import EntityList, RatingResponse
+
+try:
+    from llama_cpp import Llama, LlamaRAMCache
+except ImportError:  # необязательная зависимость: нужна только для провайдера "local"
+    Llama = LlamaRAMCache = None
+
+load_dotenv()
+
+# Схемы для грамматики строятся один раз
+ENTITY_LIST_SCHEMA = EntityList.model_json_schema()
+RATING_SCHEMA = RatingResponse.model_json_schema()
+
+
+def _as_response(completion):
+    """Ответ llama.cpp (словарь в формате chat.completions) в виде объекта, как у клиента OpenAI."""
+    message = SimpleNamespace(content=completion['choices'][0]['message']['content'])
+    return SimpleNamespace(choices=[SimpleNamespace(message=message)],
+                           usage=SimpleNamespace(**completion.get('usage', {})))
+
+
+class LocalProvider(BaseLLMProvider):
+    """
+    Модель с открытыми весами (GGUF) через llama-cpp-python в том же процессе.
+
+    Модель не потокобезопасна, поэтому ею владеет один рабочий поток, а потоки FillEngine
+    ставят запросы в очередь и ждут результат. Рабочий поток забирает из очереди все накопившиеся
+    запросы (до max_batch) и выполняет их подряд, сгруппировав по системному промпту: у соседних
+    запросов общий префикс, и llama.cpp пересчитывает только текст, а KV-кэш инструкции
+    переиспользуется. Состояния после длинных префиксов дополнительно хранятся в LlamaRAMCache.
+    Ответы annotate и rate генерируются с грамматикой по JSON Schema, поэтому разбираются, если модель
+    уложилась в max_tokens; ответ, обрезанный по max_tokens, дает ошибку стадии и не попадает в кэш.
+
+    Настройки по умолчанию берутся из .env: LOCAL_MODEL_PATH, LOCAL_N_CTX, LOCAL_N_THREADS,
+    LOCAL_MAX_TOKENS, LOCAL_CACHE_MB.
+    """
+    name = "local"
+
+    def __init__(self, model=None, n_ctx=None, n_threads=None, max_tokens=None, cache_mb=None, max_batch=32):
+        if Llama is None:
+            raise ImportError("The 'local' provider needs llama-cpp-python: pip install llama-cpp-python")
+        model_path = model or os.environ["LOCAL_MODEL_PATH"]
+        self.model = os.path.basename(model_path)
+        self.max_tokens = int(max_tokens or os.environ.get("LOCAL_MAX_TOKENS", 1024))
+        self.max_batch = max_batch
+        self.llm = Llama(
+            model_path=model_path,
+            n_ctx=int(n_ctx or os.environ.get("LOCAL_N_CTX", 4096)),
+            n_threads=int(n_threads or os.environ.get("LOCAL_N_THREADS", os.cpu_count() or 1)),
+            verbose=False,
+        )
+        cache_mb = int(cache_mb or os.environ.get("LOCAL_CACHE_MB", 1024))
+        if cache_mb:
+            self.llm.set_cache(LlamaRAMCache(capacity_bytes=cache_mb << 20))
+        self._queue = queue.Queue()
+        self._worker = threading.Thread(target=self._serve, name='llama', daemon=True)
+        self._worker.start()
+
+    def _serve(self):
+        while True:
+            batch = [self._queue.get()]
+            while len(batch) < self.max_batch:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            # Группируем по системному промпту: сортировка устойчива, порядок внутри группы сохраняется
+            batch.sort(key=lambda item: item[0]['messages'][0]['content'])
+            for request, future in batch:
+                if not future.set_running_or_notify_cancel():
+                    continue
+                try:
+                    future.set_result(self.llm.create_chat_completion(**request))
+                except Exception as e:
+                    future.set_exception(e)
+
+    def _send(self, **request):
+        future = Future()
+        self._queue.put((request, future))
+        completion = future.result()
+        # Грамматика не дает выйти за схему, но не гарантирует, что JSON успеет закрыться до max_tokens:
+        # обрезанный ответ не разбирается, и в кэш его класть нельзя
+        if 'response_format' in request and completion['choices'][0].get('finish_reason') == 'length':
+            raise ValueError(f"llama.cpp answer was cut at max_tokens={request['max_tokens']} and is not valid JSON; "
+                             f"raise LOCAL_MAX_TOKENS (or max_tokens of the 'local' provider)")
+        return _as_response(completion)
+
+    def _request_params(self, messages, schema=None):
+        request = dict(model=self.model, messages=messages, temperature=0, max_tokens=self.max_tokens)
+        if schema is not None:
+            # llama-cpp-python строит из схемы грамматику GBNF и не дает модели выйти за ее пределы
+            request['response_format'] = {"type": "json_object", "schema": schema}
+        return request
+
+    def _summarize_request(self, input_text):
+        return self._request_params(summarize_messages(input_text))
+
+    def _annotate_request(self, input_text):
+        return self._request_params(annotate_messages(input_text), ENTITY_LIST_SCHEMA)
+
+    def _rate_request(self, input_text):
+        return self._request_params(rate_messages(input_text), RATING_SCHEMA)
+
+    def summarize(self, input_text) -> str:
+        """Returns summary of input text"""
+        return self._complete(self._summarize_request(input_text), self._send)
+
+    def annotate(self, input_text) -> str:
+        """Returns annotated text in the Entry format; the text itself is not generated, only the entities."""
+        answer = json.loads(self._complete(self._annotate_request(input_text), self._send, check=json.loads))
+        return json.dumps({"text": input_text, "entities": answer["entities"]}, ensure_ascii=False)
+
+    def rate(self, input_text) -> str:
+        """Оценивает текст для обучения NER, см. BaseLLMProvider.rate."""
+        return self._complete(self._rate_request(input_text), self._send, check=parse_score)
@@ -1,83 +1,35 @@
-from openai import OpenAI
-from .base_provider import BaseLLMProvider
+from .base_provider import BaseLLMProvider, parse_score
+from .clients import get_client
+from .rate_limiter import get_rate_limiter
+from .prompts import ANNOTATE_WITH_SCHEMA_SYSTEM, annotate_messages, rate_messages, summarize_messages
 import os
 from dotenv import load_dotenv
 
 load_dotenv()
 
 class OpenAIProvider(BaseLLMProvider):
-    def __init__(self):
-        base_url = os.environ["BASE_URL"]
-        api_key = os.environ["OPENAI_API_KEY"]
-        self.model = os.environ["MODEL"]
-        self.client = OpenAI(
-            base_url=base_url,  
-            api_key=api_key,   
-        )   
+    name = "openai"
+
+    def __init__(self, model=None, base_url=None, api_key=None):
+        self.model = model or os.environ["MODEL"]
+        # Клиент с пулом соединений общий для всех провайдеров с тем же адресом и ключом
+        self.client = get_client(base_url or os.environ["BASE_URL"], api_key or os.environ["OPENAI_API_KEY"])
+        self.limiter = get_rate_limiter("openai")
 
     def summarize(self, input_text) -> str:
         """Returns summary of input text"""
-        chat_response = self.client.chat.completions.create(
-        model = self.model,
-        messages = [
-                {
-                    "role": "user",
-                    "content": f"Summarize the given text. Write summary without any introduction words. Твой ответ должен быть на русском языке.\n Text:{input_text}",
-                }])
-        return (chat_response.choices[0].message.content) 
-
-    # with examples
-    def create_prompt_for_entity_extraction(self, text):
-        prompt = """
-    **Objective:**
-    Analyze the given text and extract named entities. Each entity should be meticulously labeled according to its type for straightforward extraction.
-
-    **Format Requirements:**
-    - The output should be formatted in JSON, containing the text and the corresponding entities list.
-    - Each entity in the text should be accurately marked and annotated in the 'entities' list.
-
-    **Entity Annotation Details:**
-    - Entities spans can be nested within other entities.
-    - A single entity may be associated with multiple types. list them in the key "types".
-    - Классы должны быть названы на русском языке.
-    - Классы должны быть с большой буквы. 
-
-    **Output Schema:**
-
-    ```json
-    {
-    "text": "{text}",
-    "entities": [
-        {"entity": "entity name", "types": ["type 1", "type 2", ...]},
-        ...
-    ]
-    }
-    ```
-
-    """
+        return self._complete(self._summarize_request(input_text), self.client.chat.completions.create)
 
-        # Adding the dynamically created text to the prompt
-        prompt += f"""
-    Text: 
-    "{text}">
-    """
-
-        return prompt
+    def _summarize_request(self, input_text):
+        return dict(model=self.model, messages=summarize_messages(input_text))
 
     def annotate(self, input_text) -> str:
         """Returns annotated text"""
+        return self._complete(self._annotate_request(input_text), self.client.chat.completions.create)
 
-        prompt = self.create_prompt_for_entity_extraction(input_text)
-
-        chat_response = self.client.chat.completions.create(
-            model= self.model,
-            messages = [
-                {
-                    "role": "user",
-                    "content": prompt,
-                }])
-
-        return (chat_response.choices[0].message.content)
+    def _annotate_request(self, input_text):
+        # Формат ответа описан в системном промпте, так как structured output здесь не используется
+        return dict(model=self.model, messages=annotate_messages(input_text, ANNOTATE_WITH_SCHEMA_SYSTEM))
 
     def rate(self, input_text) -> str:
         """Оценивает текст для обучения NER. Возвращает JSON-строку с полями 'score' (Excellent/Good/Average/Poor/Unusable) 
@@ -90,41 +42,7 @@ class OpenAIProvider(BaseLLMProvider):
         Пример вывода: 
         '{"reasoning_behind_score": "5+ сущностей из 3 категорий, ясный контекст", "score": "Excellent"}' 
         """
+        return self._complete(self._rate_request(input_text), self.client.chat.completions.create, check=parse_score)
 
-        chat_response = self.client.chat.completions.create(
-        model = self.model,
-        messages = [
-                {
-                    "role": "user",
-                    "content": 
-                    f"""Проанализируй текст для обучения NER-модели. **Детализированная инструкция**:
-
-1. **Критерии оценки**:
-   - Количество сущностей: 
-     • 5+ → Excellent
-     • 3-4 → Good
-     • 2-3 → Average
-     • 1-2 → Poor
-     • 0 → Unusable
-   - Разнообразие классов: 
-     • Примеры: персона (PERSON), организация (ORG), локация (LOC), дата (DATE)
-     • Минимум 2 класса для Good, 3+ для Excellent
-   - Контекст: 
-     • Сущности должны быть однозначны в контексте (например, "Яблоко" = компания, а не фрукт)
-     • Текст не должен требовать внешних знаний для интерпретации
-
-2. **Оценочные классы**:
-   - Excellent: 5+ сущностей, 3+ класса, идеальный контекст
-   - Good: 3-4 сущности, 2 класса, понятный контекст
-   - Average: 2-3 сущности, 1-2 класса, контекст частично ясен
-   - Poor: 1-2 сущности, 1 класс, неоднозначный контекст
-   - Unusable: нет сущностей/бессвязный текст
-
-3. **Формат ответа**:
-   - JSON-строка (в ответе должна быть только json строка, без лишних рассуждений вне формата) с полями `reasoning_behind_score` (лаконичный анализ по всем критериям) и `score` (оценочный класс)
-   - Пример: 
-     {{"reasoning_behind_score": "5 сущностей (PERSON, ORG, DATE), контекст позволяет однозначно определить классы", "score": "Excellent"}}
-
-Текст для анализа: {input_text}""",
-                }])
-        return (chat_response.choices[0].message.content) 
+    def _rate_request(self, input_text):
+        return dict(model=self.model, messages=rate_messages(input_text))
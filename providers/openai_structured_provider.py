@@ -1,32 +1,46 @@
-from .base_provider import BaseLLMProvider
-from openai import OpenAI
+from .base_provider import BaseLLMProvider, parse_score
+from .clients import get_client
+from .rate_limiter import get_rate_limiter
+from .prompts import (annotate_messages, batch_annotate_messages, batch_rate_messages, rate_messages,
+                      summarize_messages)
+import json
 import os
 from dotenv import load_dotenv
-from pydantic import BaseModel
-from typing import List, Literal
+from .schemas import Entry, EntryBatch, RatingBatch, RatingResponse
 
 load_dotenv()
 
+
+def _numbered(texts):
+    return json.dumps([{"id": i, "text": text} for i, text in enumerate(texts)], ensure_ascii=False)
+
+
+def _by_id(items, texts):
+    """Ответы пакета по номерам текстов; элементы с чужими или повторными id отбрасываются."""
+    answers = {}
+    for item in items:
+        if 0 <= item.id < len(texts) and item.id not in answers:
+            answers[item.id] = item
+    if not answers:
+        raise ValueError("batched response has no items for the requested ids")
+    return answers
+
+
 class OpenAIStructuredProvider(BaseLLMProvider):
-    def __init__(self):
-        base_url = os.environ["BASE_URL"]
-        api_key = os.environ["OPENAI_API_KEY"]
-        self.model = os.environ["MODEL"]
-        self.client = OpenAI(
-            base_url=base_url,  
-            api_key=api_key,   
-        )   
+    name = "structured_openai"
+
+    def __init__(self, model=None, base_url=None, api_key=None):
+        self.model = model or os.environ["MODEL"]
+        # Клиент с пулом соединений общий для всех провайдеров с тем же адресом и ключом
+        self.client = get_client(base_url or os.environ["BASE_URL"], api_key or os.environ["OPENAI_API_KEY"])
+        self.limiter = get_rate_limiter("openai")
 
     def summarize(self, input_text) -> str:
         """Returns summary of input text"""
-        chat_response = self.client.chat.completions.create(
-        model = self.model,
-        messages = [
-                {
-                    "role": "user",
-                    "content": f"Summarize the given text. Write summary without any introduction words. Твой ответ должен быть на русском языке.\n Text:{input_text}",
-                }])
-        return (chat_response.choices[0].message.content) 
+        return self._complete(self._summarize_request(input_text), self.client.chat.completions.create)
+
+    def _summarize_request(self, input_text):
+        return dict(model=self.model, messages=summarize_messages(input_text))
 
     def annotate(self, input_text) -> str:
         """Returns annotated text, in format:
@@ -42,28 +56,39 @@ class OpenAIStructuredProvider(BaseLLMProvider):
         ```
         
         """
-        class Entity(BaseModel):
-            entity: str
-            types: List[str]
+        return self._complete(self._annotate_request(input_text), self.client.beta.chat.completions.parse)
 
-        class Entry(BaseModel):
-            text: str
-            entities: List[Entity]
-
-        completion = self.client.beta.chat.completions.parse(
+    def _annotate_request(self, input_text):
+        return dict(
             temperature=0,
             model=self.model,
-            messages=[
-                {"role": "user", "content": f"""Analyze the given text and extract named entities. Each entity should be meticulously labeled according to its type for straightforward extraction. Классы должны быть написаны с большой буквы, и на русском языке. 
-                Классы могут быть любые, чем разнообразнее, тем лучше.
-                text - это оригинальный текст
-                
-                Входной текст:
-                {input_text}"""}
-            ],
+            messages=annotate_messages(input_text),
             response_format=Entry,
         )
-        return completion.choices[0].message.content
+
+    def annotate_many(self, input_texts) -> list:
+        """annotate() для нескольких текстов: тексты упаковываются в запросы со списком Entry
+        под бюджет batch_tokens, при неверном ответе — одиночные запросы."""
+        def split(content, texts):
+            answers = _by_id(EntryBatch.model_validate_json(content).items, texts)
+            return {
+                i: json.dumps({"text": texts[i], "entities": [e.model_dump() for e in item.entities]},
+                              ensure_ascii=False)
+                for i, item in answers.items()
+            }
+
+        return self._complete_many(
+            input_texts,
+            self._annotate_request,
+            lambda texts: dict(
+                temperature=0,
+                model=self.model,
+                messages=batch_annotate_messages(_numbered(texts)),
+                response_format=EntryBatch,
+            ),
+            split,
+            self.client.beta.chat.completions.parse,
+        )
 
     def rate(self, input_text) -> str:
         """Оценивает текст для обучения NER. Возвращает JSON-строку с полями 'score' (Excellent/Good/Average/Poor/Unusable) 
@@ -77,44 +102,36 @@ class OpenAIStructuredProvider(BaseLLMProvider):
         '{"reasoning_behind_score": "5+ сущностей из 3 категорий, ясный контекст", "score": "Excellent"}' 
         """
 
-        class RatingResponse(BaseModel):
-            reasoning_behind_score: str
-            score: Literal["Excellent", "Good", "Average", "Poor", "Unusable"]
+        return self._complete(self._rate_request(input_text), self.client.beta.chat.completions.parse, check=parse_score)
 
-        completion = self.client.beta.chat.completions.parse(
+    def _rate_request(self, input_text):
+        return dict(
             temperature=0,
             model=self.model,
-            messages=[
-                {"role": "user", "content": f"""Проанализируй текст для обучения NER-модели. **Детализированная инструкция**:
-
-1. **Критерии оценки**:
-   - Количество сущностей: 
-     • 5+ → Excellent
-     • 3-4 → Good
-     • 2-3 → Average
-     • 1-2 → Poor
-     • 0 → Unusable
-   - Разнообразие классов: 
-     • Примеры: персона (PERSON), организация (ORG), локация (LOC), дата (DATE)
-     • Минимум 2 класса для Good, 3+ для Excellent
-   - Контекст: 
-     • Сущности должны быть однозначны в контексте (например, "Яблоко" = компания, а не фрукт)
-     • Текст не должен требовать внешних знаний для интерпретации
-
-2. **Оценочные классы**:
-   - Excellent: 5+ сущностей, 3+ класса, идеальный контекст
-   - Good: 3-4 сущности, 2 класса, понятный контекст
-   - Average: 2-3 сущности, 1-2 класса, контекст частично ясен
-   - Poor: 1-2 сущности, 1 класс, неоднозначный контекст
-   - Unusable: нет сущностей/бессвязный текст
-
-3. **Формат ответа**:
-   - JSON-строка (в ответе должна быть только json строка, без лишних рассуждений вне формата) с полями `reasoning_behind_score` (лаконичный анализ по всем критериям) и `score` (оценочный класс)
-   - Пример: 
-     {{"reasoning_behind_score": "5 сущностей (PERSON, ORG, DATE), контекст позволяет однозначно определить классы", "score": "Excellent"}}
-
-Текст для анализа: {input_text}"""}
-            ],
+            messages=rate_messages(input_text),
             response_format=RatingResponse,
         )
-        return completion.choices[0].message.content
\ No newline at end of file
+
+    def rate_many(self, input_texts) -> list:
+        """rate() для нескольких текстов: одна рубрика на пакет текстов, при неверном ответе — одиночные запросы."""
+        def split(content, texts):
+            answers = _by_id(RatingBatch.model_validate_json(content).items, texts)
+            return {
+                i: json.dumps({"reasoning_behind_score": item.reasoning_behind_score, "score": item.score},
+                              ensure_ascii=False)
+                for i, item in answers.items()
+            }
+
+        return self._complete_many(
+            input_texts,
+            self._rate_request,
+            lambda texts: dict(
+                temperature=0,
+                model=self.model,
+                messages=batch_rate_messages(_numbered(texts)),
+                response_format=RatingBatch,
+            ),
+            split,
+            self.client.beta.chat.completions.parse,
+            check=parse_score,
+        )
\ No newline at end of file
@@ -0,0 +1,99 @@
+# Промпты провайдеров. Каждый промпт делится на статическую часть (системное сообщение, одно
+# и то же байт в байт для всех запросов стадии) и переменную (сообщение пользователя с текстом).
+# Статическая часть идет первой, поэтому серверный кэш префиксов (prompt caching OpenAI,
+# prefix cache vLLM / llama.cpp) переиспользует ее между запросами.
+
+SUMMARIZE_SYSTEM = "Summarize the given text. Write summary without any introduction words. Твой ответ должен быть на русском языке."
+
+# Разметка со structured output: формат ответа задает схема
+ANNOTATE_SYSTEM = """Analyze the given text and extract named entities. Each entity should be meticulously labeled according to its type for straightforward extraction. Классы должны быть написаны с большой буквы, и на русском языке.
+Классы могут быть любые, чем разнообразнее, тем лучше.
+text - это оригинальный текст"""
+
+# Разметка без structured output: формат ответа описан в самом промпте
+ANNOTATE_WITH_SCHEMA_SYSTEM = """**Objective:**
+Analyze the given text and extract named entities. Each entity should be meticulously labeled according to its type for straightforward extraction.
+
+**Format Requirements:**
+- The output should be formatted in JSON, containing the text and the corresponding entities list.
+- Each entity in the text should be accurately marked and annotated in the 'entities' list.
+
+**Entity Annotation Details:**
+- Entities spans can be nested within other entities.
+- A single entity may be associated with multiple types. list them in the key "types".
+- Классы должны быть названы на русском языке.
+- Классы должны быть с большой буквы. 
+
+**Output Schema:**
+
+```json
+{
+"text": "{text}",
+"entities": [
+    {"entity": "entity name", "types": ["type 1", "type 2", ...]},
+    ...
+]
+}
+```"""
+
+RATING_SYSTEM = """Проанализируй текст для обучения NER-модели. **Детализированная инструкция**:
+
+1. **Критерии оценки**:
+   - Количество сущностей: 
+     • 5+ → Excellent
+     • 3-4 → Good
+     • 2-3 → Average
+     • 1-2 → Poor
+     • 0 → Unusable
+   - Разнообразие классов: 
+     • Примеры: персона (PERSON), организация (ORG), локация (LOC), дата (DATE)
+     • Минимум 2 класса для Good, 3+ для Excellent
+   - Контекст: 
+     • Сущности должны быть однозначны в контексте (например, "Яблоко" = компания, а не фрукт)
+     • Текст не должен требовать внешних знаний для интерпретации
+
+2. **Оценочные классы**:
+   - Excellent: 5+ сущностей, 3+ класса, идеальный контекст
+   - Good: 3-4 сущности, 2 класса, понятный контекст
+   - Average: 2-3 сущности, 1-2 класса, контекст частично ясен
+   - Poor: 1-2 сущности, 1 класс, неоднозначный контекст
+   - Unusable: нет сущностей/бессвязный текст
+
+3. **Формат ответа**:
+   - JSON-строка (в ответе должна быть только json строка, без лишних рассуждений вне формата) с полями `reasoning_behind_score` (лаконичный анализ по всем критериям) и `score` (оценочный класс)
+   - Пример: 
+     {"reasoning_behind_score": "5 сущностей (PERSON, ORG, DATE), контекст позволяет однозначно определить классы", "score": "Excellent"}"""
+
+# Пакетные запросы (annotate_many / rate_many) используют те же системные сообщения,
+# что и одиночные, а пояснение про список текстов стоит в сообщении пользователя
+BATCH_ANNOTATE_INSTRUCTIONS = "Тексты даны JSON-списком объектов с полями id и text. Для каждого текста верни элемент items с тем же id и сущностями только этого текста."
+
+BATCH_RATE_INSTRUCTIONS = "Тексты даны JSON-списком объектов с полями id и text. Оцени каждый текст по критериям отдельно от остальных и верни для него элемент items с тем же id."
+
+
+def chat_messages(system, user):
+    """Сообщения чата: статический системный промпт, затем переменная часть."""
+    return [
+        {"role": "system", "content": system},
+        {"role": "user", "content": user},
+    ]
+
+
+def summarize_messages(text):
+    return chat_messages(SUMMARIZE_SYSTEM, f"Text:\n{text}")
+
+
+def annotate_messages(text, system=ANNOTATE_SYSTEM):
+    return chat_messages(system, f"Входной текст:\n{text}")
+
+
+def rate_messages(text):
+    return chat_messages(RATING_SYSTEM, f"Текст для анализа: {text}")
+
+
+def batch_annotate_messages(numbered_texts):
+    return chat_messages(ANNOTATE_SYSTEM, f"{BATCH_ANNOTATE_INSTRUCTIONS}\n\nВходные тексты:\n{numbered_texts}")
+
+
+def batch_rate_messages(numbered_texts):
+    return chat_messages(RATING_SYSTEM, f"{BATCH_RATE_INSTRUCTIONS}\n\nТексты для анализа: {numbered_texts}")
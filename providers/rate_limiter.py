@@ -0,0 +1,237 @@
+import os
+import random
+import re
+import threading
+import time
+from collections import deque
+
+
+def estimate_tokens(text) -> int:
+    """Грубая оценка числа токенов до отправки запроса (для русского текста ~3 символа на токен)."""
+    return max(1, len(str(text)) // 3)
+
+
+def parse_duration(value):
+    """
+    Разбирает длительность из заголовков лимитов: '1.5', '20ms', '6m0s', '1h2m3.5s'.
+
+    :return: Секунды (float) или None, если значение не распознано.
+    """
+    if value is None:
+        return None
+    value = str(value).strip()
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    parts = re.findall(r'(\d+(?:\.\d+)?)(ms|h|m|s)', value)
+    if not parts or ''.join(n + u for n, u in parts) != value:
+        return None
+    units = {'ms': 0.001, 's': 1, 'm': 60, 'h': 3600}
+    return sum(float(n) * units[u] for n, u in parts)
+
+
+def get_status_code(error):
+    status = getattr(error, 'status_code', None)
+    if status is None:
+        status = getattr(getattr(error, 'response', None), 'status_code', None)
+    if status is None:
+        # Исключения google.api_core хранят HTTP-статус в code
+        code = getattr(error, 'code', None)
+        status = code if isinstance(code, int) else None
+    return status
+
+
+def is_rate_limit_error(error) -> bool:
+    return get_status_code(error) == 429
+
+
+def is_transient_error(error) -> bool:
+    """5xx и сетевые ошибки, после которых запрос имеет смысл повторить."""
+    status = get_status_code(error)
+    if status is not None:
+        return status >= 500
+    name = type(error).__name__
+    return 'Connection' in name or 'Timeout' in name
+
+
+class _Bucket:
+    """Token bucket: емкость capacity, пополнение capacity единиц в минуту."""
+
+    def __init__(self, per_minute):
+        self.capacity = float(per_minute)
+        self.level = float(per_minute)
+        self.rate = per_minute / 60.0
+        self.updated = time.monotonic()
+
+    def refill(self, now):
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount):
+        # Запрос больше емкости ведра ждет только полного ведра, иначе он не пройдет никогда
+        amount = min(amount, self.capacity)
+        if self.level >= amount:
+            return 0.0
+        return (amount - self.level) / self.rate
+
+
+class RateLimiter:
+    """
+    Общий для всех потоков лимитер запросов к одному провайдеру.
+
+    Держит два token bucket: запросы в минуту (rpm) и токены в минуту (tpm).
+    После ответа 429 читает Retry-After / x-ratelimit-reset-* и приостанавливает
+    все запросы; если заголовков нет, ждет экспоненциально дольше с каждым 429 подряд.
+
+    :param rpm: Лимит запросов в минуту (None — без ограничения).
+    :param tpm: Лимит токенов в минуту (None — без ограничения).
+    :param max_backoff: Максимальная пауза в секундах при адаптивном ожидании.
+    """
+
+    def __init__(self, rpm=None, tpm=None, max_backoff=60.0):
+        self.requests = _Bucket(rpm) if rpm else None
+        self.tokens = _Bucket(tpm) if tpm else None
+        self.max_backoff = max_backoff
+        self._lock = threading.Lock()
+        self._blocked_until = 0.0
+        self._consecutive_limits = 0
+        self._total_wait = 0.0
+        self._rate_limited = 0
+        self._sent = deque()  # время отправки запросов за последнюю минуту
+        self._spent = deque()  # (время, токены) за последнюю минуту
+
+    @classmethod
+    def from_env(cls, prefix):
+        """Создает лимитер из переменных {PREFIX}_RPM и {PREFIX}_TPM (или общих RPM и TPM)."""
+        def read(name):
+            value = os.environ.get(f"{prefix}_{name}") or os.environ.get(name)
+            return float(value) if value else None
+        return cls(rpm=read('RPM'), tpm=read('TPM'))
+
+    def configure(self, rpm=None, tpm=None):
+        """Переопределяет лимиты (например, из аргументов командной строки)."""
+        with self._lock:
+            if rpm:
+                self.requests = _Bucket(rpm)
+            if tpm:
+                self.tokens = _Bucket(tpm)
+
+    def _prune(self, now):
+        while self._sent and now - self._sent[0] >= 60:
+            self._sent.popleft()
+        while self._spent and now - self._spent[0][0] >= 60:
+            self._spent.popleft()
+
+    def _wait_time(self, now, tokens):
+        wait = max(0.0, self._blocked_until - now)
+        for bucket, amount in ((self.requests, 1), (self.tokens, tokens)):
+            if bucket:
+                bucket.refill(now)
+                wait = max(wait, bucket.wait_time(amount))
+        return wait
+
+    def acquire(self, tokens=1):
+        """
+        Блокирует поток, пока оба лимита не позволят отправить запрос, и списывает квоту.
+
+        :param tokens: Ожидаемое число токенов запроса.
+        :return: Сколько секунд пришлось ждать.
+        """
+        waited = 0.0
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                wait = self._wait_time(now, tokens)
+                if wait <= 0:
+                    if self.requests:
+                        self.requests.level -= 1
+                    if self.tokens:
+                        self.tokens.level -= min(tokens, self.tokens.capacity)
+                    self._sent.append(now)
+                    self._spent.append((now, tokens))
+                    self._prune(now)
+                    self._total_wait += waited
+                    return waited
+            time.sleep(wait)
+            waited += wait
+
+    def record_tokens(self, estimated, actual):
+        """Корректирует tpm-ведро, когда из usage ответа известно реальное число токенов."""
+        if not actual:
+            return
+        with self._lock:
+            if self.tokens:
+                self.tokens.level -= actual - estimated
+            self._spent.append((time.monotonic(), actual - estimated))
+
+    def on_success(self):
+        with self._lock:
+            self._consecutive_limits = 0
+
+    def on_rate_limited(self, error):
+        """
+        Обрабатывает ответ 429: ставит паузу для всех потоков.
+
+        :return: Длительность паузы в секундах.
+        """
+        headers = getattr(getattr(error, 'response', None), 'headers', None) or {}
+        delay = None
+        if headers.get('retry-after-ms'):
+            delay = parse_duration(headers['retry-after-ms'] + 'ms')
+        if delay is None:
+            delay = parse_duration(headers.get('retry-after'))
+        if delay is None:
+            resets = []
+            for kind in ('requests', 'tokens'):
+                if headers.get(f'x-ratelimit-remaining-{kind}') in ('0', 0):
+                    resets.append(parse_duration(headers.get(f'x-ratelimit-reset-{kind}')))
+            resets = [r for r in resets if r is not None]
+            delay = max(resets) if resets else None
+
+        with self._lock:
+            self._rate_limited += 1
+            self._consecutive_limits += 1
+            if delay is None:
+                delay = min(self.max_backoff, 2 ** self._consecutive_limits) * (0.5 + random.random() / 2)
+            # Сервер считает квоту лучше нас — выравниваем ведра, чтобы не отправлять пачку сразу после паузы
+            if self.requests:
+                self.requests.level = min(self.requests.level, 0)
+            self._blocked_until = max(self._blocked_until, time.monotonic() + delay)
+        return delay
+
+    def metrics(self):
+        """
+        Текущее состояние лимитера.
+
+        :return: Словарь: wait_time — сколько сейчас ждал бы новый запрос, total_wait — суммарное ожидание,
+            rate_limited — число ответов 429, requests_utilisation / tokens_utilisation — доля лимита,
+            израсходованная за последнюю минуту.
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._prune(now)
+            result = {
+                'wait_time': round(self._wait_time(now, 1), 3),
+                'total_wait': round(self._total_wait, 3),
+                'rate_limited': self._rate_limited,
+                'requests_last_minute': len(self._sent),
+                'tokens_last_minute': sum(n for _, n in self._spent),
+            }
+            if self.requests:
+                result['requests_utilisation'] = round(len(self._sent) / self.requests.capacity, 3)
+            if self.tokens:
+                result['tokens_utilisation'] = round(result['tokens_last_minute'] / self.tokens.capacity, 3)
+            return result
+
+
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+
+def get_rate_limiter(name: str) -> RateLimiter:
+    """Возвращает общий лимитер для провайдера name; лимиты читаются из {NAME}_RPM / {NAME}_TPM."""
+    with _limiters_lock:
+        if name not in _limiters:
+            _limiters[name] = RateLimiter.from_env(name.upper())
+        return _limiters[name]
@@ -0,0 +1,164 @@
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS responses (
+    key TEXT PRIMARY KEY,
+    provider TEXT,
+    model TEXT,
+    value TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    created REAL NOT NULL,
+    accessed REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS responses_accessed ON responses(accessed);
+"""
+
+logger = logging.getLogger(__name__)
+
+
+def _jsonable(value):
+    """Приводит параметры запроса к JSON: Pydantic-схемы заменяются их JSON Schema."""
+    if hasattr(value, 'model_json_schema'):
+        return {'schema': value.model_json_schema(), 'name': value.__name__}
+    if isinstance(value, dict):
+        return {k: _jsonable(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_jsonable(v) for v in value]
+    return value
+
+
+def make_key(provider, request):
+    """
+    Ключ кэша: SHA-256 от провайдера и всех параметров запроса
+    (модель, сообщения с полностью подставленным промптом, temperature, response_format и т.д.).
+    """
+    payload = json.dumps({'provider': provider, 'request': _jsonable(request)}, ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+class ResponseCache:
+    """
+    Дисковый кэш ответов LLM на SQLite.
+
+    :param path: Путь к файлу кэша.
+    :param max_entries: Максимальное число записей (None — без ограничения).
+    :param max_bytes: Максимальный суммарный размер ответов в байтах (None — без ограничения).
+    :param ttl: Время жизни записи в секундах (None — бессрочно); просроченные записи считаются промахом.
+    :param read_only: Только читать: новые ответы не сохраняются, время доступа не обновляется.
+                      Если файла кэша еще нет, кэш считается пустым.
+    """
+
+    def __init__(self, path='llm_cache.sqlite', max_entries=None, max_bytes=None, ttl=None, read_only=False):
+        self.path = path
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.read_only = read_only
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+        self.evictions = 0
+        if read_only and not os.path.exists(path):
+            # Кэш еще не создан (например, свежий клон): читать нечего, все запросы — промахи
+            logger.warning(f"Read-only LLM cache {path} does not exist, every request will go to the API")
+            self.conn = sqlite3.connect(":memory:", check_same_thread=False)
+            self.conn.executescript(SCHEMA)
+        elif read_only:
+            self.conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True, check_same_thread=False)
+        else:
+            self.conn = sqlite3.connect(path, check_same_thread=False)
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            self.conn.execute("PRAGMA synchronous=NORMAL")
+            self.conn.executescript(SCHEMA)
+        self._entries, self._bytes = self.conn.execute(
+            "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses").fetchone()
+
+    @classmethod
+    def from_env(cls, path=None, read_only=None, ttl=None):
+        """Создает кэш по переменным LLM_CACHE, LLM_CACHE_MAX_ENTRIES, LLM_CACHE_MAX_MB, LLM_CACHE_TTL, LLM_CACHE_READ_ONLY."""
+        max_entries = os.environ.get('LLM_CACHE_MAX_ENTRIES')
+        max_mb = os.environ.get('LLM_CACHE_MAX_MB')
+        env_ttl = os.environ.get('LLM_CACHE_TTL')
+        return cls(
+            path=path or os.environ.get('LLM_CACHE', 'llm_cache.sqlite'),
+            max_entries=int(max_entries) if max_entries else None,
+            max_bytes=int(float(max_mb) * 1024 * 1024) if max_mb else None,
+            ttl=ttl if ttl is not None else (float(env_ttl) if env_ttl else None),
+            read_only=read_only if read_only is not None else os.environ.get('LLM_CACHE_READ_ONLY') == '1',
+        )
+
+    def get(self, key):
+        """:return: Сохраненный ответ или None."""
+        now = time.time()
+        with self._lock:
+            row = self.conn.execute("SELECT value, created FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None or (self.ttl is not None and now - row[1] > self.ttl):
+                self.misses += 1
+                return None
+            self.hits += 1
+            if not self.read_only:
+                with self.conn:
+                    self.conn.execute("UPDATE responses SET accessed = ? WHERE key = ?", (now, key))
+            return row[0]
+
+    def put(self, key, value, provider=None, model=None):
+        if self.read_only or value is None:
+            return
+        size = len(value.encode('utf-8'))
+        now = time.time()
+        with self._lock, self.conn:
+            old = self.conn.execute("SELECT size FROM responses WHERE key = ?", (key,)).fetchone()
+            self.conn.execute(
+                "INSERT OR REPLACE INTO responses (key, provider, model, value, size, created, accessed) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (key, provider, model, value, size, now, now),
+            )
+            self.writes += 1
+            self._entries += 0 if old else 1
+            self._bytes += size - (old[0] if old else 0)
+            self._evict()
+
+    def _evict(self):
+        over_entries = self.max_entries is not None and self._entries > self.max_entries
+        over_bytes = self.max_bytes is not None and self._bytes > self.max_bytes
+        if not (over_entries or over_bytes):
+            return
+        # Удаляем давно не использованные записи с запасом в 10%, чтобы не вытеснять на каждой записи
+        entries_target = int(self.max_entries * 0.9) if self.max_entries is not None else None
+        bytes_target = self.max_bytes * 0.9 if self.max_bytes is not None else None
+        removed = []
+        entries, total = self._entries, self._bytes
+        for key, size in self.conn.execute("SELECT key, size FROM responses ORDER BY accessed"):
+            if (entries_target is None or entries <= entries_target) and (bytes_target is None or total <= bytes_target):
+                break
+            removed.append((key,))
+            entries -= 1
+            total -= size
+        self.conn.executemany("DELETE FROM responses WHERE key = ?", removed)
+        self.evictions += len(removed)
+        self._entries, self._bytes = entries, total
+
+    def stats(self):
+        """:return: Словарь с числом попаданий, промахов, записей, вытеснений и текущим размером кэша."""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / lookups, 3) if lookups else 0.0,
+                'writes': self.writes,
+                'evictions': self.evictions,
+                'entries': self._entries,
+                'bytes': self._bytes,
+            }
+
+    def close(self):
+        with self._lock:
+            self.conn.close()
@@ -0,0 +1,347 @@
+import contextvars
+import logging
+import os
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from dotenv import load_dotenv
+
+from .base_provider import USAGE_FIELDS, BaseLLMProvider
+from .usage import track_calls
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+STAGES = ('rate', 'summarize', 'annotate')
+
+
+class NoBackendError(RuntimeError):
+    """Для стадии нет ни одного бэкенда с закрытым (или полуоткрытым) выключателем."""
+
+
+class Backend:
+    """
+    Провайдер-бэкенд роутера и наблюдаемая статистика его вызовов.
+
+    Задержка и стоимость вызова сглаживаются EWMA, доля ошибок — тоже. Выключатель (circuit breaker)
+    размыкается после failure_threshold ошибок подряд на cooldown секунд, затем пропускает один
+    пробный вызов: успех замыкает его, ошибка снова размыкает.
+
+    :param name: Имя бэкенда в настройках роутера.
+    :param provider: Экземпляр BaseLLMProvider.
+    :param prompt_price: Цена миллиона токенов промпта (любая валюта, одна для всех бэкендов).
+    :param completion_price: Цена миллиона токенов ответа.
+    """
+
+    # Вес нового наблюдения в EWMA
+    alpha = 0.2
+    # Задержка в секундах, которую score приписывает бэкенду без единого успешного вызова, на единицу доли ошибок
+    failure_penalty = 10.0
+
+    def __init__(self, name, provider, prompt_price=0.0, completion_price=0.0, failure_threshold=3, cooldown=30.0):
+        self.name = name
+        self.provider = provider
+        self.prompt_price = prompt_price
+        self.completion_price = completion_price
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.latency = None
+        self.deviation = 0.0
+        self.error_rate = 0.0
+        self.cost = 0.0
+        self.in_flight = 0
+        self.calls = 0
+        self.errors = 0
+        self._failures = 0
+        self._open_until = 0.0
+        self._trial = False
+        self._lock = threading.Lock()
+
+    def state(self, now=None):
+        """'closed', 'open' или 'half-open'."""
+        if self._failures < self.failure_threshold:
+            return 'closed'
+        return 'open' if (now or time.monotonic()) < self._open_until else 'half-open'
+
+    def available(self, now):
+        return self.state(now) == 'closed' or (self.state(now) == 'half-open' and not self._trial)
+
+    def score(self, cost_weight):
+        """Ожидаемая «цена» вызова: задержка с учетом очереди и ошибок плюс стоимость. Меньше — лучше.
+
+        Новый бэкенд без измерений получает 0, поэтому сначала пробуется. Если же у бэкенда были только
+        ошибки, вместо задержки берется failure_penalty * error_rate, и он уходит за рабочие бэкенды,
+        а не пробуется первым при каждом вызове до размыкания выключателя и после каждого cooldown.
+        """
+        latency = self.latency if self.latency is not None else self.failure_penalty * self.error_rate
+        latency *= (1 + self.in_flight) * (1 + 4 * self.error_rate)
+        return latency + cost_weight * self.cost
+
+    def hedge_delay(self):
+        """Через сколько секунд без ответа дублировать вызов: оценка хвоста latency + 4 * отклонение (как RTO в TCP)."""
+        return None if self.latency is None else self.latency + 4 * self.deviation
+
+    def acquire(self):
+        """Занимает бэкенд для вызова; в полуоткрытом состоянии пропускает только один пробный вызов."""
+        with self._lock:
+            state = self.state()
+            if state == 'open' or (state == 'half-open' and self._trial):
+                return False
+            self._trial = state == 'half-open'
+            self.in_flight += 1
+            return True
+
+    def release(self, ok, latency=None, usage=None):
+        """
+        Учитывает результат вызова.
+
+        :param latency: Время вызова; None — ответ из кэша, задержка не учитывается.
+        :param usage: Накопитель providers.usage с токенами вызова.
+        """
+        with self._lock:
+            self.in_flight -= 1
+            self._trial = False
+            self.calls += 1
+            self.error_rate += self.alpha * ((0.0 if ok else 1.0) - self.error_rate)
+            if not ok:
+                self.errors += 1
+                self._failures += 1
+                if self._failures >= self.failure_threshold:
+                    self._open_until = time.monotonic() + self.cooldown
+                    logger.warning(f"Router backend '{self.name}' is open for {self.cooldown:.0f}s "
+                                   f"after {self._failures} failures in a row")
+                return
+            if self._failures >= self.failure_threshold:
+                logger.info(f"Router backend '{self.name}' is closed again")
+            self._failures = 0
+            if latency is not None:
+                if self.latency is None:
+                    self.latency, self.deviation = latency, latency / 2
+                else:
+                    self.deviation += self.alpha * (abs(latency - self.latency) - self.deviation)
+                    self.latency += self.alpha * (latency - self.latency)
+            if usage is not None and usage['calls']:
+                cost = (usage['prompt_tokens'] * self.prompt_price
+                        + usage['completion_tokens'] * self.completion_price) / 1e6
+                self.cost += self.alpha * (cost - self.cost)
+
+    def metrics(self):
+        return {
+            'state': self.state(), 'calls': self.calls, 'errors': self.errors, 'in_flight': self.in_flight,
+            'latency': self.latency, 'error_rate': self.error_rate, 'cost': self.cost,
+        }
+
+
+class BackendLimiters:
+    """
+    Лимитеры бэкендов роутера под интерфейсом RateLimiter, который использует main.py (configure, metrics).
+
+    Бэкенды одного провайдера делят лимитер (см. rate_limiter.get_rate_limiter), поэтому каждый
+    лимитер настраивается один раз, а лимиты --rpm / --tpm действуют на каждый API отдельно.
+
+    :param limiters: Список пар (имена бэкендов, RateLimiter).
+    """
+
+    def __init__(self, limiters):
+        self.limiters = limiters
+
+    def configure(self, rpm=None, tpm=None):
+        for _, limiter in self.limiters:
+            limiter.configure(rpm=rpm, tpm=tpm)
+
+    def metrics(self):
+        return {", ".join(names): limiter.metrics() for names, limiter in self.limiters}
+
+
+def _shared(name):
+    """Атрибут роутера, который на самом деле хранится у всех бэкендов (кэш, размер пакетов)."""
+    def get(self):
+        return getattr(self.backends[0].provider, name)
+
+    def set(self, value):
+        for backend in self.backends:
+            setattr(backend.provider, name, value)
+
+    return property(get, set)
+
+
+class RouterProvider(BaseLLMProvider):
+    """
+    Провайдер, который распределяет вызовы между несколькими бэкендами (BaseLLMProvider).
+
+    Для каждой стадии (rate, summarize, annotate) задается свой список бэкендов, например дешевая
+    модель для rate и summarize и сильная для annotate. Вызов уходит бэкенду с наименьшей оценкой
+    Backend.score: сглаженная задержка с поправкой на очередь и долю ошибок плюс cost_weight * стоимость вызова.
+    Ошибка бэкенда не роняет строку: вызов повторяется на следующем бэкенде стадии, а бэкенд после
+    нескольких ошибок подряд выключается на время (circuit breaker).
+
+    Если hedge включен и бэкенд не ответил за оценку хвоста своей задержки (Backend.hedge_delay),
+    тот же вызов дублируется на следующий бэкенд и берется первый ответ. Вызовы идут в потоках роутера
+    с копией contextvars вызывающего потока, поэтому usage попадает в стадию FillEngine (см. providers.usage),
+    включая usage проигравшего дубля, если он успел ответить до конца стадии.
+
+    :param backends: Список Backend.
+    :param stages: Словарь {стадия: [имена бэкендов в порядке предпочтения]}; стадии без записи используют все бэкенды.
+    :param hedge: Дублировать медленные вызовы.
+    :param cost_weight: Сколько секунд задержки стоит единица цены (см. Backend.prompt_price); 0 — не учитывать цену.
+    :param max_workers: Число потоков роутера (одновременных вызовов с учетом дублей).
+    """
+    name = "router"
+
+    cache = _shared('cache')
+    batch_size = _shared('batch_size')
+    batch_tokens = _shared('batch_tokens')
+
+    def __init__(self, backends=None, stages=None, hedge=True, cost_weight=0.0, backend_retries=1, max_workers=32):
+        if backends is None:
+            backends, stages, hedge, cost_weight = self._from_env()
+        if not backends:
+            raise ValueError("RouterProvider needs at least one backend (ROUTER_BACKENDS)")
+        self.backends = backends
+        by_name = {backend.name: backend for backend in backends}
+        self.routes = {stage: [by_name[name] for name in (stages or {}).get(stage, by_name)] for stage in STAGES}
+        self.hedge = hedge
+        self.cost_weight = cost_weight
+        self.hedges = 0
+        # Повторы внутри бэкенда короткие: дальше выручает другой бэкенд
+        for backend in backends:
+            backend.provider.max_retries = backend_retries
+        self.model = ", ".join(dict.fromkeys(backend.provider.model for backend in backends))
+        limiters = {}
+        for backend in backends:
+            limiter = backend.provider.limiter
+            if limiter is not None:
+                limiters.setdefault(id(limiter), ([], limiter))[0].append(backend.name)
+        # Лимиты из командной строки передаются лимитерам бэкендов
+        self.limiter = BackendLimiters(list(limiters.values())) if limiters else None
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='router')
+
+    @staticmethod
+    def _from_env():
+        """
+        Читает настройки из .env:
+
+        ROUTER_BACKENDS="mini=structured_openai:gpt-4o-mini, big=structured_openai:gpt-4o, gem=gemini"
+        ROUTER_STAGES="rate=mini; summarize=mini; annotate=big,gem"
+        ROUTER_<ИМЯ>_BASE_URL, ROUTER_<ИМЯ>_API_KEY, ROUTER_<ИМЯ>_PRICE="0.15,0.60" (за миллион токенов промпта и ответа)
+        ROUTER_HEDGE=0 выключает дублирование, ROUTER_COST_WEIGHT — вес цены.
+        """
+        from . import get_provider
+
+        backends = []
+        for spec in filter(None, (item.strip() for item in os.environ.get("ROUTER_BACKENDS", "").split(","))):
+            name, _, target = spec.partition("=")
+            provider_name, _, model = target.strip().partition(":")
+            prefix = f"ROUTER_{name.strip().upper()}_"
+            options = {"model": model or None, "base_url": os.environ.get(prefix + "BASE_URL"),
+                       "api_key": os.environ.get(prefix + "API_KEY")}
+            provider = get_provider(provider_name, **{k: v for k, v in options.items() if v})
+            prices = [float(price) for price in os.environ.get(prefix + "PRICE", "0,0").split(",")]
+            backends.append(Backend(name.strip(), provider, *prices))
+        stages = {}
+        for spec in filter(None, (item.strip() for item in os.environ.get("ROUTER_STAGES", "").split(";"))):
+            stage, _, names = spec.partition("=")
+            stages[stage.strip()] = [name.strip() for name in names.split(",") if name.strip()]
+        hedge = os.environ.get("ROUTER_HEDGE", "1").lower() not in ("0", "false", "no")
+        return backends, stages, hedge, float(os.environ.get("ROUTER_COST_WEIGHT", 0))
+
+    def _candidates(self, stage):
+        now = time.monotonic()
+        candidates = [backend for backend in self.routes[stage] if backend.available(now)]
+        return sorted(candidates, key=lambda backend: (backend.score(self.cost_weight), backend.in_flight))
+
+    def _attempt(self, backend, method, args):
+        started = time.perf_counter()
+        try:
+            with track_calls() as usage:
+                result = getattr(backend.provider, method)(*args)
+        except Exception:
+            backend.release(False)
+            raise
+        backend.release(True, time.perf_counter() - started if usage['calls'] else None, usage)
+        return result
+
+    def _route(self, stage, method, *args):
+        """
+        Вызывает метод бэкенда стадии с переключением на следующий бэкенд при ошибке и дублированием медленных вызовов.
+
+        :raises NoBackendError: Если для стадии нет доступных бэкендов.
+        :return: Первый успешный результат; если ошиблись все бэкенды — исключение последнего.
+        """
+        queue = self._candidates(stage)
+        pending = {}
+        errors = []
+        hedged = False
+
+        def launch():
+            while queue:
+                backend = queue.pop(0)
+                if backend.acquire():
+                    context = contextvars.copy_context()
+                    pending[self._executor.submit(context.run, self._attempt, backend, method, args)] = backend
+                    return backend
+            return None
+
+        if launch() is None:
+            raise NoBackendError(f"No router backend is available for stage '{stage}'")
+        while pending:
+            timeout = None
+            if self.hedge and not hedged and queue and len(pending) == 1:
+                timeout = next(iter(pending.values())).hedge_delay()
+            done, _ = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+            if not done:
+                hedged = True
+                backend = launch()
+                if backend is not None:
+                    self.hedges += 1
+                    logger.debug(f"Hedging '{stage}' call on router backend '{backend.name}'")
+                continue
+            for future in done:
+                backend = pending.pop(future)
+                try:
+                    return future.result()
+                except Exception as e:
+                    logger.warning(f"Router backend '{backend.name}' failed on '{stage}': {e}")
+                    errors.append(e)
+            if not pending:
+                launch()
+        raise errors[-1]
+
+    def stage_request(self, stage, text):
+        raise NotImplementedError("RouterProvider does not support batch jobs, use one of its backends")
+
+    def summarize(self, input_text) -> str:
+        """Returns summary of input text"""
+        return self._route('summarize', 'summarize', input_text)
+
+    def annotate(self, input_text) -> str:
+        """Returns annotated text in the Entry format, см. BaseLLMProvider.annotate."""
+        return self._route('annotate', 'annotate', input_text)
+
+    def annotate_many(self, texts):
+        """annotate() для списка текстов одним вызовом бэкенда (он сам упаковывает тексты в запросы)."""
+        return self._route('annotate', 'annotate_many', texts)
+
+    def rate(self, input_text) -> str:
+        """Оценивает текст для обучения NER, см. BaseLLMProvider.rate."""
+        return self._route('rate', 'rate', input_text)
+
+    def rate_many(self, texts):
+        """rate() для списка текстов одним вызовом бэкенда."""
+        return self._route('rate', 'rate_many', texts)
+
+    def usage_stats(self):
+        """Сумма счетчиков токенов бэкендов, см. BaseLLMProvider.usage_stats."""
+        stats = dict.fromkeys(USAGE_FIELDS, 0)
+        for backend in self.backends:
+            for name, value in backend.provider.usage_stats().items():
+                if name in stats:
+                    stats[name] += value
+        stats['cached_share'] = stats['cached_tokens'] / stats['prompt_tokens'] if stats['prompt_tokens'] else 0.0
+        return stats
+
+    def metrics(self):
+        """Статистика бэкендов: состояние выключателя, вызовы, ошибки, EWMA задержки, доли ошибок и стоимости."""
+        return {'hedges': self.hedges, 'backends': {backend.name: backend.metrics() for backend in self.backends}}
@@ -0,0 +1,44 @@
+# Схемы ответов для structured output и constrained decoding. Строятся один раз при импорте
+from pydantic import BaseModel
+from typing import List, Literal
+
+
+class Entity(BaseModel):
+    entity: str
+    types: List[str]
+
+
+class Entry(BaseModel):
+    text: str
+    entities: List[Entity]
+
+
+class RatingResponse(BaseModel):
+    reasoning_behind_score: str
+    score: Literal["Excellent", "Good", "Average", "Poor", "Unusable"]
+
+
+# Схемы пакетных запросов: по элементу на текст, id — номер текста в пакете.
+# Текст в ответе не повторяется, его подставляем сами
+class BatchEntry(BaseModel):
+    id: int
+    entities: List[Entity]
+
+
+class EntryBatch(BaseModel):
+    items: List[BatchEntry]
+
+
+class BatchRating(BaseModel):
+    id: int
+    reasoning_behind_score: str
+    score: Literal["Excellent", "Good", "Average", "Poor", "Unusable"]
+
+
+class RatingBatch(BaseModel):
+    items: List[BatchRating]
+
+
+# Только сущности, без копии текста: текст подставляем сами, а модель не тратит на него токены
+class EntityList(BaseModel):
+    entities: List[Entity]
@@ -0,0 +1,118 @@
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+# Поля учета одного вызова или суммы вызовов
+FIELDS = ('calls', 'prompt_tokens', 'completion_tokens', 'cached_tokens', 'latency')
+
+# (стадия, накопители) текущего контекста: usage вызовов провайдеров пишется во все накопители
+_stage = ContextVar('llm_stage', default=(None, ()))
+
+
+def new_usage(model=None):
+    usage = dict.fromkeys(FIELDS, 0)
+    usage['latency'] = 0.0
+    usage['model'] = model
+    return usage
+
+
+def add_usage(total, part):
+    """Прибавляет usage part к total (на месте). Модель берется из part, если в total ее еще нет."""
+    for name in FIELDS:
+        total[name] += part.get(name) or 0
+    if part.get('model') and not total.get('model'):
+        total['model'] = part['model']
+    return total
+
+
+def split_usage(usage, parts):
+    """Делит usage пакетного вызова поровну между parts строками (calls и latency — дробные доли)."""
+    share = new_usage(usage.get('model'))
+    for name in FIELDS:
+        share[name] = usage[name] / parts if name in ('calls', 'latency') else round(usage[name] / parts)
+    return share
+
+
+@contextmanager
+def track_stage(stage):
+    """
+    Собирает usage всех вызовов провайдера внутри блока (в этом потоке и в скопированных контекстах).
+
+    :return: Накопитель — словарь new_usage(), заполняется по мере вызовов.
+    """
+    accumulator = new_usage()
+    token = _stage.set((stage, (accumulator,)))
+    try:
+        yield accumulator
+    finally:
+        _stage.reset(token)
+
+
+@contextmanager
+def track_calls():
+    """
+    Как track_stage, но не меняет текущую стадию и не отнимает вызовы у внешних накопителей:
+    usage вызовов внутри блока попадает и в новый накопитель, и в накопители вокруг него.
+
+    :return: Накопитель — словарь new_usage().
+    """
+    accumulator = new_usage()
+    stage, accumulators = _stage.get()
+    token = _stage.set((stage, accumulators + (accumulator,)))
+    try:
+        yield accumulator
+    finally:
+        _stage.reset(token)
+
+
+class UsageTracker:
+    """
+    Учет токенов и задержек по всем провайдерам: суммы по (модель, стадия) с начала работы.
+
+    Вызов внутри track_stage дополнительно попадает в накопитель стадии, через который
+    FillEngine приписывает usage строкам таблицы.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._totals = {}
+
+    def record(self, model, prompt_tokens=0, completion_tokens=0, cached_tokens=0, latency=0.0):
+        usage = {
+            'model': model, 'calls': 1, 'prompt_tokens': prompt_tokens or 0,
+            'completion_tokens': completion_tokens or 0, 'cached_tokens': cached_tokens or 0,
+            'latency': latency or 0.0,
+        }
+        stage, accumulators = _stage.get()
+        with self._lock:
+            add_usage(self._totals.setdefault((model, stage), new_usage(model)), usage)
+            for accumulator in accumulators:
+                add_usage(accumulator, usage)
+
+    def summary(self):
+        """Список сумм по (модель, стадия) со средней задержкой вызова (avg_latency)."""
+        with self._lock:
+            totals = [dict(usage, stage=stage) for (_, stage), usage in self._totals.items()]
+        return [dict(usage, avg_latency=usage['latency'] / usage['calls'] if usage['calls'] else 0.0)
+                for usage in totals]
+
+
+def summarize_rows(row_usages):
+    """
+    Суммирует сохраненный в таблице usage строк по (модель, стадия).
+
+    :param row_usages: Итерируемое из словарей {стадия: usage} (колонка usage хранилища).
+    :return: Список сумм с полями модели, стадии, rows (число строк) и avg_latency.
+    """
+    totals = {}
+    for stages in row_usages:
+        for stage, usage in stages.items():
+            total = totals.setdefault((usage.get('model'), stage), dict(new_usage(usage.get('model')), rows=0))
+            add_usage(total, usage)
+            total['rows'] += 1
+    return [dict(usage, stage=stage, avg_latency=usage['latency'] / usage['calls'] if usage['calls'] else 0.0)
+            for (_, stage), usage in sorted(totals.items(), key=lambda item: (str(item[0][0]), item[0][1]))]
+
+
+# Общий учет процесса
+tracker = UsageTracker()
@@ -0,0 +1,357 @@
+import csv
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+
+from dedup import MinHasher, normalized_hash
+
+# Колонки таблицы в том виде, в каком они были в texts.csv, и соответствующие им колонки SQLite
+COLUMNS = {
+    'full text': 'full_text',
+    'summary': 'summary',
+    'LLM json': 'llm_json',
+    'LLM summary json': 'llm_summary_json',
+    'score_reason': 'score_reason',
+    'score': 'score',
+    'model': 'model',
+    'time': 'time',
+}
+
+# Колонки, появившиеся после первой версии схемы; в старые базы добавляются при открытии
+ADDED_COLUMNS = {
+    'norm_hash': 'TEXT',
+    'source': 'TEXT',
+    'source_offset': 'INTEGER',
+    'metadata': 'TEXT',
+    'usage': 'TEXT',
+    'answer_hash': 'TEXT',
+}
+
+# Условие завершенной строки: заполнены все колонки таблицы
+COMPLETE = " AND ".join(f"{column} IS NOT NULL" for column in COLUMNS.values())
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS texts (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    hash TEXT NOT NULL UNIQUE,
+    norm_hash TEXT,
+    source TEXT,
+    source_offset INTEGER,
+    metadata TEXT,
+    -- JSON {стадия: usage} с токенами и задержкой вызовов модели (см. providers.usage)
+    usage TEXT,
+    -- SHA-256 ответов llm_json и llm_summary_json завершенной строки (см. answer_hash); NULL, пока строка не завершена
+    answer_hash TEXT,
+    full_text TEXT NOT NULL,
+    summary TEXT,
+    llm_json TEXT,
+    llm_summary_json TEXT,
+    score_reason TEXT,
+    score TEXT,
+    model TEXT,
+    time TEXT
+);
+-- time заполняется последним, поэтому строки без time — это незавершенная работа
+CREATE INDEX IF NOT EXISTS texts_pending ON texts(id) WHERE time IS NULL;
+-- MinHash-сигнатуры и корзины LSH для поиска почти-дубликатов
+CREATE TABLE IF NOT EXISTS minhash (
+    text_id INTEGER PRIMARY KEY,
+    signature BLOB NOT NULL
+);
+CREATE TABLE IF NOT EXISTS lsh_buckets (
+    band INTEGER NOT NULL,
+    bucket TEXT NOT NULL,
+    text_id INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS lsh_buckets_key ON lsh_buckets(band, bucket);
+"""
+
+
+def content_hash(text):
+    """SHA-256 от текста, ключ строки в хранилище."""
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+def answer_hash(llm_json, summary_json):
+    """SHA-256 пары ответов разметки; по нему инкрементальный экспорт находит изменившиеся строки."""
+    return hashlib.sha256(f"{llm_json}\0{summary_json}".encode('utf-8')).hexdigest()
+
+
+def _is_missing(value):
+    return value is None or str(value) in ('', 'nan', 'NaN')
+
+
+class ResultStore:
+    """
+    Хранилище текстов и ответов LLM на SQLite в режиме WAL.
+
+    Каждая строка адресуется по id (порядок добавления) и по хэшу текста. Результат
+    каждой стадии записывается отдельным UPDATE одной строки, поэтому запись не
+    зависит от размера таблицы, а при падении процесса теряется максимум одна стадия.
+
+    :param path: Путь к файлу базы данных.
+    """
+
+    def __init__(self, path='texts.sqlite'):
+        self.path = path
+        self._lock = threading.RLock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.create_function('answer_hash', 2, answer_hash, deterministic=True)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(SCHEMA)
+        self._migrate()
+        self.minhasher = MinHasher()
+        # Строки с id не больше этого уже проиндексированы для поиска почти-дубликатов
+        self._minhash_indexed = 0
+
+    def _migrate(self):
+        columns = {row[1] for row in self.conn.execute("PRAGMA table_info(texts)")}
+        with self.conn:
+            for name, column_type in ADDED_COLUMNS.items():
+                if name not in columns:
+                    self.conn.execute(f"ALTER TABLE texts ADD COLUMN {name} {column_type}")
+            # Заполняем хэш нормализованного текста у строк, добавленных до его появления
+            rows = self.conn.execute("SELECT id, full_text FROM texts WHERE norm_hash IS NULL").fetchall()
+            self.conn.executemany(
+                "UPDATE texts SET norm_hash = ? WHERE id = ?",
+                ((normalized_hash(text), row_id) for row_id, text in rows),
+            )
+            self.conn.execute("CREATE INDEX IF NOT EXISTS texts_norm_hash ON texts(norm_hash)")
+            # Хэш ответов у строк, завершенных до его появления (считается один раз)
+            self.conn.execute(
+                f"UPDATE texts SET answer_hash = answer_hash(llm_json, llm_summary_json) "
+                f"WHERE answer_hash IS NULL AND {COMPLETE}")
+            # Ключи и хэши ответов завершенных строк: экспорт сравнивает их с манифестом, не читая самих ответов
+            self.conn.execute(
+                "CREATE INDEX IF NOT EXISTS texts_answers ON texts(hash, answer_hash) WHERE answer_hash IS NOT NULL")
+
+    def close(self):
+        with self._lock:
+            self.conn.close()
+
+    def __len__(self):
+        with self._lock:
+            return self.conn.execute("SELECT COUNT(*) FROM texts").fetchone()[0]
+
+    def _row_to_dict(self, row):
+        return {name: value for name, value in zip(COLUMNS, row)}
+
+    def add_texts(self, texts, near_duplicates=False, threshold=0.8):
+        """
+        Добавляет тексты, которых еще нет в хранилище.
+
+        Точные дубликаты (с точностью до регистра и пробелов) отсекаются по индексу norm_hash.
+        С near_duplicates=True дополнительно отсекаются перепосты с небольшими правками:
+        кандидаты ищутся по корзинам LSH, а сходство оценивается по MinHash-сигнатурам.
+
+        :param texts: Итерируемое из строк или SourceItem (тогда сохраняются источник, смещение и метаданные).
+        :param near_duplicates: Искать почти-дубликаты.
+        :param threshold: Минимальное сходство Жаккара, при котором текст считается почти-дубликатом.
+        :return: Словарь со счетчиками added, duplicates, near_duplicates.
+        """
+        stats = {'added': 0, 'duplicates': 0, 'near_duplicates': 0}
+        with self._lock, self.conn:
+            if near_duplicates:
+                self._index_minhash()
+            for item in texts:
+                if isinstance(item, str):
+                    text, source, offset, metadata = item, None, None, None
+                else:
+                    text, source, offset = item.text, item.source_id, item.offset
+                    metadata = json.dumps(item.metadata, ensure_ascii=False) if item.metadata else None
+                norm = normalized_hash(text)
+                if self.conn.execute("SELECT 1 FROM texts WHERE norm_hash = ? LIMIT 1", (norm,)).fetchone():
+                    stats['duplicates'] += 1
+                    continue
+                signature = None
+                if near_duplicates:
+                    signature = self.minhasher.signature(text)
+                    if self._find_near_duplicate(signature, threshold) is not None:
+                        stats['near_duplicates'] += 1
+                        continue
+                cursor = self.conn.execute(
+                    "INSERT OR IGNORE INTO texts (hash, norm_hash, source, source_offset, metadata, full_text) "
+                    "VALUES (?, ?, ?, ?, ?, ?)",
+                    (content_hash(text), norm, source, offset, metadata, text),
+                )
+                if not cursor.rowcount:
+                    stats['duplicates'] += 1
+                    continue
+                if signature is not None:
+                    self._add_minhash(cursor.lastrowid, signature)
+                    self._minhash_indexed = cursor.lastrowid
+                stats['added'] += 1
+        return stats
+
+    def _add_minhash(self, text_id, signature):
+        self.conn.execute(
+            "INSERT OR REPLACE INTO minhash (text_id, signature) VALUES (?, ?)",
+            (text_id, self.minhasher.pack(signature)),
+        )
+        self.conn.executemany(
+            "INSERT INTO lsh_buckets (band, bucket, text_id) VALUES (?, ?, ?)",
+            ((band, bucket, text_id) for band, bucket in self.minhasher.band_keys(signature)),
+        )
+
+    def _index_minhash(self):
+        """
+        Строит сигнатуры для строк, добавленных без поиска почти-дубликатов.
+
+        Просматриваются только строки новее отметки _minhash_indexed, поэтому таблица целиком
+        проходится один раз на экземпляр хранилища, а не при каждом вызове add_texts.
+        """
+        rows = self.conn.execute(
+            "SELECT t.id, t.full_text FROM texts t LEFT JOIN minhash m ON m.text_id = t.id "
+            "WHERE t.id > ? AND m.text_id IS NULL",
+            (self._minhash_indexed,),
+        ).fetchall()
+        for row_id, text in rows:
+            self._add_minhash(row_id, self.minhasher.signature(text))
+        self._minhash_indexed = self.conn.execute("SELECT COALESCE(MAX(id), 0) FROM texts").fetchone()[0]
+
+    def _find_near_duplicate(self, signature, threshold):
+        candidates = set()
+        for band, bucket in self.minhasher.band_keys(signature):
+            candidates.update(row[0] for row in self.conn.execute(
+                "SELECT text_id FROM lsh_buckets WHERE band = ? AND bucket = ?", (band, bucket)))
+        for text_id in candidates:
+            blob = self.conn.execute("SELECT signature FROM minhash WHERE text_id = ?", (text_id,)).fetchone()
+            if blob and self.minhasher.similarity(signature, self.minhasher.unpack(blob[0])) >= threshold:
+                return text_id
+        return None
+
+    def update(self, row_id, values):
+        """
+        Записывает значения колонок одной строки.
+
+        :param row_id: id строки.
+        :param values: Словарь {имя колонки как в texts.csv: значение}.
+        """
+        assignments = ", ".join(f"{COLUMNS[name]} = ?" for name in values)
+        with self._lock, self.conn:
+            self.conn.execute(
+                f"UPDATE texts SET {assignments} WHERE id = ?",
+                [*(None if _is_missing(v) else str(v) for v in values.values()), row_id],
+            )
+            self._update_answer_hash("id = ?", row_id)
+
+    def _update_answer_hash(self, where, value):
+        # Отдельным UPDATE: в SET одного запроса видны старые значения колонок.
+        # Хэш считается только у завершенной строки, то есть на последних стадиях
+        self.conn.execute(
+            f"UPDATE texts SET answer_hash = CASE WHEN {COMPLETE} THEN answer_hash(llm_json, llm_summary_json) END "
+            f"WHERE {where}",
+            (value,),
+        )
+
+    def add_usage(self, row_id, usage):
+        """
+        Дописывает usage стадий к строке; usage той же стадии заменяется.
+
+        :param row_id: id строки.
+        :param usage: Словарь {стадия: usage} (см. providers.usage.new_usage).
+        """
+        with self._lock, self.conn:
+            self.conn.execute(
+                "UPDATE texts SET usage = json_patch(COALESCE(usage, '{}'), ?) WHERE id = ?",
+                (json.dumps(usage), row_id),
+            )
+
+    def iter_usage(self, page_size=500):
+        """
+        Перебирает сохраненный usage строк (для providers.usage.summarize_rows).
+
+        :return: Генератор словарей {стадия: usage}.
+        """
+        last_id = 0
+        while True:
+            with self._lock:
+                rows = self.conn.execute(
+                    "SELECT id, usage FROM texts WHERE usage IS NOT NULL AND id > ? ORDER BY id LIMIT ?",
+                    (last_id, page_size),
+                ).fetchall()
+            if not rows:
+                return
+            for _, usage in rows:
+                yield json.loads(usage)
+            last_id = rows[-1][0]
+
+    def _iter(self, where, page_size):
+        columns = ", ".join(COLUMNS.values())
+        last_id = 0
+        while True:
+            with self._lock:
+                rows = self.conn.execute(
+                    f"SELECT id, {columns} FROM texts WHERE {where} AND id > ? ORDER BY id LIMIT ?",
+                    (last_id, page_size),
+                ).fetchall()
+            if not rows:
+                return
+            for row in rows:
+                yield row[0], self._row_to_dict(row[1:])
+            last_id = rows[-1][0]
+
+    def pending(self, page_size=500):
+        """
+        Возвращает строки, у которых еще не заполнены все стадии (по индексу texts_pending).
+
+        :return: Генератор пар (id, словарь колонок); пустые ячейки — None.
+        """
+        return self._iter("time IS NULL", page_size)
+
+    def iter_rows(self, complete=False, page_size=500):
+        """
+        Постранично перебирает строки хранилища в порядке добавления.
+
+        :param complete: Только строки, в которых заполнены все колонки.
+        :return: Генератор пар (id, словарь колонок).
+        """
+        return self._iter(COMPLETE if complete else "1", page_size)
+
+    def import_csv(self, file_path='texts.csv'):
+        """
+        Импортирует старую таблицу texts.csv. Уже заполненные в хранилище ячейки не перезаписываются.
+
+        :return: Число прочитанных строк.
+        """
+        columns = list(COLUMNS.values())
+        placeholders = ", ".join("?" for _ in columns)
+        merge = ", ".join(f"{c} = COALESCE(texts.{c}, excluded.{c})" for c in columns[1:])
+        count = 0
+        # Ответы LLM бывают длиннее стандартного лимита поля модуля csv (128 КБ)
+        csv.field_size_limit(2**31 - 1)
+        with open(file_path, 'r', encoding='utf-8', newline='') as f, self._lock, self.conn:
+            for record in csv.DictReader(f):
+                text = record.get('full text')
+                if _is_missing(text):
+                    continue
+                values = [None if _is_missing(record.get(name)) else record[name] for name in COLUMNS]
+                self.conn.execute(
+                    f"INSERT INTO texts (hash, norm_hash, {', '.join(columns)}) VALUES (?, ?, {placeholders}) "
+                    f"ON CONFLICT(hash) DO UPDATE SET {merge}",
+                    [content_hash(text), normalized_hash(text), *values],
+                )
+                self._update_answer_hash("hash = ?", content_hash(text))
+                count += 1
+        return count
+
+    def export_csv(self, file_path='texts.csv'):
+        """
+        Выгружает хранилище в CSV того же формата, что и старый texts.csv.
+        Файл пишется во временный и затем атомарно подменяется.
+
+        :return: Число выгруженных строк.
+        """
+        tmp_path = file_path + '.tmp'
+        count = 0
+        with open(tmp_path, 'w', encoding='utf-8', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(COLUMNS)
+            for _, row in self.iter_rows():
+                writer.writerow(['' if v is None else v for v in row.values()])
+                count += 1
+        os.replace(tmp_path, file_path)
+        return count